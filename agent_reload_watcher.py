@@ -0,0 +1,88 @@
+import importlib.util
+import os
+import sys
+import threading
+import traceback
+
+DEFAULT_CHECK_SECONDS = 0.5
+
+
+class AgentReloadWatcher(threading.Thread):
+    """
+    Watches the file of an agent module and builds a replacement agent in the background when it changes.
+
+    The bot loop only checks has_new_agent, a plain attribute read, and calls take_new_agent when it is set.
+    The modified file is executed into a fresh module object instead of reloading the one the running agent uses,
+    so the running agent keeps working on its own module while the new one is imported and constructed.
+    The standard library has no file change notifications, so the file is checked on an interval.
+    """
+
+    def __init__(self, agent_module, load_agent, check_seconds=DEFAULT_CHECK_SECONDS):
+        """
+        :param agent_module: The module the running agent was created from
+        :param load_agent: Creates an agent from a module, it is called on this thread
+        :param check_seconds: How often the file is checked for modifications
+        """
+        super().__init__(daemon=True)
+        self.agent_module = agent_module
+        self.load_agent = load_agent
+        self.check_seconds = check_seconds
+        self.module_file = agent_module.__file__
+        self.last_modification_time = os.stat(self.module_file).st_mtime
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.new_agent = None
+        self.new_module = None
+        self.has_new_agent = False
+
+    def run(self):
+        while not self.stop_event.wait(self.check_seconds):
+            try:
+                modification_time = os.stat(self.module_file).st_mtime
+            except OSError:
+                continue  # The file is being replaced
+            if modification_time == self.last_modification_time:
+                continue
+            self.last_modification_time = modification_time
+            print('Reloading Agent: ' + self.module_file)
+            try:
+                module = self.import_module()
+                agent = self.load_agent(module)
+            except Exception:
+                # Keep the running agent, the next modification is tried again
+                traceback.print_exc()
+                continue
+            with self.lock:
+                self.new_module = module
+                self.new_agent = agent
+                self.has_new_agent = True
+
+    def import_module(self):
+        """:return: A new module object with the current contents of the agent file"""
+        # Packages need their search path so their relative imports keep working
+        spec = importlib.util.spec_from_file_location(self.agent_module.__name__, self.module_file,
+                                                      submodule_search_locations=getattr(self.agent_module,
+                                                                                         '__path__', None))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def take_new_agent(self):
+        """
+        Hands over the agent that was built from the modified file.
+        The new module replaces the old one in sys.modules so later imports see it.
+        :return: The new agent, None if there is none
+        """
+        with self.lock:
+            agent = self.new_agent
+            module = self.new_module
+            self.new_agent = None
+            self.new_module = None
+            self.has_new_agent = False
+        if module is not None:
+            sys.modules[module.__name__] = module
+            self.agent_module = module
+        return agent
+
+    def stop(self):
+        self.stop_event.set()
@@ -1,11 +1,15 @@
+import bz2
 import io
+import lzma
 import os
 import struct
+import zlib
 
 import numpy as np
 import time
 import logging
 from bot_code.conversions.input import input_formatter
+from bot_code.conversions.input import vectorized_input_formatter as layout
 
 import gzip
 
@@ -17,16 +21,521 @@ HASHED_NAME_FILE_VERSION = 2
 IS_EVAL_FILE_VERSION = 3
 BATCH_ARRAY_FILE_VERSION = 4
 TIME_ADDITION_FILE_VERSION = 5
+COLUMNAR_FILE_VERSION = 6
+
+GZIP_CODEC = 'gzip'
+BZ2_CODEC = 'bz2'
+LZMA_CODEC = 'lzma'
+DEFAULT_CODEC = GZIP_CODEC
+DEFAULT_COMPRESSION_LEVEL = 9
+CODEC_EXTENSIONS = {GZIP_CODEC: '.gz', BZ2_CODEC: '.bz2', LZMA_CODEC: '.xz'}
+CODEC_MAGIC_BYTES = {GZIP_CODEC: b'\x1f\x8b', BZ2_CODEC: b'BZh', LZMA_CODEC: b'\xfd7zXZ\x00'}
+
+# Columnar files (version 6) start with the same version, hash and is_eval as older files.
+# The rest of the fixed size header describes the frames that follow it.
+# Not '.bin', the older stream files are written as '.bin' before they get their codec extension
+COLUMNAR_EXTENSION = '.scol'
+LEGACY_EXTENSION = '.bin'
+COLUMNAR_MAGIC_BYTES = b'SCOL'
+COLUMNAR_HEADER_FORMAT = '=iQ?3x4siiiqq16x'
+COLUMNAR_HEADER_SIZE = struct.calcsize(COLUMNAR_HEADER_FORMAT)
+COMMON_HEADER_SIZE = struct.calcsize('=iQ?')
+COLUMNAR_FRAME_COUNT_OFFSET = struct.calcsize('=iQ?3x4siii')
+COLUMNAR_BLOCK_FORMAT = '=ii'
+COLUMNAR_BLOCK_HEADER_SIZE = struct.calcsize(COLUMNAR_BLOCK_FORMAT)
+COLUMNAR_READ_FRAMES = 1000
+DEFAULT_BATCH_ROWS = 1000
+UNKNOWN_FRAME_COUNT = -1
+# The footer of a columnar file indexes every block so single blocks can be read without the rest
+COLUMNAR_INDEX_MAGIC_BYTES = b'SIDX'
+COLUMNAR_INDEX_FORMAT = '=4sii'
+COLUMNAR_TRAILER_FORMAT = '=q4s'
+COLUMNAR_TRAILER_SIZE = struct.calcsize(COLUMNAR_TRAILER_FORMAT)
+# The index keeps the min and max of these state columns for every block
+INDEX_KEY_COLUMNS = [layout.PASSED_TIME_INDEX, layout.DIFF_IN_SCORE_INDEX,
+                     layout.PLAYER_CAR_START, layout.PLAYER_CAR_START + 1, layout.PLAYER_CAR_START + 2,
+                     layout.BALL_INFO_START, layout.BALL_INFO_START + 1, layout.BALL_INFO_START + 2]
+CONTROLLER_DIM = 8
+# None writes the frames uncompressed so the file can be memory mapped
+BLOCK_CODEC_IDS = {None: 0, GZIP_CODEC: 1, BZ2_CODEC: 2, LZMA_CODEC: 3}
+BLOCK_CODEC_NAMES = {codec_id: codec for codec, codec_id in BLOCK_CODEC_IDS.items()}
+REPLAY_EXTENSIONS = list(CODEC_EXTENSIONS.values()) + [COLUMNAR_EXTENSION]
 
 
 def get_latest_file_version():
+    return COLUMNAR_FILE_VERSION
+
+def get_recording_file_version():
+    """
+    The version replays are recorded and uploaded as.
+    Older trainers and the server can not read columnar replays, so recording them is opt in.
+    """
     return TIME_ADDITION_FILE_VERSION
 
+def is_readable_file_version(file_version):
+    """Replays older than version 4 have a state layout nothing in the tree knows, they can not be read"""
+    return file_version >= BATCH_ARRAY_FILE_VERSION
+
 def get_state_dim(file_version):
-    if file_version == 4:
+    if not is_readable_file_version(file_version):
+        raise ValueError('replays of version ' + str(file_version) + ' can not be read, only version ' +
+                         str(BATCH_ARRAY_FILE_VERSION) + ' and newer')
+    if file_version == BATCH_ARRAY_FILE_VERSION:
         return 206
-    elif file_version is get_latest_file_version():
-        return input_formatter.get_state_dim()
+    return input_formatter.get_state_dim()
+
+def get_codec_extension(codec=DEFAULT_CODEC):
+    return CODEC_EXTENSIONS[codec]
+
+
+def open_compressed_file(file, codec=DEFAULT_CODEC, compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """
+    Opens a replay file for writing that compresses everything written to it as it is written.
+    :param file: A file name or a binary file-like object the compressed bytes are written to
+    :param codec: One of the *_CODEC constants
+    :param compression_level: The compression level passed to the codec, 0-9
+    :return: A file object that the write_* functions can write to
+    """
+    if codec == GZIP_CODEC:
+        if isinstance(file, str):
+            return gzip.open(file, 'wb', compresslevel=compression_level)
+        return gzip.GzipFile(fileobj=file, mode='wb', compresslevel=compression_level)
+    elif codec == BZ2_CODEC:
+        return bz2.BZ2File(file, 'wb', compresslevel=max(compression_level, 1))
+    elif codec == LZMA_CODEC:
+        return lzma.LZMAFile(file, 'wb', preset=compression_level)
+    raise ValueError('unknown replay codec: ' + str(codec))
+
+
+def get_file_codec(file):
+    """
+    Detects the codec of a compressed replay from its first bytes.
+    :param file: A binary file-like object, its position is restored afterwards
+    :return: One of the *_CODEC constants, defaults to gzip if nothing matches.
+        None for columnar files, they are not compressed as a whole
+    """
+    position = file.tell()
+    header = file.read(COMMON_HEADER_SIZE + 3 + len(COLUMNAR_MAGIC_BYTES))
+    file.seek(position, os.SEEK_SET)
+    if is_columnar_header(header):
+        return None
+    for codec, magic_bytes in CODEC_MAGIC_BYTES.items():
+        if header.startswith(magic_bytes):
+            return codec
+    return GZIP_CODEC
+
+
+def open_decompressed_file(file):
+    """
+    Opens a compressed replay for reading regardless of which codec it was written with.
+    :param file: A file name or a binary file-like object
+    :return: A file object that read_data can read from
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as raw_file:
+            codec = get_file_codec(raw_file)
+    else:
+        codec = get_file_codec(file)
+    if codec is None:
+        return open(file, 'rb') if isinstance(file, str) else file
+    if codec == BZ2_CODEC:
+        return bz2.BZ2File(file, 'rb')
+    elif codec == LZMA_CODEC:
+        return lzma.LZMAFile(file, 'rb')
+    if isinstance(file, str):
+        return gzip.open(file, 'rb')
+    return gzip.GzipFile(fileobj=file, mode='rb')
+
+
+def is_columnar_header(header):
+    start = COMMON_HEADER_SIZE + 3
+    return (len(header) >= start + len(COLUMNAR_MAGIC_BYTES) and
+            struct.unpack('=i', header[:4])[0] == COLUMNAR_FILE_VERSION and
+            header[start:start + len(COLUMNAR_MAGIC_BYTES)] == COLUMNAR_MAGIC_BYTES)
+
+
+class ColumnarHeader:
+    """The fixed size header at the start of every columnar file"""
+
+    def __init__(self, hashed_name=0, is_eval=False, state_dim=None, controller_dim=CONTROLLER_DIM,
+                 codec=None, frame_count=UNKNOWN_FRAME_COUNT, index_offset=0):
+        self.hashed_name = hashed_name
+        self.is_eval = is_eval
+        self.state_dim = state_dim if state_dim is not None else input_formatter.get_state_dim()
+        self.controller_dim = controller_dim
+        self.codec = codec
+        self.frame_count = frame_count
+        self.index_offset = index_offset
+
+    def get_frame_size(self):
+        """:return: The number of floats in a single frame, the state followed by the controls"""
+        return self.state_dim + self.controller_dim
+
+    def pack(self):
+        return struct.pack(COLUMNAR_HEADER_FORMAT, COLUMNAR_FILE_VERSION, self.hashed_name, self.is_eval,
+                           COLUMNAR_MAGIC_BYTES, self.state_dim, self.controller_dim, BLOCK_CODEC_IDS[self.codec],
+                           self.frame_count, self.index_offset)
+
+    @staticmethod
+    def unpack(header_bytes):
+        (file_version, hashed_name, is_eval, magic_bytes, state_dim, controller_dim, codec_id,
+         frame_count, index_offset) = struct.unpack(COLUMNAR_HEADER_FORMAT, header_bytes)
+        if file_version != COLUMNAR_FILE_VERSION or magic_bytes != COLUMNAR_MAGIC_BYTES:
+            raise ValueError('not a columnar replay')
+        return ColumnarHeader(hashed_name, is_eval, state_dim, controller_dim, BLOCK_CODEC_NAMES[codec_id],
+                              frame_count, index_offset)
+
+
+def read_columnar_header(file):
+    """
+    Reads the header of a columnar file.
+    :param file: A file positioned at the start of the file
+    :return: A ColumnarHeader, the file is left at the first frame
+    """
+    return ColumnarHeader.unpack(file.read(COLUMNAR_HEADER_SIZE))
+
+
+def read_rest_of_columnar_header(file, hashed_name, is_eval):
+    """
+    Reads the part of the header of a columnar file that comes after what get_file_version reads.
+    :return: A ColumnarHeader, the file is left at the first frame
+    """
+    common_header = struct.pack('=iQ?', COLUMNAR_FILE_VERSION, hashed_name, is_eval)
+    return ColumnarHeader.unpack(common_header + file.read(COLUMNAR_HEADER_SIZE - COMMON_HEADER_SIZE))
+
+
+def compress_block(data, codec, compression_level):
+    if codec == GZIP_CODEC:
+        return zlib.compress(data, compression_level)
+    elif codec == BZ2_CODEC:
+        return bz2.compress(data, max(compression_level, 1))
+    elif codec == LZMA_CODEC:
+        return lzma.compress(data, preset=compression_level)
+    raise ValueError('unknown replay codec: ' + str(codec))
+
+
+def decompress_block(data, codec):
+    if codec == GZIP_CODEC:
+        return zlib.decompress(data)
+    elif codec == BZ2_CODEC:
+        return bz2.decompress(data)
+    elif codec == LZMA_CODEC:
+        return lzma.decompress(data)
+    raise ValueError('unknown replay codec: ' + str(codec))
+
+
+class ColumnarFileWriter:
+    """
+    Writes a columnar replay (file version 6).
+
+    After the fixed size header every frame is stored as float32 values, the state followed by the controls.
+    Without a codec the frames are one contiguous (frames, state_dim + 8) array that
+    open_columnar_memmap maps without parsing anything.
+    With a codec every written block of frames is compressed on its own, behind the number of frames
+    and compressed bytes in it, and an empty block marks the end of the frames.
+
+    Closing the file appends an index of the blocks: where each starts, how many frames it has and the
+    min and max of INDEX_KEY_COLUMNS in it.  The header points at the index, and so does a trailer at the
+    very end of the file in case the header could not be rewritten.
+    """
+
+    def __init__(self, file, hashed_name, is_eval, codec=None, compression_level=DEFAULT_COMPRESSION_LEVEL,
+                 state_dim=None):
+        """
+        :param file: A file name or a binary file-like object,
+            which has to be seekable without a codec so the frame count can be written into the header
+        :param hashed_name: The hash of the model that created the frames
+        :param is_eval: If the model was evaluating
+        :param codec: None for a file that can be memory mapped, else one of the *_CODEC constants
+        :param compression_level: The compression level passed to the codec
+        :param state_dim: The size of a state, the current input formatter size if None
+        """
+        if codec is None and not isinstance(file, str) and not file.seekable():
+            # Without the frame count the frames do not end before the index, nothing marks where they stop
+            raise ValueError('uncompressed columnar replays can only be written to seekable files')
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, 'wb') if self.owns_file else file
+        self.header = ColumnarHeader(hashed_name, is_eval, state_dim, codec=codec)
+        self.compression_level = compression_level
+        self.frame_count = 0
+        self.start = self.file.tell() if self.file.seekable() else 0
+        self.position = COLUMNAR_HEADER_SIZE
+        self.key_columns = [column for column in INDEX_KEY_COLUMNS if column < self.header.state_dim]
+        self.chunk_offsets = []
+        self.chunk_frame_counts = []
+        self.chunk_mins = []
+        self.chunk_maxs = []
+        self.file.write(self.header.pack())
+
+    def write_frames(self, input_array, output_array):
+        """
+        :param input_array: The states, flat or of shape (frames, state_dim)
+        :param output_array: The controls, flat or of shape (frames, 8)
+        """
+        input_array = np.reshape(input_array, (-1, self.header.state_dim))
+        output_array = np.reshape(output_array, (-1, self.header.controller_dim))
+        frames = np.empty((len(input_array), self.header.get_frame_size()), dtype=np.float32)
+        frames[:, :self.header.state_dim] = input_array
+        frames[:, self.header.state_dim:] = output_array
+        if len(frames) == 0:
+            return
+        self.chunk_offsets.append(self.position)
+        self.chunk_frame_counts.append(len(frames))
+        key_values = input_array[:, self.key_columns]
+        self.chunk_mins.append(key_values.min(axis=0))
+        self.chunk_maxs.append(key_values.max(axis=0))
+        data = frames.tobytes()
+        if self.header.codec is not None:
+            data = compress_block(data, self.header.codec, self.compression_level)
+            self.write(struct.pack(COLUMNAR_BLOCK_FORMAT, len(frames), len(data)))
+        self.write(data)
+        self.frame_count += len(frames)
+
+    def write(self, data):
+        self.file.write(data)
+        self.position += len(data)
+
+    def write_index(self):
+        """:return: Where the index starts, relative to the start of the file"""
+        if self.header.codec is not None:
+            self.write(struct.pack(COLUMNAR_BLOCK_FORMAT, 0, 0))
+        index_offset = self.position
+        num_chunks = len(self.chunk_offsets)
+        num_columns = len(self.key_columns)
+        self.write(struct.pack(COLUMNAR_INDEX_FORMAT, COLUMNAR_INDEX_MAGIC_BYTES, num_chunks, num_columns))
+        self.write(np.array(self.key_columns, dtype=np.int32).tobytes())
+        self.write(np.array(self.chunk_offsets, dtype=np.int64).tobytes())
+        self.write(np.array(self.chunk_frame_counts, dtype=np.int64).tobytes())
+        self.write(np.array(self.chunk_mins, dtype=np.float32).reshape(num_chunks, num_columns).tobytes())
+        self.write(np.array(self.chunk_maxs, dtype=np.float32).reshape(num_chunks, num_columns).tobytes())
+        self.write(struct.pack(COLUMNAR_TRAILER_FORMAT, index_offset, COLUMNAR_INDEX_MAGIC_BYTES))
+        return index_offset
+
+    def close(self):
+        """
+        Writes the index and, if the file can seek, the final frame count and index offset into the header.
+        Closes the file if it was opened by the writer.
+        """
+        try:
+            index_offset = self.write_index()
+            if self.file.seekable():
+                end = self.file.tell()
+                self.file.seek(self.start + COLUMNAR_FRAME_COUNT_OFFSET, os.SEEK_SET)
+                self.file.write(struct.pack('=qq', self.frame_count, index_offset))
+                self.file.seek(end, os.SEEK_SET)
+        finally:
+            if self.owns_file:
+                self.file.close()
+
+
+def iter_columnar_blocks(file, header, read_frames=COLUMNAR_READ_FRAMES):
+    """
+    Reads the frames of a columnar file after its header.
+    :param file: A file positioned at the first frame
+    :param header: The ColumnarHeader of the file
+    :param read_frames: How many frames are read at a time from uncompressed files
+    :return: A generator of (input_array, output_array) for each block
+    """
+    frame_size = header.get_frame_size()
+    frame_bytes = frame_size * 4
+    frames_left = header.frame_count
+    while frames_left != 0:
+        if header.codec is None:
+            num_frames = read_frames if frames_left < 0 else min(read_frames, frames_left)
+            data = bytearray(num_frames * frame_bytes)
+            num_frames = file.readinto(data) // frame_bytes
+        else:
+            block_header = file.read(COLUMNAR_BLOCK_HEADER_SIZE)
+            if len(block_header) < COLUMNAR_BLOCK_HEADER_SIZE:
+                break
+            num_frames, num_bytes = struct.unpack(COLUMNAR_BLOCK_FORMAT, block_header)
+            if num_frames == 0:
+                break
+            data = bytearray(decompress_block(file.read(num_bytes), header.codec))
+        if num_frames == 0:
+            break
+        frames = np.frombuffer(data, dtype=np.float32, count=num_frames * frame_size).reshape(num_frames, frame_size)
+        yield frames[:, :header.state_dim], frames[:, header.state_dim:]
+        if frames_left > 0:
+            frames_left -= num_frames
+
+
+class ColumnarReplayReader:
+    """
+    Random access to the blocks (chunks) and frames of a columnar file, using the index in its footer.
+    Only the blocks that are asked for are read and decompressed.
+    Files without an index, because the writer never closed them, are indexed by walking the block headers.
+    """
+
+    def __init__(self, file):
+        """
+        :param file: A file name or a seekable binary file-like object positioned at the start of the replay
+        """
+        self.owns_file = isinstance(file, str)
+        self.file = open(file, 'rb') if self.owns_file else file
+        self.start = self.file.tell()
+        self.header = read_columnar_header(self.file)
+        self.frame_bytes = self.header.get_frame_size() * 4
+        self.key_columns = []
+        self.chunk_mins = None
+        self.chunk_maxs = None
+        self.cached_chunk = None
+        self.cached_frames = None
+        index_offset = self.find_index_offset()
+        if index_offset is not None:
+            self.read_index(index_offset)
+        else:
+            self.scan_chunks()
+        # chunk i holds the frames from chunk_starts[i] up to chunk_starts[i + 1]
+        self.chunk_starts = np.concatenate([[0], np.cumsum(self.chunk_frame_counts)]).astype(np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
+    def find_index_offset(self):
+        if self.header.index_offset > 0:
+            return self.header.index_offset
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() - self.start < COLUMNAR_HEADER_SIZE + COLUMNAR_TRAILER_SIZE:
+            return None
+        self.file.seek(-COLUMNAR_TRAILER_SIZE, os.SEEK_END)
+        index_offset, magic_bytes = struct.unpack(COLUMNAR_TRAILER_FORMAT, self.file.read(COLUMNAR_TRAILER_SIZE))
+        if magic_bytes != COLUMNAR_INDEX_MAGIC_BYTES:
+            return None
+        return index_offset
+
+    def read_index(self, index_offset):
+        self.file.seek(self.start + index_offset, os.SEEK_SET)
+        magic_bytes, num_chunks, num_columns = struct.unpack(
+            COLUMNAR_INDEX_FORMAT, self.file.read(struct.calcsize(COLUMNAR_INDEX_FORMAT)))
+        if magic_bytes != COLUMNAR_INDEX_MAGIC_BYTES:
+            raise ValueError('columnar replay index is corrupt')
+
+        def read_array(dtype, count):
+            return np.frombuffer(self.file.read(count * np.dtype(dtype).itemsize), dtype=dtype)
+
+        self.key_columns = read_array(np.int32, num_columns).tolist()
+        self.chunk_offsets = read_array(np.int64, num_chunks)
+        self.chunk_frame_counts = read_array(np.int64, num_chunks)
+        self.chunk_mins = read_array(np.float32, num_chunks * num_columns).reshape(num_chunks, num_columns)
+        self.chunk_maxs = read_array(np.float32, num_chunks * num_columns).reshape(num_chunks, num_columns)
+
+    def scan_chunks(self):
+        """Builds the offsets and frame counts of the blocks from the frames themselves"""
+        offsets = []
+        frame_counts = []
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell() - self.start
+        if self.header.codec is None:
+            frame_count = (end - COLUMNAR_HEADER_SIZE) // self.frame_bytes
+            if self.header.frame_count != UNKNOWN_FRAME_COUNT:
+                frame_count = min(frame_count, self.header.frame_count)
+            for first_frame in range(0, frame_count, COLUMNAR_READ_FRAMES):
+                offsets.append(COLUMNAR_HEADER_SIZE + first_frame * self.frame_bytes)
+                frame_counts.append(min(COLUMNAR_READ_FRAMES, frame_count - first_frame))
+        else:
+            offset = COLUMNAR_HEADER_SIZE
+            while offset + COLUMNAR_BLOCK_HEADER_SIZE <= end:
+                self.file.seek(self.start + offset, os.SEEK_SET)
+                num_frames, num_bytes = struct.unpack(COLUMNAR_BLOCK_FORMAT,
+                                                      self.file.read(COLUMNAR_BLOCK_HEADER_SIZE))
+                if num_frames == 0 or offset + COLUMNAR_BLOCK_HEADER_SIZE + num_bytes > end:
+                    break
+                offsets.append(offset)
+                frame_counts.append(num_frames)
+                offset += COLUMNAR_BLOCK_HEADER_SIZE + num_bytes
+        self.chunk_offsets = np.array(offsets, dtype=np.int64)
+        self.chunk_frame_counts = np.array(frame_counts, dtype=np.int64)
+
+    def get_chunk_count(self):
+        return len(self.chunk_offsets)
+
+    def get_frame_count(self):
+        return int(self.chunk_starts[-1])
+
+    def read_chunk_frames(self, chunk_index):
+        """:return: The frames of a block as a (frames, state_dim + 8) array"""
+        if chunk_index == self.cached_chunk:
+            return self.cached_frames
+        num_frames = int(self.chunk_frame_counts[chunk_index])
+        self.file.seek(self.start + int(self.chunk_offsets[chunk_index]), os.SEEK_SET)
+        if self.header.codec is None:
+            data = bytearray(num_frames * self.frame_bytes)
+            self.file.readinto(data)
+        else:
+            num_frames, num_bytes = struct.unpack(COLUMNAR_BLOCK_FORMAT, self.file.read(COLUMNAR_BLOCK_HEADER_SIZE))
+            data = bytearray(decompress_block(self.file.read(num_bytes), self.header.codec))
+        frames = np.frombuffer(data, dtype=np.float32).reshape(num_frames, self.header.get_frame_size())
+        # Consecutive windows usually fall into the same block, it is shared so it can not be modified
+        frames.flags.writeable = False
+        self.cached_chunk = chunk_index
+        self.cached_frames = frames
+        return frames
+
+    def split_frames(self, frames):
+        return frames[:, :self.header.state_dim], frames[:, self.header.state_dim:]
+
+    def read_chunk(self, chunk_index):
+        """
+        :param chunk_index: Which block, between 0 and get_chunk_count()
+        :return: A tuple of (input_array, output_array) with the frames of that block, they are read only
+        """
+        return self.split_frames(self.read_chunk_frames(chunk_index))
+
+    def read_frames(self, start, stop):
+        """
+        Reads a range of frames, only the blocks it overlaps are read.
+        :param start: The first frame
+        :param stop: One past the last frame, it is clipped to the number of frames
+        :return: A tuple of (input_array, output_array), they can be read only views of a cached block
+        """
+        stop = min(stop, self.get_frame_count())
+        start = min(max(start, 0), stop)
+        if self.header.codec is None and start < stop:
+            # Uncompressed frames are contiguous, a single read does it
+            first_chunk = np.searchsorted(self.chunk_starts, start, side='right') - 1
+            offset = self.chunk_offsets[first_chunk] + (start - self.chunk_starts[first_chunk]) * self.frame_bytes
+            self.file.seek(self.start + int(offset), os.SEEK_SET)
+            data = bytearray((stop - start) * self.frame_bytes)
+            self.file.readinto(data)
+            return self.split_frames(np.frombuffer(data, dtype=np.float32).reshape(stop - start, -1))
+        parts = []
+        chunk_index = np.searchsorted(self.chunk_starts, start, side='right') - 1
+        while start < stop:
+            chunk_start = int(self.chunk_starts[chunk_index])
+            chunk_stop = int(self.chunk_starts[chunk_index + 1])
+            frames = self.read_chunk_frames(chunk_index)
+            parts.append(frames[start - chunk_start:min(stop, chunk_stop) - chunk_start])
+            start = chunk_stop
+            chunk_index += 1
+        if len(parts) == 0:
+            return self.split_frames(np.zeros((0, self.header.get_frame_size()), dtype=np.float32))
+        return self.split_frames(np.concatenate(parts) if len(parts) > 1 else parts[0])
+
+
+def open_columnar_memmap(file_name):
+    """
+    Maps the frames of an uncompressed columnar file without reading or parsing them.
+    :param file_name: The path of the file
+    :return: A tuple of (input_array, output_array, header), the arrays are read only views into the file
+    """
+    with ColumnarReplayReader(file_name) as reader:
+        header = reader.header
+        # Also right for files the writer never closed
+        frame_count = reader.get_frame_count()
+    if header.codec is not None:
+        raise ValueError('block compressed replays can not be memory mapped')
+    frames = np.memmap(file_name, dtype=np.float32, mode='r', offset=COLUMNAR_HEADER_SIZE,
+                       shape=(frame_count, header.get_frame_size()))
+    return frames[:, :header.state_dim], frames[:, header.state_dim:], header
+
 
 def write_array_to_file(game_file, array):
     """
@@ -71,7 +580,7 @@ def get_file_version(file):
             hashed_name: This is the hash of the model that was used to create this file.  If it is a least version 2
             is_eval: This is used to decide if the file was created in eval mode
     """
-    if not isinstance(file, io.BytesIO):
+    if not isinstance(file, io.BytesIO) and hasattr(file, 'name'):
         file_name = os.path.basename(file.name).split('-')[0]
     else:
         file_name = 'ram'
@@ -141,6 +650,10 @@ def read_data(file, process_pair_function, batching=False):
     print('replay version:', file_version)
     # print('hashed name:', hashed_name)
 
+    if file_version == COLUMNAR_FILE_VERSION:
+        read_columnar_data(file, process_pair_function, hashed_name, is_eval, batching)
+        return
+
     pair_number = 0
     totalbytes = 0
     total_time = 0
@@ -166,12 +679,12 @@ def read_data(file, process_pair_function, batching=False):
             if not batching:
                 for i in range(len(input_array)):
                     input_ = input_array[i]
-                    if file_version is 4:
+                    if file_version < TIME_ADDITION_FILE_VERSION:
                         input_ = v4tov5(input_)
                     process_pair_function(input_, output_array[i], pair_number, hashed_name)
                     pair_number += 1
             else:
-                if file_version is 4:
+                if file_version < TIME_ADDITION_FILE_VERSION:
                     input_array = v4tov5(input_array)
                 process_pair_function(input_array, output_array, pair_number, hashed_name)
                 pair_number += batch_size
@@ -194,14 +707,71 @@ def read_data(file, process_pair_function, batching=False):
         print('read: ' + str(totalbytes) + '/' + str(file_size) + ' bytes')
 
 
-def v4tov5(input_array):
-    # Passed time (after game_info) 1
-    input_array = np.insert(input_array, 1, 0.0, axis=1)
-    for i in range(6):
-        i = 22 if i is 0 else 43 + 20 * i
-        input_array = np.insert(input_array, i, 0, axis=1)
-        input_array = np.insert(input_array, i + 1, np.greater(np.hypot(np.hypot(input_array[:, i - 6], input_array[:, i - 5]), input_array[:, i - 4]), 2200), axis=1)
-    return input_array
+def read_columnar_data(file, process_pair_function, hashed_name, is_eval, batching=False):
+    """
+    The read_data of columnar files, process_pair_function is called the same way
+    """
+    header = read_rest_of_columnar_header(file, hashed_name, is_eval)
+    pair_number = 0
+    counter = 0
+    for input_array, output_array in iter_columnar_blocks(file, header):
+        if not batching:
+            for i in range(len(input_array)):
+                process_pair_function(input_array[i], output_array[i], pair_number, hashed_name)
+                pair_number += 1
+        else:
+            process_pair_function(input_array, output_array, pair_number, hashed_name)
+            pair_number += len(input_array)
+        counter += 1
+    print('total batches [', counter, '] total pairs [', pair_number, ']')
+
+
+def create_v4_to_v5_columns():
+    """
+    Works out where every version 4 column ends up in a version 5 state.
+    Version 5 added the passed time after the game info and a zero and a supersonic flag after every car.
+    :return: A tuple of the version 5 column of every version 4 column,
+        the version 5 columns of the supersonic flags and the version 4 velocity columns they are computed from
+    """
+    # Replays the insertions version 5 made on the column numbers, new columns are negative
+    columns = list(range(206))
+    columns.insert(1, -1)
+    supersonic_columns = []
+    velocity_columns = []
+    for car in range(6):
+        i = 22 if car == 0 else 43 + 20 * car
+        columns.insert(i, -1)
+        columns.insert(i + 1, -2)
+        supersonic_columns.append(i + 1)
+        velocity_columns.append(columns[i - 6:i - 3])
+    columns = np.array(columns)
+    destination_columns = np.argsort(columns)[np.sum(columns < 0):]
+    return destination_columns, np.array(supersonic_columns), np.array(velocity_columns)
+
+
+V4_DESTINATION_COLUMNS, V5_SUPERSONIC_COLUMNS, V4_VELOCITY_COLUMNS = create_v4_to_v5_columns()
+
+
+def v4tov5(input_array, out=None):
+    """
+    Upgrades version 4 states to version 5 with a single scatter of the columns.
+    :param input_array: A single state or a batch of states
+    :param out: Where the version 5 states are written, a new array is created if None
+    :return: The version 5 states
+    """
+    batch = np.reshape(input_array, (-1, input_array.shape[-1]))
+    if out is None:
+        out = np.zeros((len(batch), input_formatter.get_state_dim()), dtype=batch.dtype)
+    else:
+        out = np.reshape(out, (len(batch), -1))
+        out[:] = 0
+    out[:, V4_DESTINATION_COLUMNS] = batch
+    velocities = batch[:, V4_VELOCITY_COLUMNS]
+    speeds = np.hypot(np.hypot(velocities[:, :, 0], velocities[:, :, 1]), velocities[:, :, 2])
+    out[:, V5_SUPERSONIC_COLUMNS] = np.greater(speeds, 2200)
+    if input_array.ndim == 1:
+        return out[0]
+    return out
 
 
 def get_array(file, chunk):
@@ -229,6 +799,91 @@ def get_array(file, chunk):
     return result, starting_byte
 
 
+def iter_stream_blocks(file, file_version):
+    """
+    Reads the blocks of a version 4 or 5 file, where every block is a pair of length prefixed arrays.
+    Older versions raise a ValueError, see is_readable_file_version.
+    :param file: A file positioned right after its header
+    :param file_version: The version get_file_version returned
+    :return: A generator of (input_array, output_array) for every block, states older than version 5 are upgraded
+    """
+    state_dim = get_state_dim(file_version)
+    while True:
+        try:
+            input_array, num_bytes = get_array(file, file.read(4))
+            output_array, num_bytes = get_array(file, file.read(4))
+        except EOFError:
+            return
+        batch_size = int(len(input_array) / state_dim)
+        input_array = np.reshape(input_array, (batch_size, state_dim))
+        output_array = np.reshape(output_array, (batch_size, 8))
+        if file_version < TIME_ADDITION_FILE_VERSION:
+            input_array = v4tov5(input_array)
+        yield input_array, output_array
+
+
+def iter_batches(file, batch_rows=DEFAULT_BATCH_ROWS, frame_filter=None):
+    """
+    Reads a replay of any version from 4 on in batches of a fixed number of frames.
+    Batches span the blocks the file was written in, only the last batch can be smaller.
+    :param file: A decompressed file positioned at the start of the replay
+    :param batch_rows: How many frames are in a batch
+    :param frame_filter: A FrameFilter that drops frames from every block before they are batched.
+        pair_number then counts the frames that were kept
+    :return: A generator of (input_array, output_array, meta), the arrays are always float32.
+        meta is a dictionary of the file_version, hashed_name and is_eval of the file
+        and the pair_number of the first frame in the batch
+    """
+    file_version, hashed_name, is_eval = get_file_version(file)
+    if file_version == EMPTY_FILE:
+        return
+    if file_version == COLUMNAR_FILE_VERSION:
+        blocks = iter_columnar_blocks(file, read_rest_of_columnar_header(file, hashed_name, is_eval))
+    else:
+        blocks = iter_stream_blocks(file, file_version)
+
+    def create_meta(pair_number):
+        return {'file_version': file_version, 'hashed_name': hashed_name, 'is_eval': is_eval,
+                'pair_number': pair_number}
+
+    pair_number = 0
+    inputs = None
+    outputs = None
+    filled = 0
+    if frame_filter is not None:
+        frame_filter.start_file()
+    for input_block, output_block in blocks:
+        if frame_filter is not None:
+            input_block, output_block = frame_filter.filter(input_block, output_block, file_version)
+        start = 0
+        while start < len(input_block):
+            if filled == 0 and len(input_block) - start >= batch_rows:
+                # A whole batch inside the block does not need to be copied, unless it is not float32
+                yield (np.asarray(input_block[start:start + batch_rows], dtype=np.float32),
+                       np.asarray(output_block[start:start + batch_rows], dtype=np.float32),
+                       create_meta(pair_number))
+                start += batch_rows
+                pair_number += batch_rows
+                continue
+            if inputs is None:
+                inputs = np.empty((batch_rows, input_block.shape[1]), dtype=np.float32)
+                outputs = np.empty((batch_rows, output_block.shape[1]), dtype=np.float32)
+            count = min(batch_rows - filled, len(input_block) - start)
+            inputs[filled:filled + count] = input_block[start:start + count]
+            outputs[filled:filled + count] = output_block[start:start + count]
+            filled += count
+            start += count
+            if filled == batch_rows:
+                yield inputs, outputs, create_meta(pair_number)
+                pair_number += batch_rows
+                # The batch belongs to the consumer now
+                inputs = None
+                outputs = None
+                filled = 0
+    if filled > 0:
+        yield inputs[:filled], outputs[:filled], create_meta(pair_number)
+
+
 def default_process_pair(input_array, output_array, pair_number):
     """
     Default method for processing a pair of inputs this does nothing
@@ -0,0 +1,121 @@
+import numpy as np
+
+from bot_code.conversions import binary_converter
+from bot_code.conversions.input import vectorized_input_formatter as layout
+
+COMPARISONS = {'==': np.equal, '!=': np.not_equal, '<': np.less, '<=': np.less_equal,
+               '>': np.greater, '>=': np.greater_equal}
+
+DUPLICATE = 'duplicate'
+NO_PASSED_TIME = 'no passed time'
+PREDICATE = 'predicate'
+
+
+def parse_predicates(text):
+    """
+    Parses predicates written like '30 == 0; 32 > 1000', a state column, a comparison and a value.
+    :return: A list of (column, comparison, value)
+    """
+    predicates = []
+    for predicate in text.split(';'):
+        predicate = predicate.strip()
+        if predicate == '':
+            continue
+        # The two character comparisons have to be found before the one character ones
+        for comparison in sorted(COMPARISONS, key=len, reverse=True):
+            if comparison in predicate:
+                column, value = predicate.split(comparison)
+                predicates.append((int(column), comparison, float(value)))
+                break
+        else:
+            raise ValueError('unknown predicate: ' + predicate)
+    return predicates
+
+
+class FrameFilter:
+    """
+    Drops frames that are useless for training while a replay is read, a whole block at a time.
+
+    Every enabled check builds a boolean mask over the block with numpy and the frames any mask marks are dropped:
+    frames with exactly the same state as the frame before them (paused or frozen games),
+    frames where no time passed, and frames matching any of the predicates on state columns.
+    Version 4 and older replays never recorded the passed time, so that check is skipped for them.
+
+    How many frames were dropped for which reason is kept until reset_stats.
+    A filter only holds plain values so it can be sent to decoding processes.
+    """
+
+    def __init__(self, drop_duplicates=True, drop_no_passed_time=True, predicates=None):
+        """
+        :param drop_duplicates: Drops frames whose state is the same as the state of the frame before
+        :param drop_no_passed_time: Drops frames where the passed time is 0
+        :param predicates: A list of (column, comparison, value), frames where any of them is true are dropped.
+            comparison is one of the keys of COMPARISONS
+        """
+        self.drop_duplicates = drop_duplicates
+        self.drop_no_passed_time = drop_no_passed_time
+        self.predicates = predicates if predicates is not None else []
+        for column, comparison, value in self.predicates:
+            if comparison not in COMPARISONS:
+                raise ValueError('unknown comparison: ' + str(comparison))
+        self.last_state = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.dropped = {DUPLICATE: 0, NO_PASSED_TIME: 0, PREDICATE: 0}
+
+    def start_file(self):
+        """Called before the first block of a file, the first frame of a file is never a duplicate"""
+        self.last_state = None
+
+    def create_drop_mask(self, input_array, file_version):
+        """
+        :param input_array: A block of states of shape (frames, state_dim)
+        :return: A boolean mask of the frames to drop
+        """
+        drop = np.zeros(len(input_array), dtype=bool)
+        if self.drop_duplicates and len(input_array) > 0:
+            duplicates = np.empty(len(input_array), dtype=bool)
+            duplicates[1:] = np.all(input_array[1:] == input_array[:-1], axis=1)
+            duplicates[0] = self.last_state is not None and np.array_equal(input_array[0], self.last_state)
+            self.dropped[DUPLICATE] += np.count_nonzero(duplicates)
+            drop |= duplicates
+        if self.drop_no_passed_time and file_version >= binary_converter.TIME_ADDITION_FILE_VERSION:
+            no_passed_time = input_array[:, layout.PASSED_TIME_INDEX] == 0
+            self.dropped[NO_PASSED_TIME] += np.count_nonzero(no_passed_time & ~drop)
+            drop |= no_passed_time
+        if len(self.predicates) > 0:
+            matches = np.zeros(len(input_array), dtype=bool)
+            for column, comparison, value in self.predicates:
+                matches |= COMPARISONS[comparison](input_array[:, column], value)
+            self.dropped[PREDICATE] += np.count_nonzero(matches & ~drop)
+            drop |= matches
+        return drop
+
+    def filter(self, input_array, output_array, file_version):
+        """
+        :return: The input and output arrays without the dropped frames.
+            The arrays are returned as they are if nothing was dropped
+        """
+        self.frames += len(input_array)
+        drop = self.create_drop_mask(input_array, file_version)
+        if len(input_array) > 0:
+            # Compared against the next block even if it was dropped, a frozen game stays frozen
+            self.last_state = np.array(input_array[-1])
+        if not drop.any():
+            return input_array, output_array
+        keep = ~drop
+        return input_array[keep], output_array[keep]
+
+    def get_dropped_frames(self):
+        return sum(self.dropped.values())
+
+    def create_report(self):
+        dropped = self.get_dropped_frames()
+        report = 'filtered ' + str(dropped) + ' of ' + str(self.frames) + ' frames'
+        if self.frames > 0:
+            report += ' ({:.1f}%)'.format(100.0 * dropped / self.frames)
+        for reason, count in self.dropped.items():
+            report += ' ' + reason + ': ' + str(count)
+        return report
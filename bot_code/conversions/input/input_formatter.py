@@ -1,3 +1,5 @@
+import ctypes
+
 import numpy as np
 import game_data_struct
 
@@ -27,6 +29,9 @@ class InputFormatter:
         """
 
         if self.team == 1:
+            if isinstance(game_tick_packet, ctypes.Structure):
+                # Rotate a copy, the packet is shared with everything else that reads it this tick
+                game_tick_packet = type(game_tick_packet).from_buffer_copy(game_tick_packet)
             game_data_struct.rotate_game_tick_packet_boost_omitted(game_tick_packet)
 
         player_car, team_members, enemies, own_team_score, enemy_team_score = self.split_teams(game_tick_packet)
@@ -0,0 +1,365 @@
+import ctypes
+
+import numpy as np
+
+import game_data_struct
+from bot_code.conversions.input import input_formatter
+
+CTYPES_TO_NUMPY = {
+    ctypes.c_float: np.dtype(np.float32),
+    ctypes.c_int: np.dtype(np.int32),
+    ctypes.c_long: np.dtype('i' + str(ctypes.sizeof(ctypes.c_long))),
+    ctypes.c_bool: np.dtype(np.bool_),
+    ctypes.c_ubyte: np.dtype(np.uint8),
+    ctypes.c_wchar: np.dtype('u' + str(ctypes.sizeof(ctypes.c_wchar))),
+}
+
+# Where each section of the state vector starts, see InputFormatter.create_input_array
+GAME_INFO_START = 0
+PASSED_TIME_INDEX = 1
+SCORE_INFO_START = 2
+DIFF_IN_SCORE_INDEX = 9
+PLAYER_CAR_START = 10
+BALL_INFO_START = 30
+TEAM_MEMBERS_START = 51
+ENEMIES_START = 91
+BOOST_INFO_START = 151
+
+CAR_SIZE = 20
+MAX_TEAM_MEMBERS = 2
+MAX_ENEMIES = 3
+NUM_BOOSTS = 34
+
+CAR_FIELDS = ['Location.X', 'Location.Y', 'Location.Z',
+              'Rotation.Pitch', 'Rotation.Yaw', 'Rotation.Roll',
+              'Velocity.X', 'Velocity.Y', 'Velocity.Z',
+              'AngularVelocity.X', 'AngularVelocity.Y', 'AngularVelocity.Z',
+              'bOnGround', 'bSuperSonic', 'bDemolished', 'bJumped', 'bDoubleJumped',
+              'Team', 'Boost']
+LAST_TOUCHED_BALL_INDEX = len(CAR_FIELDS)
+BALL_FIELDS = ['Location.X', 'Location.Y', 'Location.Z',
+               'Rotation.Pitch', 'Rotation.Yaw', 'Rotation.Roll',
+               'Velocity.X', 'Velocity.Y', 'Velocity.Z',
+               'AngularVelocity.X', 'AngularVelocity.Y', 'AngularVelocity.Z',
+               'Acceleration.X', 'Acceleration.Y', 'Acceleration.Z',
+               'LatestTouch.sHitLocation.X', 'LatestTouch.sHitLocation.Y', 'LatestTouch.sHitLocation.Z',
+               'LatestTouch.sHitNormal.X', 'LatestTouch.sHitNormal.Y', 'LatestTouch.sHitNormal.Z']
+SCORE_FIELDS = ['Score.Score', 'Score.Goals', 'Score.OwnGoals', 'Score.Assists',
+                'Score.Saves', 'Score.Shots', 'Score.Demolitions']
+
+
+def create_numpy_dtype(ctypes_type):
+    """
+    Creates a numpy dtype with exactly the same memory layout as a ctypes type.
+    :param ctypes_type: A ctypes Structure, Array or simple type
+    :return: A numpy dtype, structures become structured dtypes with the same field names and offsets
+    """
+    if issubclass(ctypes_type, ctypes.Structure):
+        names = []
+        formats = []
+        offsets = []
+        for field in ctypes_type._fields_:
+            names.append(field[0])
+            formats.append(create_numpy_dtype(field[1]))
+            offsets.append(getattr(ctypes_type, field[0]).offset)
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                         'itemsize': ctypes.sizeof(ctypes_type)})
+    if issubclass(ctypes_type, ctypes.Array):
+        return np.dtype((create_numpy_dtype(ctypes_type._type_), (ctypes_type._length_,)))
+    return CTYPES_TO_NUMPY[ctypes_type]
+
+
+GAME_TICK_PACKET_DTYPE = create_numpy_dtype(game_data_struct.GameTickPacket)
+
+
+def get_field(dtype, path):
+    """
+    Finds a field inside a structured dtype.
+    :param dtype: A structured dtype
+    :param path: A dotted path, array elements are written as name[index].  For example 'gameBoosts[3].Timer'
+    :return: A tuple of the dtype of the field and its byte offset from the start of dtype
+    """
+    offset = 0
+    for name in path.split('.'):
+        index = None
+        if name.endswith(']'):
+            name, index = name[:-1].split('[')
+        dtype, field_offset = dtype.fields[name][:2]
+        offset += field_offset
+        if index is not None:
+            offset += int(index) * dtype.base.itemsize
+            dtype = dtype.base
+    return dtype, offset
+
+
+class GatherPlan:
+    """
+    Precomputed indexes that copy packet fields into state vector columns.
+    Fields are grouped by the flat view of the packet they are read through:
+    4 byte floats, 4 byte ints and single bytes (bools and the team byte).
+    """
+
+    def __init__(self):
+        self.float_columns = []
+        self.float_sources = []
+        self.int_columns = []
+        self.int_sources = []
+        self.byte_columns = []
+        self.byte_sources = []
+
+    def add(self, column, dtype, offset):
+        if dtype == np.float32:
+            self.float_columns.append(column)
+            self.float_sources.append(offset // 4)
+        elif dtype == np.int32:
+            self.int_columns.append(column)
+            self.int_sources.append(offset // 4)
+        elif dtype.itemsize == 1:
+            self.byte_columns.append(column)
+            self.byte_sources.append(offset)
+        else:
+            raise ValueError('unsupported field type ' + str(dtype))
+
+    def finalize(self):
+        for name in ['float_columns', 'float_sources', 'int_columns', 'int_sources', 'byte_columns', 'byte_sources']:
+            setattr(self, name, np.array(getattr(self, name), dtype=np.intp))
+        return self
+
+
+def create_static_plan():
+    """The parts of the state that are always read from the same place in the packet"""
+    plan = GatherPlan()
+    plan.add(GAME_INFO_START, *get_field(GAME_TICK_PACKET_DTYPE, 'gameInfo.bBallHasBeenHit'))
+    for i, field in enumerate(BALL_FIELDS):
+        plan.add(BALL_INFO_START + i, *get_field(GAME_TICK_PACKET_DTYPE, 'gameball.' + field))
+    for i in range(NUM_BOOSTS):
+        boost = 'gameBoosts[' + str(i) + '].'
+        plan.add(BOOST_INFO_START + 2 * i, *get_field(GAME_TICK_PACKET_DTYPE, boost + 'bActive'))
+        plan.add(BOOST_INFO_START + 2 * i + 1, *get_field(GAME_TICK_PACKET_DTYPE, boost + 'Timer'))
+    return plan.finalize()
+
+
+def create_car_plans(fields):
+    """
+    :param fields: The PlayerInfo fields that are read, in order
+    :return: A plan per car slot in the packet, the columns are relative to the start of the car in the state
+    """
+    plans = []
+    for car_index in range(game_data_struct.MAX_PLAYERS):
+        plan = GatherPlan()
+        for i, field in enumerate(fields):
+            plan.add(i, *get_field(GAME_TICK_PACKET_DTYPE, 'gamecars[' + str(car_index) + '].' + field))
+        plans.append(plan.finalize())
+    return plans
+
+
+def get_car_field_sources(field):
+    """:return: The byte offset of a PlayerInfo field for every car slot in the packet"""
+    return np.array([get_field(GAME_TICK_PACKET_DTYPE, 'gamecars[' + str(i) + '].' + field)[1]
+                     for i in range(game_data_struct.MAX_PLAYERS)], dtype=np.intp)
+
+
+STATIC_PLAN = create_static_plan()
+CAR_PLANS = create_car_plans(CAR_FIELDS)
+SCORE_PLANS = create_car_plans(SCORE_FIELDS)
+NUM_CARS_SOURCE = get_field(GAME_TICK_PACKET_DTYPE, 'numCars')[1] // 4
+TEAM_SOURCES = get_car_field_sources('Team')
+GOALS_SOURCES = get_car_field_sources('Score.Goals') // 4
+OWN_GOALS_SOURCES = get_car_field_sources('Score.OwnGoals') // 4
+
+# The car block is the player, then the team members, then the enemies.
+# Row i of the car block starts at CAR_BLOCK_STARTS[i] in the state.
+CAR_BLOCK_STARTS = np.array([PLAYER_CAR_START] +
+                            [TEAM_MEMBERS_START + CAR_SIZE * i for i in range(MAX_TEAM_MEMBERS)] +
+                            [ENEMIES_START + CAR_SIZE * i for i in range(MAX_ENEMIES)])
+# [row, field] -> state column
+CAR_FLOAT_COLUMNS = CAR_BLOCK_STARTS[:, np.newaxis] + CAR_PLANS[0].float_columns[np.newaxis, :]
+CAR_INT_COLUMNS = CAR_BLOCK_STARTS[:, np.newaxis] + CAR_PLANS[0].int_columns[np.newaxis, :]
+CAR_BYTE_COLUMNS = CAR_BLOCK_STARTS[:, np.newaxis] + CAR_PLANS[0].byte_columns[np.newaxis, :]
+CAR_LAST_TOUCHED_COLUMNS = CAR_BLOCK_STARTS + LAST_TOUCHED_BALL_INDEX
+# [car slot, field] -> index into the flat views of the packet
+CAR_FLOAT_SOURCES = np.stack([plan.float_sources for plan in CAR_PLANS])
+CAR_INT_SOURCES = np.stack([plan.int_sources for plan in CAR_PLANS])
+CAR_BYTE_SOURCES = np.stack([plan.byte_sources for plan in CAR_PLANS])
+WCHAR_DTYPE = CTYPES_TO_NUMPY[ctypes.c_wchar]
+NAME_SOURCES = get_car_field_sources('wName')
+LATEST_TOUCH_NAME_SOURCE = get_field(GAME_TICK_PACKET_DTYPE, 'gameball.LatestTouch.wPlayerName')[1]
+
+# Mirroring to the other team negates the X and Y of everything positional and turns the yaw half way around,
+# the same as game_data_struct.rotate_game_tick_packet_boost_omitted does to the packet
+HALF_TURN = np.float32(32768)
+MIRRORED_CAR_FIELDS = ['Location.X', 'Location.Y', 'Velocity.X', 'Velocity.Y',
+                       'AngularVelocity.X', 'AngularVelocity.Y']
+MIRRORED_BALL_FIELDS = MIRRORED_CAR_FIELDS + ['Acceleration.X', 'Acceleration.Y',
+                                              'LatestTouch.sHitLocation.X', 'LatestTouch.sHitLocation.Y',
+                                              'LatestTouch.sHitNormal.X', 'LatestTouch.sHitNormal.Y']
+BALL_YAW_COLUMN = BALL_INFO_START + BALL_FIELDS.index('Rotation.Yaw')
+CAR_YAW_COLUMNS = CAR_BLOCK_STARTS + CAR_FIELDS.index('Rotation.Yaw')
+YAW_COLUMNS = np.concatenate([[BALL_YAW_COLUMN], CAR_YAW_COLUMNS])
+# [row, column in the car] -> state column
+CAR_ROW_COLUMNS = CAR_BLOCK_STARTS[:, np.newaxis] + np.arange(CAR_SIZE)[np.newaxis, :]
+
+
+def create_mirror_signs():
+    signs = np.ones(input_formatter.get_state_dim(), dtype=np.float32)
+    signs[[BALL_INFO_START + BALL_FIELDS.index(field) for field in MIRRORED_BALL_FIELDS]] = -1
+    for start in CAR_BLOCK_STARTS:
+        signs[[start + CAR_FIELDS.index(field) for field in MIRRORED_CAR_FIELDS]] = -1
+    return signs
+
+
+MIRROR_SIGNS = create_mirror_signs()
+
+
+def get_present_cars(states):
+    """
+    :param states: A state or a batch of states
+    :return: For every row of the car block if it holds a car, shape (..., 6).
+        Empty rows are all zeros, a car in the game always has a height so it never is.
+    """
+    return states[..., CAR_ROW_COLUMNS].any(axis=-1)
+
+
+def mirror_states(states, present_cars=None, out=None):
+    """
+    Mirrors states to the point of view of the other team without touching any packet.
+    Mirroring a state twice gives back the original state.
+    :param states: A state or a batch of states of shape (..., state_dim)
+    :param present_cars: Which rows of the car block hold a car, shape (..., 6).
+        The yaw of empty rows stays zero.  Found with get_present_cars if None
+    :param out: The array the result is written to, can be states itself.  A new array is created if None
+    :return: The mirrored states
+    """
+    states = np.asarray(states, dtype=np.float32)
+    if present_cars is None:
+        present_cars = get_present_cars(states)
+    out = np.multiply(states, MIRROR_SIGNS, out=out)
+    yaws = out[..., YAW_COLUMNS]
+    turns = np.where(yaws < 0, HALF_TURN, -HALF_TURN)
+    turns[..., 1:] *= present_cars
+    yaws += turns
+    out[..., YAW_COLUMNS] = yaws
+    return out
+
+
+class PacketViews:
+    """Numpy views over the memory of a single ctypes packet, nothing is copied"""
+
+    def __init__(self, game_tick_packet):
+        self.game_tick_packet = game_tick_packet  # keeps the memory alive
+        size = ctypes.sizeof(game_data_struct.GameTickPacket)
+        raw = (ctypes.c_ubyte * size).from_address(ctypes.addressof(game_tick_packet))
+        self.bytes = np.frombuffer(raw, dtype=np.uint8)
+        self.floats = self.bytes.view(np.float32)
+        self.ints = self.bytes.view(np.int32)
+        self.packet = self.bytes.view(GAME_TICK_PACKET_DTYPE)[0]
+        name_size = game_data_struct.MAX_NAME_LENGTH * WCHAR_DTYPE.itemsize
+        self.names = np.lib.stride_tricks.as_strided(
+            self.bytes[NAME_SOURCES[0]:], shape=(game_data_struct.MAX_PLAYERS, name_size),
+            strides=(NAME_SOURCES[1] - NAME_SOURCES[0], 1), writeable=False)
+        self.latest_touch_name = self.bytes[LATEST_TOUCH_NAME_SOURCE:LATEST_TOUCH_NAME_SOURCE + name_size]
+
+
+class VectorizedInputFormatter(input_formatter.InputFormatter):
+    """
+    Creates exactly the same array as InputFormatter but reads the ctypes game_tick_packet through numpy views.
+    The state is assembled with a few fancy index operations instead of hundreds of attribute lookups.
+    Only works on real ctypes GameTickPackets.
+    The packet is never modified, the state of team 1 is mirrored after it is created.
+    At most 2 team members and 3 enemies are included, InputFormatter would produce a longer array for bigger teams.
+    """
+
+    def __init__(self, team, index):
+        super().__init__(team, index)
+        self.packet_views = None
+        self.names_key = None
+        self.last_touched_balls = None
+
+    def get_packet_views(self, game_tick_packet):
+        if self.packet_views is None or self.packet_views.game_tick_packet is not game_tick_packet:
+            self.packet_views = PacketViews(game_tick_packet)
+        return self.packet_views
+
+    def create_input_array(self, game_tick_packet, passed_time=0.0):
+        views = self.get_packet_views(game_tick_packet)
+        result = np.zeros(input_formatter.get_state_dim(), dtype=np.float32)
+
+        result[STATIC_PLAN.float_columns] = views.floats[STATIC_PLAN.float_sources]
+        result[STATIC_PLAN.int_columns] = views.ints[STATIC_PLAN.int_sources]
+        result[STATIC_PLAN.byte_columns] = views.bytes[STATIC_PLAN.byte_sources]
+        result[PASSED_TIME_INDEX] = passed_time
+
+        score_plan = SCORE_PLANS[self.index]
+        result[SCORE_INFO_START + score_plan.int_columns] = views.ints[score_plan.int_sources]
+
+        rows, cars, total_score = self.split_teams_from_views(views)
+        result[DIFF_IN_SCORE_INDEX] = self.last_total_score - total_score
+        self.last_total_score = total_score
+
+        result[CAR_FLOAT_COLUMNS[rows]] = views.floats[CAR_FLOAT_SOURCES[cars]]
+        result[CAR_INT_COLUMNS[rows]] = views.ints[CAR_INT_SOURCES[cars]]
+        result[CAR_BYTE_COLUMNS[rows]] = views.bytes[CAR_BYTE_SOURCES[cars]]
+        result[CAR_LAST_TOUCHED_COLUMNS[rows]] = self.get_last_touched_balls(views)[cars]
+
+        if self.team == 1:
+            present_cars = np.zeros(len(CAR_BLOCK_STARTS), dtype=np.bool_)
+            present_cars[rows] = True
+            mirror_states(result, present_cars, out=result)
+
+        return self.remove_nans(result)
+
+    def split_teams_from_views(self, views):
+        """
+        Works out which car goes into which row of the car block, in the same order as InputFormatter.split_teams
+        :return: The rows of the car block that are used, the car slots that fill them and the total score
+        """
+        num_cars = int(views.ints[NUM_CARS_SOURCE])
+        teams = views.bytes[TEAM_SOURCES[:num_cars]].tolist()
+        goals = views.ints[GOALS_SOURCES[:num_cars]].tolist()
+        own_goals = views.ints[OWN_GOALS_SOURCES[:num_cars]].tolist()
+        rows = []
+        cars = []
+        team_members = 0
+        enemies = 0
+        own_team_score = 0
+        enemy_team_score = 0
+        for index in range(num_cars):
+            if index == self.index or teams[index] == self.team:
+                own_team_score += goals[index]
+                enemy_team_score += own_goals[index]
+                if index == self.index:
+                    rows.append(0)
+                    cars.append(index)
+                elif team_members < MAX_TEAM_MEMBERS:
+                    team_members += 1
+                    rows.append(team_members)
+                    cars.append(index)
+            else:
+                enemy_team_score += goals[index]
+                own_team_score += own_goals[index]
+                if enemies < MAX_ENEMIES:
+                    rows.append(1 + MAX_TEAM_MEMBERS + enemies)
+                    cars.append(index)
+                    enemies += 1
+        return rows, cars, enemy_team_score - own_team_score
+
+    def get_last_touched_balls(self, views):
+        """
+        :return: For every car slot if it was the last to touch the ball.
+            The names are only compared again when one of them changed.
+        """
+        names_key = views.names.tobytes() + views.latest_touch_name.tobytes()
+        if names_key != self.names_key:
+            self.names_key = names_key
+            game_tick_packet = views.game_tick_packet
+            latest_touch = game_tick_packet.gameball.LatestTouch
+            self.last_touched_balls = np.array([self.get_last_touched_ball(car, latest_touch)
+                                                for car in game_tick_packet.gamecars], dtype=np.float32)
+        return self.last_touched_balls
+
+    def remove_nans(self, np_version):
+        is_nan = np.isnan(np_version)
+        if is_nan.any():
+            print('nan indexes', np.argwhere(is_nan))
+            np_version[is_nan] = 0
+        return np_version
@@ -0,0 +1,176 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from bot_code.conversions import binary_converter
+
+INDEX_FILE_NAME = 'cache.sqlite'
+OBJECT_FOLDER_NAME = 'objects'
+TEMPORARY_EXTENSION = '.tmp'
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+# How long a replay that was handed out is kept, so it is not removed before the trainer that asked for it opens it
+DEFAULT_PIN_SECONDS = 10 * 60
+
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL)'''
+CREATE_INDEXES = ['CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)',
+                  'CREATE INDEX IF NOT EXISTS entries_content_hash ON entries (content_hash)']
+
+
+def get_cache_name(name):
+    """Replays are cached by their file name, whatever folder the server listed them in"""
+    return os.path.basename(name)
+
+
+class ReplayCache:
+    """
+    Keeps downloaded replays on disk so training on the same replays again does not download them again.
+
+    A replay is stored under the sha256 of the bytes the server sent, so the same replay listed under two
+    names is only stored once, and an index maps the names to those hashes.
+    The stored replays are already decoded into uncompressed columnar replays, which can be memory mapped
+    or read without decompressing anything.
+    Once the stored replays take more than max_bytes the least recently used ones are removed,
+    except for the ones handed out in the last pin_seconds, which can make the cache go over max_bytes for a while.
+    The downloader threads share a single cache, so everything goes through a lock.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES, pin_seconds=DEFAULT_PIN_SECONDS):
+        """
+        :param folder: Where the replays and the index are kept, created if it does not exist
+        :param max_bytes: How big the stored replays can get before old ones are removed
+        :param pin_seconds: How long a replay returned by get or put is kept, however big the cache is
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.pin_seconds = pin_seconds
+        self.object_folder = os.path.join(folder, OBJECT_FOLDER_NAME)
+        os.makedirs(self.object_folder, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(folder, INDEX_FILE_NAME), check_same_thread=False)
+        self.connection.execute(CREATE_TABLE)
+        for create_index in CREATE_INDEXES:
+            self.connection.execute(create_index)
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def get_object_file(self, content_hash):
+        return os.path.join(self.object_folder, content_hash + binary_converter.COLUMNAR_EXTENSION)
+
+    def get(self, name):
+        """
+        :param name: The name the server knows the replay by
+        :return: The path of the decoded replay, None if it is not cached
+        """
+        name = get_cache_name(name)
+        with self.lock:
+            row = self.connection.execute('SELECT content_hash FROM entries WHERE name = ?', (name,)).fetchone()
+            if row is not None and not os.path.exists(self.get_object_file(row[0])):
+                # Removed behind the cache's back
+                self.connection.execute('DELETE FROM entries WHERE name = ?', (name,))
+                self.connection.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute('UPDATE entries SET last_used = ? WHERE name = ?', (time.time(), name))
+            self.connection.commit()
+            self.hits += 1
+        return self.get_object_file(row[0])
+
+    def put(self, name, data):
+        """
+        Decodes a downloaded replay into the cache.
+        :param name: The name the server knows the replay by
+        :param data: The bytes the server sent
+        :return: The path of the decoded replay, None if it could not be decoded
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        object_file = self.get_object_file(content_hash)
+        if not os.path.exists(object_file) and not self.decode(data, object_file):
+            return None
+        size = os.path.getsize(object_file)
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                                    (get_cache_name(name), content_hash, size, time.time()))
+            self.connection.commit()
+            self.evict()
+        if not os.path.exists(object_file):
+            return None  # removed behind the cache's back
+        return object_file
+
+    def decode(self, data, object_file):
+        """
+        Writes the replay as an uncompressed columnar replay.
+        The replay is written next to its final name first, so readers never see half a replay.
+        :return: True if the replay had frames in it
+        """
+        temporary_file = object_file + '.' + str(threading.get_ident()) + TEMPORARY_EXTENSION
+        writer = None
+        try:
+            with binary_converter.open_decompressed_file(io.BytesIO(data)) as f:
+                for input_array, output_array, meta in binary_converter.iter_batches(f):
+                    if writer is None:
+                        # The oldest versions only know the name of the bot, not its hash
+                        hashed_name = meta['hashed_name'] if isinstance(meta['hashed_name'], int) else 0
+                        writer = binary_converter.ColumnarFileWriter(temporary_file, hashed_name, meta['is_eval'])
+                    writer.write_frames(input_array, output_array)
+            if writer is None:
+                return False
+            writer.close()
+            os.replace(temporary_file, object_file)
+            return True
+        except Exception as e:
+            print('could not cache replay', e)
+            if writer is not None:
+                writer.file.close()
+            return False
+        finally:
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+
+    def get_size(self):
+        """:return: How many bytes the stored replays take"""
+        row = self.connection.execute(
+            'SELECT SUM(size) FROM (SELECT DISTINCT content_hash, size FROM entries)').fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        """
+        Removes the least recently used replays until the cache fits in max_bytes, the lock must be held.
+        Replays handed out in the last pin_seconds are kept, another thread may be about to open them.
+        """
+        size = self.get_size()
+        if size <= self.max_bytes:
+            return
+        removed = 0
+        pinned_since = time.time() - self.pin_seconds
+        for name, content_hash, object_size in self.connection.execute(
+                'SELECT name, content_hash, size FROM entries WHERE last_used <= ? ORDER BY last_used',
+                (pinned_since,)).fetchall():
+            if size <= self.max_bytes:
+                break
+            self.connection.execute('DELETE FROM entries WHERE name = ?', (name,))
+            # the same content can be pinned under another name
+            still_used = self.connection.execute('SELECT size FROM entries WHERE content_hash = ? LIMIT 1',
+                                                 (content_hash,)).fetchone()
+            if still_used is None:
+                size -= object_size
+                try:
+                    os.remove(self.get_object_file(content_hash))
+                except OSError:
+                    pass
+            removed += 1
+        self.connection.commit()
+        print('replay cache removed', removed, 'replays')
@@ -1,44 +1,241 @@
 import argparse
-import glob
-import gzip
+import collections
+import multiprocessing as mp
 import os
+import sys
+import time
+import zlib
 
 import numpy as np
 
 from bot_code.conversions import binary_converter
 
-parser = argparse.ArgumentParser()
-parser.add_argument('path', type=str,
-                    help='path to convert files from')
-args = parser.parse_args()
-
-
-class ReplayConverter:
-    step = 0
-
-    def __init__(self, game_file):
-        self.game_file = game_file
-        self.inputs = np.array([])
-        self.outputs = np.array([])
-
-    def process_pair(self, input_array, output_array, pair_number, file_version):
-        self.inputs = np.append(self.inputs, np.array(input_array))
-        self.outputs = np.append(self.outputs, np.array(output_array))
-        if self.inputs.shape[0] % 2000 == 0:
-            binary_converter.write_array_to_file(self.game_file, self.inputs)
-            binary_converter.write_array_to_file(self.game_file, self.outputs)
-            self.inputs = np.array([])
-            self.outputs = np.array([])
-            self.step = 0
-        self.step += 1
-
-
-fs = glob.glob(os.path.join(args.path, '*.gz'))
-if not os.path.isdir('converted/'):
-    os.makedirs('converted/')
-print (fs, args.path)
-for file in fs:
-    with gzip.open(file, 'rb') as f:
-        with gzip.open(os.path.join('converted', os.path.basename(file)), 'wb') as new_file:
-            trainer = ReplayConverter(new_file)
-            binary_converter.read_data(f, trainer.process_pair)
+CODECS = {'none': None, 'gzip': binary_converter.GZIP_CODEC, 'bz2': binary_converter.BZ2_CODEC,
+          'lzma': binary_converter.LZMA_CODEC}
+# Level 9 barely beats 6 on replays and takes a lot longer, which adds up over a whole archive
+MIGRATION_COMPRESSION_LEVEL = 6
+JOURNAL_FILE_NAME = 'migration-journal.tsv'
+TEMPORARY_EXTENSION = '.tmp'
+
+CONVERTED = 'converted'
+EMPTY = 'empty'
+
+
+class FrameChecksum:
+    """
+    A checksum of the frames of a replay that does not depend on how they were split into blocks or batches.
+    The states and the controls are each checksummed as one long stream of float32 rows.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.input_crc = 0
+        self.output_crc = 0
+
+    def update(self, input_array, output_array):
+        self.frames += len(input_array)
+        self.input_crc = zlib.crc32(np.ascontiguousarray(input_array, dtype=np.float32), self.input_crc)
+        self.output_crc = zlib.crc32(np.ascontiguousarray(output_array, dtype=np.float32), self.output_crc)
+
+    def get_checksum(self):
+        return '{:08x}{:08x}'.format(self.input_crc, self.output_crc)
+
+
+def checksum_replay(file_name, batch_rows=binary_converter.DEFAULT_BATCH_ROWS):
+    """:return: The FrameChecksum of every frame in a replay of any readable version"""
+    checksum = FrameChecksum()
+    with binary_converter.open_decompressed_file(file_name) as f:
+        for input_array, output_array, meta in binary_converter.iter_batches(f, batch_rows):
+            checksum.update(input_array, output_array)
+    return checksum
+
+
+def get_output_name(relative_name):
+    """
+    :return: The name of the converted replay, 'bot-3.bin.gz' and 'bot-3.gz' both become 'bot-3.scol'
+    """
+    for extension in binary_converter.CODEC_EXTENSIONS.values():
+        if relative_name.endswith(extension):
+            relative_name = relative_name[:-len(extension)]
+            break
+    if relative_name.endswith(binary_converter.LEGACY_EXTENSION):
+        relative_name = relative_name[:-len(binary_converter.LEGACY_EXTENSION)]
+    if not relative_name.endswith(binary_converter.COLUMNAR_EXTENSION):
+        relative_name += binary_converter.COLUMNAR_EXTENSION
+    return relative_name
+
+
+def convert_replay(task):
+    """
+    Converts a single replay into a columnar replay and reads it back to check it.
+    The replay is written to a temporary file that only replaces the output once it checked out,
+    so a crash never leaves a broken replay behind.
+    :param task: A tuple of (relative_name, source_file, output_file, codec, compression_level, batch_rows)
+    :return: A tuple of (relative_name, status, frames, checksum, error), error is None if it worked
+    """
+    relative_name, source_file, output_file, codec, compression_level, batch_rows = task
+    temporary_file = output_file + TEMPORARY_EXTENSION
+    try:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        checksum = FrameChecksum()
+        with binary_converter.open_decompressed_file(source_file) as f, open(temporary_file, 'wb') as out:
+            writer = None
+            for input_array, output_array, meta in binary_converter.iter_batches(f, batch_rows):
+                if writer is None:
+                    # The oldest versions only know the name of the bot, not its hash
+                    hashed_name = meta['hashed_name'] if isinstance(meta['hashed_name'], int) else 0
+                    writer = binary_converter.ColumnarFileWriter(out, hashed_name, meta['is_eval'], codec=codec,
+                                                                 compression_level=compression_level)
+                writer.write_frames(input_array, output_array)
+                checksum.update(input_array, output_array)
+            if writer is None:
+                out.close()
+                os.remove(temporary_file)
+                return relative_name, EMPTY, 0, '', None
+            writer.close()
+            out.flush()
+            os.fsync(out.fileno())
+
+        with open(temporary_file, 'rb') as f:
+            written_frames = binary_converter.ColumnarReplayReader(f).get_frame_count()
+        if written_frames != checksum.frames:
+            raise ValueError('wrote ' + str(written_frames) + ' frames of ' + str(checksum.frames))
+        written_checksum = checksum_replay(temporary_file, batch_rows)
+        if written_checksum.frames != checksum.frames or written_checksum.get_checksum() != checksum.get_checksum():
+            raise ValueError('the written frames do not match the replay')
+        os.replace(temporary_file, output_file)
+        return relative_name, CONVERTED, checksum.frames, checksum.get_checksum(), None
+    except Exception as e:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+        return relative_name, None, 0, '', str(e)
+
+
+def find_replays(source_folder, excluded_folder=None):
+    """:return: The sorted paths of every replay under source_folder, relative to it"""
+    replays = []
+    for (dirpath, dirnames, filenames) in os.walk(source_folder):
+        if excluded_folder is not None:
+            dirnames[:] = [d for d in dirnames
+                           if os.path.abspath(os.path.join(dirpath, d)) != os.path.abspath(excluded_folder)]
+        for file in filenames:
+            if any(file.endswith(extension) for extension in binary_converter.REPLAY_EXTENSIONS):
+                replays.append(os.path.relpath(os.path.join(dirpath, file), source_folder))
+    return sorted(replays)
+
+
+def find_colliding_replays(replays):
+    """:return: The replays that share their output name with another replay, like 'bot-3.gz' and 'bot-3.bin.gz'"""
+    sources = collections.defaultdict(list)
+    for relative_name in replays:
+        sources[get_output_name(relative_name)].append(relative_name)
+    return sorted(name for names in sources.values() if len(names) > 1 for name in names)
+
+
+def read_journal(journal_file):
+    """
+    :return: The set of replays the journal lists as finished.
+        A line cut short by a crash is ignored, that replay is simply converted again
+    """
+    finished = set()
+    if not os.path.exists(journal_file):
+        return finished
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                continue
+            fields = line[:-1].split('\t')
+            if len(fields) == 4:
+                finished.add(fields[1])
+    return finished
+
+
+def end_partial_journal_line(journal_file):
+    """Finishes a line cut short by a crash, so the next entry starts on its own line"""
+    if not os.path.exists(journal_file) or os.path.getsize(journal_file) == 0:
+        return
+    with open(journal_file, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def write_journal_entry(journal, relative_name, status, frames, checksum):
+    journal.write(status + '\t' + relative_name + '\t' + str(frames) + '\t' + checksum + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def migrate(source_folder, output_folder, num_processes=None, codec=binary_converter.GZIP_CODEC,
+            compression_level=MIGRATION_COMPRESSION_LEVEL, batch_rows=binary_converter.DEFAULT_BATCH_ROWS,
+            journal_file=None):
+    """
+    Converts every replay under source_folder into a columnar replay under output_folder, keeping the folders.
+    Every replay that was converted and checked is added to the journal, running again skips them.
+    :param num_processes: How many replays are converted at the same time, every cpu if None
+    :param codec: The codec the blocks are compressed with, None for memory mappable replays
+    :param journal_file: The journal, output_folder/migration-journal.tsv if None
+    :return: A tuple of how many replays were converted, skipped because of the journal and failed.
+        Replays that would be converted into the same file are not converted and count as failed
+    """
+    if journal_file is None:
+        journal_file = os.path.join(output_folder, JOURNAL_FILE_NAME)
+    os.makedirs(output_folder, exist_ok=True)
+    finished = read_journal(journal_file)
+    end_partial_journal_line(journal_file)
+    replays = find_replays(source_folder, excluded_folder=output_folder)
+    colliding = [relative_name for relative_name in find_colliding_replays(replays) if relative_name not in finished]
+    for relative_name in colliding:
+        print('not converting', relative_name, 'another replay would be converted into',
+              get_output_name(relative_name))
+    colliding = set(colliding)
+    tasks = [(relative_name, os.path.join(source_folder, relative_name),
+              os.path.join(output_folder, get_output_name(relative_name)), codec, compression_level, batch_rows)
+             for relative_name in replays if relative_name not in finished and relative_name not in colliding]
+    skipped = len([relative_name for relative_name in replays if relative_name in finished])
+    print('converting', len(tasks), 'replays,', skipped, 'were already converted')
+
+    converted = 0
+    failed = len(colliding)
+    total_frames = 0
+    start = time.time()
+    with open(journal_file, 'a', encoding='utf-8') as journal, mp.Pool(num_processes) as pool:
+        for relative_name, status, frames, checksum, error in pool.imap_unordered(convert_replay, tasks):
+            if error is not None:
+                failed += 1
+                print('failed to convert', relative_name, error)
+                continue
+            write_journal_entry(journal, relative_name, status, frames, checksum)
+            converted += 1
+            total_frames += frames
+            if converted % 100 == 0:
+                seconds = time.time() - start
+                print('converted', converted, '/', len(tasks), 'replays,', int(total_frames / max(seconds, 1e-9)),
+                      'frames per second')
+    print('converted', converted, 'replays with', total_frames, 'frames in', str(time.time() - start), 'seconds,',
+          failed, 'failed')
+    return converted, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts every replay in a folder, of any file version, into '
+                                                 'columnar replays.  Finished replays are kept in a journal, so an '
+                                                 'interrupted conversion picks up where it stopped.')
+    parser.add_argument('path', type=str, help='path to convert files from, sub folders are included')
+    parser.add_argument('--output', default='converted', help='where the converted replays are written')
+    parser.add_argument('--processes', type=int, help='how many replays are converted at once, every cpu by default')
+    parser.add_argument('--codec', choices=sorted(CODECS), default='gzip',
+                        help='how the blocks are compressed, none writes memory mappable replays')
+    parser.add_argument('--compression-level', type=int, default=MIGRATION_COMPRESSION_LEVEL)
+    parser.add_argument('--batch-rows', type=int, default=binary_converter.DEFAULT_BATCH_ROWS,
+                        help='how many frames go in a block')
+    parser.add_argument('--journal', help='the journal of finished replays, in the output folder by default')
+    args = parser.parse_args()
+    converted, skipped, failed = migrate(args.path, args.output, args.processes, CODECS[args.codec],
+                                         args.compression_level, args.batch_rows, args.journal)
+    if failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
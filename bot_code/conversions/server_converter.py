@@ -14,6 +14,7 @@ class ServerConverter:
     download_config = False
     download_model = False
     error = False
+    replay_cache = None
 
     def __init__(self, server_ip, uploading, download_config, download_model,
                  num_players=2, num_my_team=1, username='', model_hash='', is_eval=False):
@@ -46,6 +47,13 @@ class ServerConverter:
         print('setting is eval', is_eval)
         self.is_eval = is_eval
 
+    def set_replay_cache(self, replay_cache):
+        """
+        Downloaded replays are looked up in and added to this cache.
+        :param replay_cache: A ReplayCache, or None to always download
+        """
+        self.replay_cache = replay_cache
+
     def load_config(self):
         """
         Makes a request to download the config from the server.
@@ -174,19 +182,44 @@ class ServerConverter:
         return [";".join(c) for c in chunks(replays_to_use, batch_size)]
 
     def download_file(self, file):
+        """
+        Downloads replays, the ones in the replay cache are not downloaded again.
+        :param file: The name of a replay, or several names joined by ';'
+        :return: A file for a single name, a list of files for several names.
+            The files are not all of the same type: a replay in the cache is the str path of its decoded replay,
+            any other replay is an io.BytesIO of what the server sent.
+            binary_converter.open_decompressed_file opens either of them.
+        """
+        names = file.split(';')
+        files = []
+        if self.replay_cache is not None:
+            cached = [self.replay_cache.get(name) for name in names]
+            files = [path for path in cached if path is not None]
+            names = [name for name, path in zip(names, cached) if path is None]
+        if len(names) > 0:
+            for name, in_memory_file in self.download_replays(names):
+                path = None
+                if self.replay_cache is not None:
+                    path = self.replay_cache.put(name, in_memory_file.getvalue())
+                files.append(path if path is not None else in_memory_file)
         if ';' in file:
-            file = file.split(';')
-            response = requests.post(self.server_ip + '/replays/download', data={'files': json.dumps(file)})
+            return files
+        return files[0]
+
+    def download_replays(self, names):
+        """:return: A list of (name, io.BytesIO) of the downloaded replays"""
+        if len(names) > 1:
+            response = requests.post(self.server_ip + '/replays/download', data={'files': json.dumps(names)})
             print('status code', response.status_code)
             in_memory_file = io.BytesIO()
             for chunk in response.iter_content(chunk_size=1024):
                 if chunk:
                     in_memory_file.write(chunk)
             zip = zipfile.ZipFile(in_memory_file)
-            return [io.BytesIO(zip.read(name)) for name in zip.namelist()]
+            return [(name, io.BytesIO(zip.read(name))) for name in zip.namelist()]
         else:
-            response = requests.get(self.server_ip + '/replays/' + file)
-            return io.BytesIO(response.content)
+            response = requests.get(self.server_ip + '/replays/' + names[0])
+            return [(names[0], io.BytesIO(response.content))]
 
     def ping_server(self):
         try:
@@ -1,7 +1,8 @@
 import ctypes
-import mmap
 import numpy as np
 
+import shared_memory
+
 BUFFER_SIZE = 100
 LAST_INDEX = BUFFER_SIZE - 1
 USED_BUFFER_FOR_GRAPHING = 100
@@ -16,7 +17,7 @@ class RotatingBufferStruct(ctypes.Structure):
 # A rotating buffer backed by shared memory so it can be used across processes.
 class RotatingBuffer:
     def __init__(self, index):
-        self.buff = mmap.mmap(-1, ctypes.sizeof(RotatingBufferStruct), SHARED_MEMORY_PREFIX + str(index))
+        self.buff = shared_memory.open_shared_memory(SHARED_MEMORY_PREFIX + str(index), ctypes.sizeof(RotatingBufferStruct))
         self.rot_buf = RotatingBufferStruct.from_buffer(self.buff)
 
     def __iadd__(self, other):
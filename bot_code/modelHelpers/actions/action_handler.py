@@ -1,8 +1,8 @@
 import collections
 import itertools
+import math
 import numpy as np
 import random
-import sys
 import tensorflow as tf
 
 
@@ -90,17 +90,11 @@ class ActionHandler:
         return self.actions[action_selection[0]]
 
     def create_tensorflow_controller_from_selection(self, action_selection, batch_size=1, should_stack=True):
-        combo_actions = self.actions
-        indexer = tf.constant(1, dtype=tf.int32)
-        if batch_size > 1:
-            multiplier = tf.constant([int(batch_size), 1, 1])
-            combo_actions = tf.tile(tf.expand_dims(combo_actions, 0), multiplier)
-            indexer = tf.constant(np.arange(0, batch_size, 1), dtype=tf.int32)
-
-        button_combo = tf.gather_nd(combo_actions, tf.stack([indexer, tf.cast(action_selection[3], tf.int32)], axis=1))
-        new_shape = [self.get_logit_size(), batch_size]
-        button_combo = tf.reshape(button_combo, new_shape)
-        controller_option = button_combo
+        combo_actions = tf.constant(np.array(self.actions, dtype=np.float32))
+
+        # gathers the rows of the selected actions straight from the table, whatever the batch size
+        button_combo = tf.gather(combo_actions, tf.cast(action_selection[0], tf.int32))
+        controller_option = tf.unstack(button_combo, num=self.control_size, axis=-1)
         controller_option = [tf.cast(option, tf.float32) for option in controller_option]
         # print(controller_option)
         if should_stack:
@@ -114,6 +108,21 @@ class ActionHandler:
     def create_action_index(self, real_action):
         return [self._find_matching_action(real_action)]
 
+    def create_action_indices(self, real_actions):
+        """
+        Creates the indexes of a whole batch of controls at once, the same ones create_action_index gives every row.
+        :param real_actions: An array of controls of shape (frames, 8)
+        :return: An array of shape (frames, number of actions)
+        """
+        real_actions = np.asarray(real_actions)
+        is_finite = np.all(np.isfinite(real_actions), axis=1)
+        option_indexes = []
+        for i in range(len(self.combo_list)):
+            option_indexes.append(self._find_closest_options(np.where(is_finite, real_actions[:, i], 0.0), i))
+        indexes = np.ravel_multi_index(option_indexes, self.action_sizes)
+        indexes[~is_finite] = 0
+        return indexes[:, np.newaxis]
+
     def _find_closet_real_number(self, number, index=0):
         if number <= -0.25:
             if number <= -0.75:
@@ -128,29 +137,61 @@ class ActionHandler:
         else:
             return 4
 
-    def _compare_actions(self, action1, action2):
-        loss = 0
-        for i in range(len(action1)):
-            loss += abs(action1[i] - action2[i])
-        return loss
+    def _find_closet_real_numbers(self, numbers, index=0):
+        """The batched version of _find_closet_real_number, nan ends up in the last bucket like it does there"""
+        return (4 - (numbers <= -0.75).astype(np.int64) - (numbers <= -0.25) - (numbers < 0.25) - (numbers < 0.75))
+
+    def _find_combo_indices(self, combo_values, combo_list):
+        """
+        The batched version of looking a button combo up in the action map.
+        :param combo_values: The values of every control in the combo, arrays of shape (frames,)
+        :param combo_list: The options of every control in the combo
+        :return: The index of the combo of every frame
+        """
+        option_indexes = []
+        for values, options in zip(combo_values, combo_list):
+            # Compared as float32 like the keys of the action map
+            matches = (np.asarray(values, dtype=np.float32)[:, np.newaxis] ==
+                       np.asarray(options, dtype=np.float32)[np.newaxis, :])
+            if not np.all(np.any(matches, axis=1)):
+                raise KeyError('controls that are not a button combo')
+            option_indexes.append(np.argmax(matches, axis=1))
+        return np.ravel_multi_index(option_indexes, [len(options) for options in combo_list])
+
+    def _find_closest_option(self, number, index):
+        """
+        :param number: The value of a single control
+        :param index: Which control it is
+        :return: The index of the option of that control closest to the number, the lower option on a tie
+        """
+        options = self.combo_list[index]
+        start = float(options[0])
+        step = float(options[1]) - start
+        position = math.ceil((float(number) - start) / step - 0.5)
+        return min(max(position, 0), len(options) - 1)
+
+    def _find_closest_options(self, numbers, index):
+        """The batched version of _find_closest_option"""
+        options = self.combo_list[index]
+        start = float(options[0])
+        step = float(options[1]) - start
+        position = np.ceil((np.asarray(numbers, dtype=np.float64) - start) / step - 0.5).astype(np.int64)
+        return np.clip(position, 0, len(options) - 1)
 
     def _find_matching_action(self, real_action):
-        # first time we do a close match I guess
-        if self.action_map.has_key(real_action):
-            #print('found a matching object!')
-            return self.action_map.get_key(real_action)
-        closest_action = None
-        index_of_action = 0
-        counter = 0
-        current_loss = sys.float_info.max
-        for action in self.actions:
-            loss = self._compare_actions(action, real_action)
-            if loss < current_loss:
-                current_loss = loss
-                closest_action = action
-                index_of_action = counter
-            counter += 1
-        return index_of_action
+        """
+        Finds the action with the smallest absolute difference to the controls.
+        That difference is the sum of the differences of every control, so the closest action is made of the
+        closest option of every control and its index is the mixed radix number of those options,
+        the order itertools.product creates the actions in.
+        """
+        index = 0
+        for i, size in enumerate(self.action_sizes):
+            if not math.isfinite(real_action[i]):
+                # nothing is closer than anything else
+                return 0
+            index = index * size + self._find_closest_option(real_action[i], i)
+        return index
 
     def _create_one_hot_encoding(self, index):
         array = np.zeros(self.get_logit_size())
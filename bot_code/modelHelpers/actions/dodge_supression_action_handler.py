@@ -1,4 +1,5 @@
 from bot_code.modelHelpers.actions.dynamic_action_handler import DynamicActionHandler, COMBO
+import numpy as np
 import tensorflow as tf
 
 DODGE = 'dodge'
@@ -62,6 +63,16 @@ class DodgeActionHandler(DynamicActionHandler):
         combo_list[self.combo_name_index_map[DODGE]] = is_suppressed
         return super()._create_combo_index(real_action, combo_list)
 
+    def _create_combo_indices(self, real_actions, combo_values):
+        is_suppressed = np.ones(len(real_actions), dtype=bool)
+        for option in self.dodge_suppressor_list[1]:
+            is_suppressed &= self.round_actions(real_actions[:, self.control_names_index_map[option]], 7) == 0.0
+        for option in self.dodge_suppressor_list[0]:
+            is_suppressed &= self.round_actions(real_actions[:, self.control_names_index_map[option]], 7) == 1.0
+
+        combo_values[self.combo_name_index_map[DODGE]] = is_suppressed
+        return super()._create_combo_indices(real_actions, combo_values)
+
     def _create_combo_index_graph(self, combo_list, real_action=None):
         is_suppressed = tf.constant([True])
         for option in self.dodge_suppressor_list[1]:
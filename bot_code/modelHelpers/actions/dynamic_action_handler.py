@@ -145,27 +145,10 @@ class DynamicActionHandler(SplitActionHandler):
     def create_tensorflow_controller_from_selection(self, action_selection, batch_size=1, should_stack=True):
         controller_output = []
 
-        ranged_actions = []
+        # the selections index these tables directly, so nothing grows with the batch size
+        ranged_actions = [tf.constant(np.array(ranged_action)) for ranged_action in self.ranged_actions]
         combo_actions = tf.constant(np.transpose(np.array(self.button_combo)))
 
-        # handle ranged actions
-        multiplier = tf.constant([int(batch_size), 1])
-        for ranged_action in self.ranged_actions:
-            action = tf.constant(np.array(ranged_action))
-            if batch_size > 1:
-                expanded_action = tf.expand_dims(action, 0)
-                action = tf.tile(expanded_action, multiplier)
-            ranged_actions.append(action)
-
-        # handle combo buttons
-        if batch_size > 1:
-            multiplier = tf.constant([1, int(batch_size), 1])
-            indexer = tf.constant(np.arange(0, batch_size, 1), dtype=tf.int32)
-            if len(self.combo_list) > 0:
-                combo_actions = tf.tile(tf.expand_dims(combo_actions, 1), multiplier)
-        else:
-            indexer = tf.constant(1, dtype=tf.int32)
-
         combo_index = self.action_name_index_map[COMBO] if len(self.combo_list) > 0 else -1
         # actually decoding the controls now the startup is done
 
@@ -177,13 +160,12 @@ class DynamicActionHandler(SplitActionHandler):
                 true_index = self.combo_name_index_map[control]
                 single_element = combo_actions[true_index]
                 controller_output.append(
-                    tf.gather_nd(single_element,
-                                 tf.stack([indexer, tf.cast(action_selection[combo_index], tf.int32)], axis=1)))
+                    tf.gather(single_element, tf.cast(action_selection[combo_index], tf.int32)))
                 continue
             selection = action_selection[index]
             if self.is_classification(index):
                 ranged_action = ranged_actions[index]
-                output = tf.gather_nd(ranged_action, tf.stack([indexer, tf.cast(selection, tf.int32)], axis=1))
+                output = tf.gather(ranged_action, tf.cast(selection, tf.int32))
                 controller_output.append(output)
             else:
                 # selection = tf.Print(selection, [selection], control)
@@ -200,15 +182,28 @@ class DynamicActionHandler(SplitActionHandler):
         rounded_amount = float(action_size // 2)
         return float(round(rounded_amount * input)) / rounded_amount
 
+    def round_actions(self, inputs, action_size):
+        rounded_amount = float(action_size // 2)
+        # In float64 like round_action, so halves of float32 controls round the same way
+        return np.round(rounded_amount * np.asarray(inputs, dtype=np.float64)) / rounded_amount
+
     def _find_closet_real_number(self, number, index=0):
         comparison = np.array(self.actions[index])
         result = np.abs(comparison - np.array(number))
         index = np.argmin(result)
         return index
 
+    def _find_closet_real_numbers(self, numbers, index=0):
+        comparison = np.array(self.actions[index])
+        result = np.abs(comparison[np.newaxis, :] - numbers[:, np.newaxis])
+        return np.argmin(result, axis=1)
+
     def _create_combo_index(self, real_action, combo_list):
         return self.action_map.get_key(combo_list)
 
+    def _create_combo_indices(self, real_actions, combo_values):
+        return self._find_combo_indices(combo_values, self.combo_list)
+
     def create_action_index(self, real_action):
         combo_list = []
         indexes = []
@@ -238,6 +233,36 @@ class DynamicActionHandler(SplitActionHandler):
 
         return indexes
 
+    def create_action_indices(self, real_actions):
+        real_actions = np.asarray(real_actions)
+        combo_values = []
+        indexes = []
+        for i in range(len(self.combo_list)):
+            combo_values.append(None)
+        for i in range(len(self.actions)):
+            indexes.append(None)
+        for i, control in enumerate(self.control_names):
+            if i >= real_actions.shape[1]:
+                continue
+            real_control = real_actions[:, i]
+            action_index = self.action_name_index_map[control]
+
+            if action_index == COMBO:
+                real_index = self.combo_name_index_map[control]
+                action_size = self.combo_action_sizes[real_index]
+                combo_values[real_index] = self.round_actions(real_control, action_size)
+            else:
+                if indexes[action_index] is None and self.is_classification(action_index):
+                    indexes[action_index] = self._find_closet_real_numbers(real_control, action_index)
+                elif indexes[action_index] is None:
+                    indexes[action_index] = real_control
+
+        if len(self.combo_list) > 0:
+            indexes[self.action_name_index_map[COMBO]] = self._create_combo_indices(real_actions, combo_values)
+
+        # Stays an int array unless there are regression controls
+        return np.stack(indexes, axis=1)
+
     def _create_combo_index_graph(self, combo_list, real_action=None):
         binary_combo_index = tf.constant(0.0)
         for i, name in enumerate(reversed(self.combo_name_list)):
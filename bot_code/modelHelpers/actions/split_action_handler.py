@@ -6,6 +6,9 @@ import tensorflow as tf
 
 from bot_code.modelHelpers.actions.action_handler import ActionHandler, ActionMap
 
+# Where the logits of an action are in the logits layer
+SplitAction = collections.namedtuple('SplitAction', 'name offset size loss_type')
+
 
 class SplitActionHandler(ActionHandler):
     """
@@ -20,6 +23,9 @@ class SplitActionHandler(ActionHandler):
     action_sizes = []
     movement_actions = []
     tensorflow_combo_actions = []
+    split_plan = None
+    split_logits_graph = None
+    split_logits_cache = {}
 
     def __init__(self):
         super().__init__()
@@ -30,6 +36,9 @@ class SplitActionHandler(ActionHandler):
         self.action_sizes = []
         self.movement_actions = []
         self.tensorflow_combo_actions = []
+        self.split_plan = None
+        self.split_logits_graph = None
+        self.split_logits_cache = {}
 
     def create_actions(self):
         self.reset()
@@ -110,6 +119,21 @@ class SplitActionHandler(ActionHandler):
 
         return [steer_index, pitch_index, roll_index, button_combo]
 
+    def create_action_indices(self, real_actions):
+        real_actions = np.asarray(real_actions)
+        steer = real_actions[:, 1]
+        yaw = real_actions[:, 3]
+        # only take the larger magnitude number
+        steer = np.where(np.logical_and(steer != yaw, np.abs(steer) < np.abs(yaw)), yaw, steer)
+
+        steer_index = self._find_closet_real_numbers(steer)
+        pitch_index = self._find_closet_real_numbers(real_actions[:, 2])
+        roll_index = self._find_closet_real_numbers(real_actions[:, 4])
+        button_combo = self._find_combo_indices([np.round(real_actions[:, 0]), real_actions[:, 5],
+                                                 real_actions[:, 6], real_actions[:, 7]], self.combo_list)
+
+        return np.stack([steer_index, pitch_index, roll_index, button_combo], axis=1)
+
     def create_controller_from_selection(self, action_selection):
         if len(action_selection) != len(self.actions):
             print('ACTION SELECTION IS NOT THE SAME LENGTH returning invalid action data')
@@ -127,36 +151,16 @@ class SplitActionHandler(ActionHandler):
         return controller_option
 
     def create_tensorflow_controller_from_selection(self, action_selection, batch_size=1, should_stack=True):
-        movement_actions = self.movement_actions
-        combo_actions = self.tensorflow_combo_actions
-        indexer = tf.constant(1, dtype=tf.int32)
         action_selection = tf.cast(action_selection, tf.int32)
-        if batch_size > 1:
-            movement_actions = tf.expand_dims(movement_actions, 0)
-            multiplier = tf.constant([int(batch_size), 1, 1])
-            movement_actions = tf.tile(movement_actions, multiplier)
-            combo_actions = tf.tile(tf.expand_dims(combo_actions, 0), multiplier)
-            indexer = tf.constant(np.arange(0, batch_size, 1), dtype=tf.int32)
-            yaw_actions = tf.squeeze(tf.slice(movement_actions, [0, 0, 0], [-1, 1, -1]))
-            pitch_actions = tf.squeeze(tf.slice(movement_actions, [0, 1, 0], [-1, 1, -1]))
-            roll_actions = tf.squeeze(tf.slice(movement_actions, [0, 2, 0], [-1, 1, -1]))
-        else:
-            yaw_actions = movement_actions[0]
-            pitch_actions = movement_actions[1]
-            roll_actions = movement_actions[2]
 
         # we get the options based on each individual index in the batches.  so this returns batch_size options
-        steer = tf.gather_nd(yaw_actions, tf.stack([indexer, action_selection[0]], axis=1))
-        pitch = tf.gather_nd(pitch_actions, tf.stack([indexer, action_selection[1]], axis=1))
-        roll = tf.gather_nd(roll_actions, tf.stack([indexer, action_selection[2]], axis=1))
+        # the tables are gathered from directly, so nothing grows with the batch size
+        steer = tf.gather(self.movement_actions[0], action_selection[0])
+        pitch = tf.gather(self.movement_actions[1], action_selection[1])
+        roll = tf.gather(self.movement_actions[2], action_selection[2])
 
-        button_combo = tf.gather_nd(combo_actions, tf.stack([indexer, action_selection[3]], axis=1))
-        new_shape = [len(self.combo_list), batch_size]
-        button_combo = tf.reshape(button_combo, new_shape)
-        throttle = button_combo[0]
-        jump = button_combo[1]
-        boost = button_combo[2]
-        handbrake = button_combo[3]
+        button_combo = tf.gather(self.tensorflow_combo_actions, action_selection[3])
+        throttle, jump, boost, handbrake = tf.unstack(button_combo, num=len(self.combo_list), axis=-1)
         controller_option = [throttle, steer, pitch, steer, roll, jump, boost, handbrake]
         controller_option = [tf.cast(option, tf.float32) for option in controller_option]
         # print(controller_option)
@@ -167,6 +171,43 @@ class SplitActionHandler(ActionHandler):
     def get_random_option(self):
         return [random.randrange(5), random.randrange(5), random.randrange(5), random.randrange(24)]
 
+    def get_split_plan(self):
+        """
+        Works out once where the logits of every action are.
+        :return: A list with a SplitAction for every action
+        """
+        if self.split_plan is None:
+            split_plan = []
+            offset = 0
+            for i, size in enumerate(self.action_sizes):
+                split_plan.append(SplitAction(self.action_list_names[i], offset, size, self.get_loss_type(i)))
+                offset += size
+            self.split_plan = split_plan
+        return self.split_plan
+
+    def split_logits(self, logits):
+        """
+        Splits a logits layer into the logits of every action.
+        The split is made once for every tensor and control flow context (while loop or cond),
+        so everything built on the same logits shares it.
+        Only the splits of the graph the logits are in are kept.
+        :param logits: A tensor of shape (?, logit size)
+        :return: A list with a tensor of shape (?, action size) for every action
+        """
+        graph = logits.graph
+        if graph is not self.split_logits_graph:
+            # the splits of the previous graph would keep it alive
+            self.split_logits_graph = graph
+            self.split_logits_cache = {}
+        # a split made inside a while loop or cond can not be used outside of it
+        key = (logits, graph._get_control_flow_context())
+        if key not in self.split_logits_cache:
+            sizes = [action.size for action in self.get_split_plan()]
+            # next to the logits, whatever name scope asked for the split first
+            with tf.name_scope(logits.op.name + '/'):
+                self.split_logits_cache[key] = tf.split(logits, sizes, axis=1, name='split_logits')
+        return self.split_logits_cache[key]
+
     def run_func_on_split_tensors(self, input_tensors, split_func, return_as_list=False):
         """
         Optionally splits the tensor and runs a function on the split tensor
@@ -181,32 +222,38 @@ class SplitActionHandler(ActionHandler):
         if not isinstance(input_tensors, collections.Sequence):
             input_tensors = [input_tensors]
 
+        split_plan = self.get_split_plan()
+        logit_size = self.get_logit_size()
+        number_actions = self.get_number_actions()
         total_input = []
-        for i in self.action_sizes:
+        for i in split_plan:
             total_input.append([])
 
         for tensor in input_tensors:
-            total_action_size = 0
-            for i, val in enumerate(self.action_sizes):
+            if not isinstance(tensor, collections.Sequence):
+                shape = tensor.get_shape()
+                if len(shape) > 1 and not shape[0] == logit_size and shape[1] == logit_size:
+                    # the usual case, logits of shape (?, logit size)
+                    for i, split_tensor in enumerate(self.split_logits(tensor)):
+                        total_input[i].append(split_tensor)
+                    continue
+            for i, action in enumerate(split_plan):
                 starting_length = len(total_input[i])
                 if isinstance(tensor, collections.Sequence):
-                    if len(tensor) == self.get_logit_size():
+                    if len(tensor) == logit_size:
                         # grabs each slice of tensor
-                        total_input[i].append(tensor[total_action_size:total_action_size + val])
+                        total_input[i].append(tensor[action.offset:action.offset + action.size])
                     else:
                         total_input[i].append(tensor[i])
                 else:
-                    if len(tensor.get_shape()) == 0:
+                    if len(shape) == 0:
                         total_input[i].append(tf.identity(tensor, name='copy' + str(i)))
-                    elif tensor.get_shape()[0] == self.get_logit_size():
-                        total_input[i].append(tf.slice(tensor, [total_action_size], [val]))
-                    elif tensor.get_shape()[1] == self.get_logit_size():
-                        total_input[i].append(tf.slice(tensor, [0, total_action_size], [-1, val]))
-                    elif tensor.get_shape()[1] == self.get_number_actions():
+                    elif shape[0] == logit_size:
+                        total_input[i].append(tf.slice(tensor, [action.offset], [action.size]))
+                    elif shape[1] == number_actions:
                         total_input[i].append(tf.slice(tensor, [0, i], [-1, 1]))
-                    elif tensor.get_shape()[1] == 1:
+                    elif shape[1] == 1:
                         total_input[i].append(tf.identity(tensor, name='copy' + str(i)))
-                total_action_size += val
                 if starting_length == len(total_input[i]):
                     print('tensor ignored', tensor)
 
@@ -214,13 +261,13 @@ class SplitActionHandler(ActionHandler):
             print('mis match in tensor length')
 
         results = []
-        for i, val in enumerate(self.action_list_names):
-            with tf.name_scope(val):
+        for i, action in enumerate(split_plan):
+            with tf.name_scope(action.name):
                 try:
                     functional_input = total_input[i]
                     results.append(split_func(*functional_input))
                 except Exception as e:
-                    print('exception in split func ', val)
+                    print('exception in split func ', action.name)
                     raise e
 
         if return_as_list:
@@ -240,13 +287,11 @@ class SplitActionHandler(ActionHandler):
         """
 
         total_input = []
-        total_action_size = 0
-        for i, val in enumerate(self.action_sizes):
+        for i, action in enumerate(self.get_split_plan()):
             if not is_already_split:
-                total_input.append(numpy_array[:, total_action_size:val])
+                total_input.append(numpy_array[:, action.offset:action.offset + action.size])
             else:
                 total_input.append(numpy_array[i])
-            total_action_size += val
 
         result = []
         for element in total_input:
@@ -166,15 +166,18 @@ class BaseActorCritic(base_reinforcement.BaseReinforcement):
 
     def create_reinforcement_training_model(self, model_input=None):
         converted_input = self.get_input(model_input)
+        # the returns need the whole rollout, a mini batch would cut episodes short
+        discounted_rewards = self.discount_rewards(self.input_rewards, converted_input)
         if self.batch_size > self.mini_batch_size:
-            ds = tf.data.Dataset.from_tensor_slices((converted_input, self.taken_actions)).batch(self.mini_batch_size)
+            ds = tf.data.Dataset.from_tensor_slices((converted_input, self.taken_actions, discounted_rewards))
+            ds = ds.batch(self.mini_batch_size)
             self.iterator = ds.make_initializable_iterator()
-            batched_input, batched_taken_actions = self.iterator.get_next()
+            batched_input, batched_taken_actions, self.discounted_rewards = self.iterator.get_next()
         else:
             batched_input = converted_input
             batched_taken_actions = self.taken_actions
+            self.discounted_rewards = discounted_rewards
         with tf.name_scope("training_network"):
-            self.discounted_rewards = self.discount_rewards(self.input_rewards, batched_input)
             with tf.variable_scope("actor_network", reuse=True):
                 self.logprobs = self.actor_network(batched_input)
 
@@ -3,7 +3,7 @@ import os
 import tensorflow as tf
 import numpy as np
 
-from bot_code.conversions.input.input_formatter import InputFormatter
+from bot_code.conversions.input.vectorized_input_formatter import VectorizedInputFormatter
 from bot_code.modelHelpers import tensorflow_feature_creator
 from bot_code.modelHelpers.data_normalizer import DataNormalizer
 
@@ -30,6 +30,7 @@ class BaseModel:
     input_formatter = None
     summarize = no_op
     iterator = None
+    dataset_iterator = None
     reg_param = 0.001
     should_regulate = None
 
@@ -113,7 +114,7 @@ class BaseModel:
 
     def add_input_formatter(self, team, index):
         """Creates and adds an input formatter"""
-        self.input_formatter = InputFormatter(team, index)
+        self.input_formatter = VectorizedInputFormatter(team, index)
 
     def create_input_array(self, game_tick_packet, frame_time):
         """Creates the input array from the game_tick_packet"""
@@ -155,12 +156,32 @@ class BaseModel:
         :return: The outputs converted to their batch form.
         """
         outputs = tuple(inputs)
+        if self.dataset_iterator is not None:
+            # The dataset already hands out mini batches
+            return outputs
         if self.batch_size > self.mini_batch_size:
             ds = tf.data.Dataset.from_tensor_slices(tuple(inputs)).batch(self.mini_batch_size)
             self.iterator = ds.make_initializable_iterator()
             outputs = self.iterator.get_next()
         return outputs
 
+    def create_dataset_inputs(self, dataset):
+        """
+        Makes the model train on batches from a tf.data dataset instead of batches fed through a feed_dict.
+        :param dataset: A dataset of (inputs, labels) that is already in mini batches
+        :return: The input and label tensors to create the training model with
+        """
+        self.dataset_iterator = dataset.make_initializable_iterator()
+        return self.dataset_iterator.get_next()
+
+    def initialize_dataset(self):
+        """Starts another pass over the dataset"""
+        self.sess.run(self.dataset_iterator.initializer)
+
+    def get_dataset_batch_size(self):
+        """The size of the batches the dataset should hand out, the same as create_batched_inputs makes"""
+        return min(self.batch_size, self.mini_batch_size)
+
     def create_feed_dict(self, input_array, label_array):
         return {self.get_input_placeholder(): input_array, self.get_labels_placeholder(): label_array}
 
@@ -180,7 +201,16 @@ class BaseModel:
         should_summarize = should_calculate_summaries and self.summarize is not None and self.summary_writer is not None
 
         # perform one update of training
-        if self.batch_size > self.mini_batch_size:
+        if self.dataset_iterator is not None and feed_dict is None:
+            # A single mini batch from the dataset, this raises tf.errors.OutOfRangeError once it runs out
+            result, summary_str = self.sess.run([
+                self.train_op,
+                self.summarize if should_summarize else self.no_op
+            ])
+            if should_summarize:
+                self.summary_writer.add_summary(summary_str, self.train_iteration)
+                self.train_iteration += 1
+        elif self.batch_size > self.mini_batch_size:
             _, = self.sess.run([self.iterator.initializer],
                           feed_dict=feed_dict)
             num_batches = math.ceil(float(self.batch_size) / float(self.mini_batch_size))
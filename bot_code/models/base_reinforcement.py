@@ -1,6 +1,7 @@
 import numpy as np
 import tensorflow as tf
 
+from bot_code.conversions.input import vectorized_input_formatter as layout
 from bot_code.models import base_model
 
 
@@ -131,23 +132,42 @@ class BaseReinforcement(base_model.BaseModel):
                 self.action_buffer = np.concatenate((self.action_buffer, last_action), axis=0)
                 self.state_buffer = np.concatenate((self.state_buffer, input_state), axis=0)
 
-    def in_loop(self, counter, input_rewards, discounted_rewards, r):
-        new_r = input_rewards[counter] + self.discount_factor * r
-        index = tf.reshape(counter, [1])
-        update_tensor = tf.scatter_nd(index, new_r, tf.shape(discounted_rewards))
-        new_discounted_rewards = discounted_rewards + update_tensor
-        new_counter = counter - tf.constant(1)
-        return new_counter, input_rewards, new_discounted_rewards, new_r
+    def create_episode_ends(self, input):
+        """
+        Finds where the episodes in a rollout end, at a goal and at the frame before a kickoff.
+        Normalization only scales the state, so the columns still say if they are zero.
+        :param input: The states of the rollout, of shape (frames, state_dim)
+        :return: 1.0 for every frame that ends an episode and 0.0 for every other frame
+        """
+        scored = tf.not_equal(input[:, layout.DIFF_IN_SCORE_INDEX], 0.0)
+        # the first value of the game info is if the ball has been hit, it is reset for a kickoff
+        ball_hit = tf.not_equal(input[:, layout.GAME_INFO_START], 0.0)
+        before_kickoff = tf.concat([tf.logical_and(ball_hit[:-1], tf.logical_not(ball_hit[1:])), [False]], axis=0)
+        return tf.cast(tf.logical_or(scored, before_kickoff), tf.float32)
 
     def discount_rewards(self, input_rewards, input):
-        r = tf.Variable(initial_value=tf.reshape(tf.constant(0.0), [1]))
-        length = tf.Variable(tf.size(input_rewards))
-        discounted_rewards = tf.zeros(tf.shape(input_rewards), name='discounted_rewards')
-        counter = tf.Variable(length)
-        tf.while_loop(lambda i, _, __, ___: tf.greater_equal(i, 0), self.in_loop,
-                      (counter, input_rewards, discounted_rewards, r),
-                      parallel_iterations=1, back_prop=False)
-        return discounted_rewards
+        """
+        Creates the discounted return of every frame, its reward plus the discounted return of the frame after it.
+        A single scan from the last frame to the first, returns are not carried over the end of an episode.
+        :param input_rewards: The reward of every frame, of shape (frames, 1)
+        :param input: The states of the same frames, episodes are not split up if None
+        :return: The discounted returns, the same shape as input_rewards
+        """
+        with tf.name_scope('discount_rewards'):
+            rewards = tf.reshape(input_rewards, [-1])
+            if input is None:
+                episode_ends = tf.zeros_like(rewards)
+            else:
+                episode_ends = self.create_episode_ends(input)
+
+            def discount(next_return, frame):
+                reward, episode_end = frame
+                return reward + self.discount_factor * next_return * (1.0 - episode_end)
+
+            discounted_rewards = tf.scan(discount, (tf.reverse(rewards, [0]), tf.reverse(episode_ends, [0])),
+                                         initializer=tf.constant(0.0), back_prop=False)
+            discounted_rewards = tf.reverse(discounted_rewards, [0])
+            return tf.reshape(discounted_rewards, tf.shape(input_rewards), name='discounted_rewards')
 
     def update_model(self):
         if len(self.state_buffer) == 0:
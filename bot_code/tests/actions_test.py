@@ -143,7 +143,109 @@ def test3():
         assert all(np.isclose(numpy_result, expected_row))
         assert all(np.isclose(dynamic_result, expected_row))
 
+
+def test4():
+    """
+    Test that the batched indexes are the same as the indexes of every single row
+    """
+    controls = np.random.uniform(-1, 1, (1000, 8)).astype(np.float32)
+    # exact options and the edges between buckets
+    edges = np.array([-1.0, -0.75, -0.5, -0.25, 0.0, 0.25, 0.5, 0.75, 1.0], dtype=np.float32)
+    controls[:500, :5] = np.random.choice(edges, (500, 5))
+    controls[:, 0] = np.round(controls[:, 0])
+    controls[:, 5:] = np.random.randint(0, 2, (1000, 3))
+
+    handlers = [action_factory.get_handler(False), action_factory.get_handler(True, action_factory.default_scheme),
+                action_factory.get_handler(True, action_factory.super_split_scheme),
+                action_factory.get_handler(True, action_factory.only_steer_split_scheme),
+                action_factory.get_handler(True, action_factory.mixed_controls)]
+    for handler in handlers:
+        batched = handler.create_action_indices(controls)
+        single = np.array([handler.create_action_index(row) for row in controls], dtype=batched.dtype)
+        assert np.array_equal(batched, single)
+
+
+def test5():
+    """
+    Test that the unsplit handler finds the action with the smallest absolute difference
+    """
+    handler = action_factory.get_handler(False)
+    actions = np.array(handler.actions, dtype=np.float64)
+    controls = np.random.uniform(-1.2, 1.2, (200, 8)).astype(np.float32)
+    controls[:100] = np.random.choice(np.array([-1.0, -0.5, 0.0, 0.5, 1.0], dtype=np.float32), (100, 8))
+    for row in controls:
+        losses = np.sum(np.abs(actions - row), axis=1)
+        # on a tie the first action wins
+        assert handler.create_action_index(row)[0] == np.argmin(losses)
+
+
+def test6():
+    """
+    Test that decoding a batch of selections in tensorflow gives the controls of every single selection
+    """
+    session = tf.Session(config=tf.ConfigProto(
+        device_count={'GPU': 0}
+    ))
+    controls = np.random.uniform(-1, 1, (100, 8)).astype(np.float32)
+    controls[:, 0] = np.round(controls[:, 0])
+    controls[:, 5:] = np.random.randint(0, 2, (100, 3))
+
+    for handler in [action_factory.get_handler(False), action_factory.get_handler(True, action_factory.default_scheme),
+                    action_factory.get_handler(True, action_factory.super_split_scheme)]:
+        indexes = handler.create_action_indices(controls)
+        selection = [tf.constant(column) for column in np.transpose(indexes)]
+        decoded = session.run(handler.create_tensorflow_controller_from_selection(selection, batch_size=len(controls)))
+        for index, row in enumerate(indexes):
+            assert np.allclose(decoded[index], np.array(handler.create_controller_from_selection(row), dtype=np.float32))
+
+
+def test7():
+    """
+    Test that everything built on the same logits shares a single split of them
+    """
+    handler = action_factory.get_handler(True, action_factory.super_split_scheme)
+    logits = tf.placeholder(tf.float32, shape=(None, handler.get_logit_size()))
+    softmax = handler.run_func_on_split_tensors(logits, lambda input_tensor: tf.nn.softmax(input_tensor),
+                                                return_as_list=True)
+    argmax = handler.run_func_on_split_tensors(logits, lambda input_tensor: tf.argmax(input_tensor, axis=1),
+                                               return_as_list=True)
+    assert handler.split_logits(logits) is handler.split_logits(logits)
+    assert [tensor.op.inputs[0] for tensor in softmax] == handler.split_logits(logits)
+    assert [tensor.op.inputs[0] for tensor in argmax] == handler.split_logits(logits)
+
+    session = tf.Session(config=tf.ConfigProto(
+        device_count={'GPU': 0}
+    ))
+    logit_values = np.random.uniform(-1, 1, (10, handler.get_logit_size()))
+    argmax_values = session.run(argmax, feed_dict={logits: logit_values})
+    for action, values in zip(handler.get_split_plan(), argmax_values):
+        expected = np.argmax(logit_values[:, action.offset:action.offset + action.size], axis=1)
+        assert np.array_equal(values, expected)
+
+    # Inside a cond the split is made again, it can not use the one from outside of the cond
+    in_cond = []
+
+    def branch():
+        in_cond.append(handler.split_logits(logits)[0])
+        return in_cond[-1]
+    tf.cond(tf.constant(True), branch, branch)
+    assert in_cond[0] is not handler.split_logits(logits)[0]
+    assert in_cond[0] is not in_cond[1]
+
+    # A new graph does not keep the splits of the old one
+    with tf.Graph().as_default():
+        other_logits = tf.placeholder(tf.float32, shape=(None, handler.get_logit_size()))
+        assert handler.split_logits(other_logits)[0].graph is other_logits.graph
+        assert len(handler.split_logits_cache) == 1
+    handler.reset()
+    assert len(handler.split_logits_cache) == 0
+
+
 if __name__ == '__main__':
    # test1()
    # test2()
    test3()
+   test4()
+   test5()
+   test6()
+   test7()
@@ -0,0 +1,223 @@
+import io
+import os
+import tempfile
+
+import numpy as np
+
+from bot_code.conversions import binary_converter
+from bot_code.conversions.frame_filter import FrameFilter, parse_predicates
+from bot_code.conversions.input import input_formatter
+
+STATE_DIM = input_formatter.get_state_dim()
+
+
+def create_random_blocks(num_blocks, frames_per_block=50):
+    return [(np.random.uniform(-100, 100, (frames_per_block, STATE_DIM)).astype(np.float32),
+             np.random.uniform(-1, 1, (frames_per_block, binary_converter.CONTROLLER_DIM)).astype(np.float32))
+            for _ in range(num_blocks)]
+
+
+def read_all(file):
+    inputs = []
+    outputs = []
+
+    def process_pair(input_array, output_array, pair_number, hashed_name):
+        inputs.append(np.array(input_array))
+        outputs.append(np.array(output_array))
+
+    binary_converter.read_data(file, process_pair, batching=True)
+    return np.concatenate(inputs), np.concatenate(outputs)
+
+
+def write_columnar(file, blocks, codec):
+    writer = binary_converter.ColumnarFileWriter(file, 1234, True, codec=codec)
+    for input_array, output_array in blocks:
+        writer.write_frames(input_array.ravel(), output_array.ravel())
+    writer.close()
+
+
+def test_columnar_round_trip():
+    """Test that every codec reads back exactly what was written, through the same path the trainers use"""
+    np.random.seed(0)
+    blocks = create_random_blocks(3)
+    expected_inputs = np.concatenate([block[0] for block in blocks])
+    expected_outputs = np.concatenate([block[1] for block in blocks])
+    for codec in [None, binary_converter.GZIP_CODEC, binary_converter.BZ2_CODEC, binary_converter.LZMA_CODEC]:
+        file = io.BytesIO()
+        write_columnar(file, blocks, codec)
+        file.seek(0)
+        with binary_converter.open_decompressed_file(file) as f:
+            assert binary_converter.get_file_version(f) == (binary_converter.COLUMNAR_FILE_VERSION, 1234, True)
+            f.seek(0)
+            inputs, outputs = read_all(f)
+        assert np.array_equal(expected_inputs, inputs)
+        assert np.array_equal(expected_outputs, outputs)
+
+
+def test_columnar_memmap():
+    np.random.seed(1)
+    blocks = create_random_blocks(2)
+    file_name = os.path.join(tempfile.mkdtemp(), 'replay' + binary_converter.COLUMNAR_EXTENSION)
+    write_columnar(file_name, blocks, None)
+    inputs, outputs, header = binary_converter.open_columnar_memmap(file_name)
+    assert header.frame_count == 100
+    assert np.array_equal(np.concatenate([block[0] for block in blocks]), inputs)
+    assert np.array_equal(np.concatenate([block[1] for block in blocks]), outputs)
+
+
+def test_columnar_random_access():
+    """Test that chunks and frame ranges match what was written, with and without the index"""
+    np.random.seed(3)
+    blocks = create_random_blocks(4, frames_per_block=30)
+    expected_inputs = np.concatenate([block[0] for block in blocks])
+    expected_outputs = np.concatenate([block[1] for block in blocks])
+    for codec in [None, binary_converter.GZIP_CODEC]:
+        file = io.BytesIO()
+        write_columnar(file, blocks, codec)
+        complete = file.getvalue()
+        # A file the writer never closed has no index and no frame count
+        unclosed = io.BytesIO()
+        writer = binary_converter.ColumnarFileWriter(unclosed, 1234, True, codec=codec)
+        for input_array, output_array in blocks:
+            writer.write_frames(input_array, output_array)
+        for data in [complete, unclosed.getvalue()]:
+            reader = binary_converter.ColumnarReplayReader(io.BytesIO(data))
+            assert reader.get_frame_count() == 120
+            assert reader.get_chunk_count() == (4 if codec is not None or data is complete else 1)
+            if data is complete:
+                assert np.array_equal(reader.read_chunk(2)[0], blocks[2][0])
+                key_values = blocks[2][0][:, reader.key_columns]
+                assert np.array_equal(reader.chunk_mins[2], key_values.min(axis=0))
+                assert np.array_equal(reader.chunk_maxs[2], key_values.max(axis=0))
+            for start, stop in [(0, 120), (10, 20), (25, 95), (119, 200), (50, 50)]:
+                inputs, outputs = reader.read_frames(start, stop)
+                assert np.array_equal(expected_inputs[start:stop], inputs)
+                assert np.array_equal(expected_outputs[start:stop], outputs)
+
+
+def test_stream_format_still_reads():
+    np.random.seed(2)
+    blocks = create_random_blocks(2)
+    file = io.BytesIO()
+    with binary_converter.open_compressed_file(file) as f:
+        binary_converter.write_version_info(f, binary_converter.TIME_ADDITION_FILE_VERSION)
+        binary_converter.write_bot_hash(f, 1234)
+        binary_converter.write_is_eval(f, False)
+        for input_array, output_array in blocks:
+            binary_converter.write_array_to_file(f, input_array.ravel())
+            binary_converter.write_array_to_file(f, output_array.ravel())
+    file.seek(0)
+    with binary_converter.open_decompressed_file(file) as f:
+        inputs, outputs = read_all(f)
+    assert np.array_equal(np.concatenate([block[0] for block in blocks]), inputs)
+
+
+def test_iter_batches_spans_blocks():
+    """Test that fixed size batches span the written blocks and upgrade version 4 states"""
+    np.random.seed(4)
+    v4_inputs = np.random.uniform(-3000, 3000, (70, 206)).astype(np.float32)
+    outputs = np.random.uniform(-1, 1, (70, binary_converter.CONTROLLER_DIM)).astype(np.float32)
+    file = io.BytesIO()
+    binary_converter.write_version_info(file, binary_converter.BATCH_ARRAY_FILE_VERSION)
+    binary_converter.write_bot_hash(file, 1234)
+    binary_converter.write_is_eval(file, False)
+    for start in range(0, 70, 25):
+        binary_converter.write_array_to_file(file, v4_inputs[start:start + 25].ravel())
+        binary_converter.write_array_to_file(file, outputs[start:start + 25].ravel())
+    file.seek(0)
+    batches = list(binary_converter.iter_batches(file, batch_rows=30))
+    assert [len(batch[0]) for batch in batches] == [30, 30, 10]
+    assert [batch[2]['pair_number'] for batch in batches] == [0, 30, 60]
+    assert batches[0][2]['file_version'] == binary_converter.BATCH_ARRAY_FILE_VERSION
+    inputs = np.concatenate([batch[0] for batch in batches])
+    assert np.array_equal(binary_converter.v4tov5(v4_inputs), inputs)
+    assert np.array_equal(outputs, np.concatenate([batch[1] for batch in batches]))
+
+    # Version 4 had no passed time and no supersonic flags
+    assert inputs.shape[1] == STATE_DIM
+    assert np.all(inputs[:, 1] == 0)
+    assert np.array_equal(inputs[:, 0], v4_inputs[:, 0])
+    assert np.array_equal(inputs[:, 2:22], v4_inputs[:, 1:21])
+
+
+def test_iter_batches_filters_frames():
+    """Test that duplicate, timeless and matching frames are dropped across blocks and counted"""
+    np.random.seed(5)
+    blocks = create_random_blocks(2, frames_per_block=20)
+    inputs = np.concatenate([block[0] for block in blocks])
+    inputs[3] = inputs[2]  # paused
+    inputs[20] = inputs[19]  # still paused across the block boundary
+    inputs[5, 1] = 0  # no time passed
+    inputs[7, 30] = 5000  # matches the predicate
+    inputs[8] = inputs[7]  # both a duplicate and a match, counted once
+    blocks = [(inputs[:20], blocks[0][1]), (inputs[20:], blocks[1][1])]
+    file = io.BytesIO()
+    write_columnar(file, blocks, None)
+    file.seek(0)
+    frame_filter = FrameFilter(predicates=parse_predicates('30 >= 4000'))
+    batches = list(binary_converter.iter_batches(file, batch_rows=16, frame_filter=frame_filter))
+    keep = np.ones(40, dtype=bool)
+    keep[[3, 20, 5, 7, 8]] = False
+    assert np.array_equal(np.concatenate([batch[0] for batch in batches]), inputs[keep])
+    assert [batch[2]['pair_number'] for batch in batches] == [0, 16, 32]
+    assert frame_filter.frames == 40
+    assert frame_filter.dropped == {'duplicate': 3, 'no passed time': 1, 'predicate': 1}
+
+
+def test_iter_batches_float64_stream():
+    """Test that batches read straight from a block and copied across blocks are both float32"""
+    np.random.seed(5)
+    inputs = np.random.uniform(-100, 100, (50, STATE_DIM))
+    outputs = np.random.uniform(-1, 1, (50, binary_converter.CONTROLLER_DIM))
+    file = io.BytesIO()
+    binary_converter.write_version_info(file, binary_converter.TIME_ADDITION_FILE_VERSION)
+    binary_converter.write_bot_hash(file, 1234)
+    binary_converter.write_is_eval(file, False)
+    for start in range(0, 50, 25):
+        binary_converter.write_array_to_file(file, inputs[start:start + 25].ravel())
+        binary_converter.write_array_to_file(file, outputs[start:start + 25].ravel())
+    file.seek(0)
+    batches = list(binary_converter.iter_batches(file, batch_rows=20))
+    assert [len(batch[0]) for batch in batches] == [20, 20, 10]
+    assert all(batch[0].dtype == np.float32 and batch[1].dtype == np.float32 for batch in batches)
+    assert np.array_equal(inputs.astype(np.float32), np.concatenate([batch[0] for batch in batches]))
+
+
+class StreamFile(io.RawIOBase):
+    """A file that can only be written to in order, like a pipe or an upload"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def test_columnar_non_seekable_file():
+    """Test that compressed files stream to a file that can not seek and uncompressed ones are refused"""
+    np.random.seed(6)
+    blocks = create_random_blocks(2)
+    try:
+        binary_converter.ColumnarFileWriter(StreamFile(), 1234, True)
+        assert False, 'an uncompressed file can not end its frames without seeking'
+    except ValueError:
+        pass
+    file = StreamFile()
+    write_columnar(file, blocks, binary_converter.GZIP_CODEC)
+    batches = list(binary_converter.iter_batches(io.BytesIO(bytes(file.data))))
+    assert np.array_equal(np.concatenate([block[0] for block in blocks]), np.concatenate([b[0] for b in batches]))
+    assert np.array_equal(np.concatenate([block[1] for block in blocks]), np.concatenate([b[1] for b in batches]))
+
+if __name__ == '__main__':
+    test_columnar_round_trip()
+    test_columnar_memmap()
+    test_columnar_random_access()
+    test_stream_format_still_reads()
+    test_iter_batches_spans_blocks()
+    test_iter_batches_filters_frames()
+    test_iter_batches_float64_stream()
+    test_columnar_non_seekable_file()
@@ -0,0 +1,57 @@
+import numpy as np
+import tensorflow as tf
+
+from bot_code.conversions.input import input_formatter
+from bot_code.conversions.input import vectorized_input_formatter as layout
+from bot_code.models.base_reinforcement import BaseReinforcement
+
+STATE_DIM = input_formatter.get_state_dim()
+
+
+def discount_rewards_with_loop(rewards, scored, ball_hit, discount_factor):
+    """The returns the slow way, walking back from the last frame"""
+    returns = np.zeros(len(rewards))
+    next_return = 0.0
+    for frame in reversed(range(len(rewards))):
+        before_kickoff = frame + 1 < len(rewards) and ball_hit[frame] and not ball_hit[frame + 1]
+        if scored[frame] or before_kickoff:
+            next_return = 0.0
+        next_return = rewards[frame] + discount_factor * next_return
+        returns[frame] = next_return
+    return returns
+
+
+def test_discount_rewards_resets_at_episode_ends():
+    rewards = np.array([1, 0, 0, 5, 1, 1, 2, 0, 0, 3, 1, 1], dtype=np.float32)
+    # a goal in frame 3, then a kickoff in frame 7 after the ball was hit in frames 4 to 6
+    scored = np.array([0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0], dtype=np.float32)
+    ball_hit = np.array([1, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 1], dtype=np.float32)
+    states = np.zeros((len(rewards), STATE_DIM), dtype=np.float32)
+    states[:, layout.DIFF_IN_SCORE_INDEX] = scored
+    states[:, layout.GAME_INFO_START] = ball_hit
+
+    # only the discounting is tested, so the model does not need a session or networks
+    model = BaseReinforcement.__new__(BaseReinforcement)
+    model.discount_factor = 0.9
+    with tf.Graph().as_default():
+        input_rewards = tf.placeholder(tf.float32, (None, 1))
+        input_states = tf.placeholder(tf.float32, (None, STATE_DIM))
+        discounted_rewards = model.discount_rewards(input_rewards, input_states)
+        undivided_rewards = model.discount_rewards(input_rewards, None)
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as session:
+            returns, undivided_returns = session.run(
+                [discounted_rewards, undivided_rewards],
+                feed_dict={input_rewards: rewards[:, None], input_states: states})
+
+    expected = discount_rewards_with_loop(rewards, scored, ball_hit, model.discount_factor)
+    assert returns.shape == (len(rewards), 1)
+    assert np.allclose(returns[:, 0], expected)
+    # nothing is carried over the goal or from after the kickoff
+    assert np.isclose(returns[3, 0], 5.0) and np.isclose(returns[6, 0], 2.0)
+    expected = discount_rewards_with_loop(rewards, np.zeros_like(scored), np.ones_like(ball_hit),
+                                          model.discount_factor)
+    assert np.allclose(undivided_returns[:, 0], expected)
+
+
+if __name__ == '__main__':
+    test_discount_rewards_resets_at_episode_ends()
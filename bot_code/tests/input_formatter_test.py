@@ -0,0 +1,118 @@
+import ctypes
+import random
+
+import numpy as np
+
+import game_data_struct as gd
+from bot_code.conversions.input.input_formatter import InputFormatter
+from bot_code.conversions.input.vectorized_input_formatter import VectorizedInputFormatter, mirror_states
+
+NAMES = ['', 'Saltie', 'SaltieRand', 'Salt', 'atba', 'atba(2)']
+
+
+def create_random_packet(num_cars):
+    packet = gd.GameTickPacket()
+    packet.numCars = num_cars
+    for i in range(gd.MAX_PLAYERS):
+        car = packet.gamecars[i]
+        for vector in [car.Location, car.Velocity, car.AngularVelocity]:
+            vector.X, vector.Y, vector.Z = np.random.uniform(-5000, 5000, 3)
+        car.Rotation.Pitch, car.Rotation.Yaw, car.Rotation.Roll = np.random.randint(-32768, 32768, 3).tolist()
+        car.Score.Score, car.Score.Goals, car.Score.OwnGoals, car.Score.Assists, car.Score.Saves, \
+            car.Score.Shots, car.Score.Demolitions = np.random.randint(0, 5, 7).tolist()
+        car.bDemolished, car.bOnGround, car.bSuperSonic, car.bBot, car.bJumped, car.bDoubleJumped = \
+            np.random.randint(0, 2, 6).astype(bool).tolist()
+        car.wName = random.choice(NAMES)
+        car.Team = random.randint(0, 1)
+        car.Boost = random.randint(0, 100)
+    ball = packet.gameball
+    for vector in [ball.Location, ball.Velocity, ball.AngularVelocity, ball.Acceleration,
+                   ball.LatestTouch.sHitLocation, ball.LatestTouch.sHitNormal]:
+        vector.X, vector.Y, vector.Z = np.random.uniform(-5000, 5000, 3)
+    ball.Rotation.Pitch, ball.Rotation.Yaw, ball.Rotation.Roll = np.random.randint(-32768, 32768, 3).tolist()
+    ball.LatestTouch.wPlayerName = random.choice(NAMES)
+    for i in range(gd.MAX_BOOSTS):
+        packet.gameBoosts[i].bActive = random.random() > 0.5
+        packet.gameBoosts[i].Timer = random.randint(0, 10)
+    packet.gameInfo.bBallHasBeenHit = random.random() > 0.5
+    packet.gameInfo.TimeSeconds = random.uniform(0, 300)
+    return packet
+
+
+def test_vectorized_matches_input_formatter():
+    """
+    Test that the vectorized formatter returns exactly what the attribute based formatter returns
+    for every team size, team and index, over consecutive frames so the score difference is covered too.
+    """
+    np.random.seed(0)
+    random.seed(0)
+    for num_cars in range(0, 7):
+        for team in [0, 1]:
+            for index in range(max(num_cars, 1)):
+                formatter = InputFormatter(team, index)
+                vectorized_formatter = VectorizedInputFormatter(team, index)
+                for frame in range(5):
+                    packet = create_random_packet(num_cars)
+                    expected = formatter.create_input_array(packet, passed_time=frame * 0.016)
+                    result = vectorized_formatter.create_input_array(packet, passed_time=frame * 0.016)
+                    if len(expected) != len(result):
+                        # InputFormatter makes longer arrays for teams bigger than 3
+                        continue
+                    assert result.dtype == expected.dtype
+                    assert np.array_equal(expected, result), np.argwhere(expected != result)
+
+
+def test_vectorized_reuses_packet():
+    """Test that a packet that is reused and rewritten between calls is read fresh every time"""
+    np.random.seed(1)
+    random.seed(1)
+    formatter = InputFormatter(0, 0)
+    vectorized_formatter = VectorizedInputFormatter(0, 0)
+    packet = gd.GameTickPacket()
+    for frame in range(10):
+        new_packet = create_random_packet(random.randint(1, 6))
+        ctypes.memmove(ctypes.addressof(packet), ctypes.addressof(new_packet), ctypes.sizeof(gd.GameTickPacket))
+        expected = formatter.create_input_array(packet)
+        result = vectorized_formatter.create_input_array(packet)
+        if len(expected) == len(result):
+            assert np.array_equal(expected, result)
+
+
+def test_vectorized_removes_nans():
+    packet = create_random_packet(2)
+    packet.gameball.Location.X = float('nan')
+    packet.gamecars[1].Velocity.Y = float('nan')
+    expected = InputFormatter(0, 0).create_input_array(packet)
+    result = VectorizedInputFormatter(0, 0).create_input_array(packet)
+    assert np.array_equal(expected, result)
+
+
+def test_team_one_does_not_modify_packet():
+    packet = create_random_packet(4)
+    original = bytes(packet)
+    InputFormatter(1, 0).create_input_array(packet)
+    assert bytes(packet) == original
+    VectorizedInputFormatter(1, 0).create_input_array(packet)
+    assert bytes(packet) == original
+
+
+def test_mirror_states_batch():
+    """Test that mirroring a batch of states matches creating them from rotated packets and that it undoes itself"""
+    np.random.seed(2)
+    random.seed(2)
+    packets = [create_random_packet(random.randint(0, 6)) for _ in range(20)]
+    rotated_packets = [gd.GameTickPacket.from_buffer_copy(packet) for packet in packets]
+    for packet in rotated_packets:
+        gd.rotate_game_tick_packet_boost_omitted(packet)
+    states = np.stack([VectorizedInputFormatter(0, 0).create_input_array(packet) for packet in packets])
+    expected = np.stack([VectorizedInputFormatter(0, 0).create_input_array(packet) for packet in rotated_packets])
+    mirrored = mirror_states(states)
+    assert np.array_equal(expected, mirrored)
+    assert np.array_equal(states, mirror_states(mirrored))
+
+if __name__ == '__main__':
+    test_vectorized_matches_input_formatter()
+    test_vectorized_reuses_packet()
+    test_vectorized_removes_nans()
+    test_team_one_does_not_modify_packet()
+    test_mirror_states_batch()
@@ -0,0 +1,97 @@
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from bot_code.conversions import binary_converter
+from bot_code.conversions.input import input_formatter
+from bot_code.trainer.utils.process_pool_decoder import ProcessPoolDecoder
+
+STATE_DIM = input_formatter.get_state_dim()
+
+
+def create_replay(file, num_frames, codec):
+    writer = binary_converter.ColumnarFileWriter(file, num_frames, False, codec=codec)
+    input_array = np.random.uniform(-100, 100, (num_frames, STATE_DIM)).astype(np.float32)
+    output_array = np.random.uniform(-1, 1, (num_frames, binary_converter.CONTROLLER_DIM)).astype(np.float32)
+    writer.write_frames(input_array, output_array)
+    writer.close()
+    return input_array, output_array
+
+
+def test_files_decode_in_order():
+    """Test that every file comes back whole and in the order it was started, from paths and from memory"""
+    np.random.seed(0)
+    folder = tempfile.mkdtemp()
+    files = []
+    expected = []
+    for i, num_frames in enumerate([250, 40, 0, 130, 300]):
+        if i % 2 == 0:
+            file = os.path.join(folder, str(i) + binary_converter.COLUMNAR_EXTENSION)
+            expected.append(create_replay(file, num_frames, None))
+        else:
+            file = io.BytesIO()
+            expected.append(create_replay(file, num_frames, binary_converter.GZIP_CODEC))
+        files.append(file)
+    files.append(os.path.join(folder, 'missing.bin'))
+
+    decoder = ProcessPoolDecoder(2, batch_rows=64, blocks_per_process=2)
+    decoder.start()
+    try:
+        for file in files:
+            decoder.submit(file)
+        decoder.finish()
+        decoded = []
+        for batches in decoder.iter_files():
+            batches = list(batches)
+            assert all(len(batch[0]) <= 64 for batch in batches)
+            decoded.append(batches)
+    finally:
+        decoder.close()
+
+    # The missing file ends without batches
+    assert len(decoded) == len(files)
+    for batches in decoded:
+        if len(batches) == 0:
+            continue
+        num_frames = batches[0][2]['hashed_name']
+        input_array, output_array = next(pair for pair in expected if len(pair[0]) == num_frames)
+        assert [batch[2]['pair_number'] for batch in batches] == list(range(0, num_frames, 64))
+        assert np.array_equal(np.concatenate([batch[0] for batch in batches]), input_array)
+        assert np.array_equal(np.concatenate([batch[1] for batch in batches]), output_array)
+    assert sum(len(batches) > 0 for batches in decoded) == 4
+
+
+def test_files_submitted_from_threads():
+    """Test that files submitted from several threads while the task queue is full each get their own number"""
+    num_threads = 4
+    files_per_thread = 20
+    decoder = ProcessPoolDecoder(2)
+    # no processes are started, a slow reader keeps the queue full so the submitting threads wait in it together
+    decoder.task_queue = queue.Queue(maxsize=4)
+    file_numbers = []
+
+    def read_tasks():
+        for _ in range(num_threads * files_per_thread):
+            time.sleep(0.001)
+            file_numbers.append(decoder.task_queue.get()[0])
+
+    def submit_files():
+        for _ in range(files_per_thread):
+            decoder.submit('replay' + binary_converter.COLUMNAR_EXTENSION)
+
+    threads = [threading.Thread(target=read_tasks)] + [threading.Thread(target=submit_files)
+                                                         for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(file_numbers) == list(range(num_threads * files_per_thread))
+
+if __name__ == '__main__':
+    test_files_decode_in_order()
+    test_files_submitted_from_threads()
@@ -0,0 +1,85 @@
+import io
+import os
+import tempfile
+
+import numpy as np
+
+from bot_code.conversions import binary_converter
+from bot_code.conversions.input import input_formatter
+from bot_code.conversions.replay_cache import ReplayCache
+
+STATE_DIM = input_formatter.get_state_dim()
+
+
+def create_downloaded_replay(num_frames):
+    """:return: The bytes of a gzipped version 5 replay, like the server sends"""
+    input_array = np.random.uniform(-100, 100, (num_frames, STATE_DIM)).astype(np.float32)
+    output_array = np.random.uniform(-1, 1, (num_frames, binary_converter.CONTROLLER_DIM)).astype(np.float32)
+    file = io.BytesIO()
+    with binary_converter.open_compressed_file(file) as f:
+        binary_converter.write_version_info(f, binary_converter.TIME_ADDITION_FILE_VERSION)
+        binary_converter.write_bot_hash(f, 1234)
+        binary_converter.write_is_eval(f, False)
+        binary_converter.write_array_to_file(f, input_array.ravel())
+        binary_converter.write_array_to_file(f, output_array.ravel())
+    return file.getvalue(), input_array, output_array
+
+
+def test_cache_decodes_and_evicts():
+    np.random.seed(0)
+    folder = tempfile.mkdtemp()
+    replays = [create_downloaded_replay(100) for _ in range(3)]
+    frame_bytes = (STATE_DIM + binary_converter.CONTROLLER_DIM) * 4
+    # Room for two replays of 100 frames and their headers and indexes, not three
+    cache = ReplayCache(folder, max_bytes=int(2.5 * 100 * frame_bytes), pin_seconds=0)
+    assert cache.get('a.bin.gz') is None
+
+    path = cache.put('replays/a.bin.gz', replays[0][0])
+    assert cache.get('a.bin.gz') == path
+    inputs, outputs, header = binary_converter.open_columnar_memmap(path)
+    assert header.hashed_name == 1234
+    assert np.array_equal(inputs, replays[0][1])
+    assert np.array_equal(outputs, replays[0][2])
+    del inputs, outputs
+
+    # The same content under another name is stored once
+    assert cache.put('copy-of-a.bin.gz', replays[0][0]) == path
+    assert len(os.listdir(cache.object_folder)) == 1
+
+    cache.put('b.bin.gz', replays[1][0])
+    cache.get('a.bin.gz')
+    cache.get('copy-of-a.bin.gz')
+    cache.put('c.bin.gz', replays[2][0])
+    # b was used the longest time ago
+    assert cache.get('b.bin.gz') is None
+    assert cache.get('a.bin.gz') == path
+    assert cache.get('c.bin.gz') is not None
+    assert len(os.listdir(cache.object_folder)) == 2
+
+    assert cache.put('broken.bin.gz', b'not a replay') is None
+    cache.close()
+
+
+def test_cache_keeps_pinned_replays():
+    np.random.seed(0)
+    folder = tempfile.mkdtemp()
+    replays = [create_downloaded_replay(100) for _ in range(3)]
+    frame_bytes = (STATE_DIM + binary_converter.CONTROLLER_DIM) * 4
+    cache = ReplayCache(folder, max_bytes=int(1.5 * 100 * frame_bytes), pin_seconds=60)
+
+    # Every replay was just handed out, so none of them is removed even though they do not fit
+    paths = [cache.put(name, replay[0]) for name, replay in zip(['a.bin.gz', 'b.bin.gz', 'c.bin.gz'], replays)]
+    assert all(os.path.exists(path) for path in paths)
+    assert cache.get('a.bin.gz') == paths[0]
+
+    # Once the pins run out the least recently used ones go
+    cache.pin_seconds = 0
+    cache.put('d.bin.gz', create_downloaded_replay(100)[0])
+    assert cache.get('a.bin.gz') is None and cache.get('b.bin.gz') is None and cache.get('c.bin.gz') is None
+    assert len(os.listdir(cache.object_folder)) == 1
+    cache.close()
+
+
+if __name__ == '__main__':
+    test_cache_decodes_and_evicts()
+    test_cache_keeps_pinned_replays()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+
+import numpy as np
+
+from bot_code.conversions import binary_converter
+from bot_code.conversions import replay_converter
+
+
+def write_stream_replay(file_name, file_version, input_array, output_array, codec, frames_per_array):
+    with binary_converter.open_compressed_file(file_name, codec) as f:
+        binary_converter.write_version_info(f, file_version)
+        binary_converter.write_bot_hash(f, 1234)
+        binary_converter.write_is_eval(f, False)
+        for start in range(0, len(input_array), frames_per_array):
+            binary_converter.write_array_to_file(f, input_array[start:start + frames_per_array].ravel())
+            binary_converter.write_array_to_file(f, output_array[start:start + frames_per_array].ravel())
+
+
+def create_source_folder():
+    np.random.seed(0)
+    source_folder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(source_folder, 'bot'))
+    replays = {}
+    for file_name, file_version, state_dim, codec, frames_per_array in [
+            ('old-0.gz', binary_converter.BATCH_ARRAY_FILE_VERSION, 206, binary_converter.GZIP_CODEC, 1),
+            ('bot/bot-1.bin.gz', binary_converter.BATCH_ARRAY_FILE_VERSION, 206, binary_converter.GZIP_CODEC, 40),
+            ('bot/bot-2.bin.bz2', binary_converter.TIME_ADDITION_FILE_VERSION, 219, binary_converter.BZ2_CODEC, 35)]:
+        input_array = np.random.uniform(-100, 100, (90, state_dim)).astype(np.float32)
+        output_array = np.random.uniform(-1, 1, (90, binary_converter.CONTROLLER_DIM)).astype(np.float32)
+        write_stream_replay(os.path.join(source_folder, file_name), file_version, input_array, output_array,
+                            codec, frames_per_array)
+        replays[file_name] = replay_converter.checksum_replay(os.path.join(source_folder, file_name))
+    return source_folder, replays
+
+
+def test_migration_resumes_from_journal():
+    """Test that every readable version is converted with the same frames and that a second run skips them"""
+    source_folder, replays = create_source_folder()
+    output_folder = os.path.join(source_folder, 'converted')
+    assert replay_converter.migrate(source_folder, output_folder, num_processes=1, batch_rows=32) == (3, 0, 0)
+    for file_name, checksum in replays.items():
+        assert checksum.frames == 90
+        output_file = os.path.join(output_folder, replay_converter.get_output_name(file_name))
+        assert output_file.endswith(binary_converter.COLUMNAR_EXTENSION)
+        with open(output_file, 'rb') as f:
+            assert binary_converter.get_file_version(f)[0] == binary_converter.COLUMNAR_FILE_VERSION
+        assert replay_converter.checksum_replay(output_file).get_checksum() == checksum.get_checksum()
+
+    # The output folder is inside the source folder, the converted replays must not be converted again
+    assert replay_converter.migrate(source_folder, output_folder, num_processes=1) == (0, 3, 0)
+
+    # A crash in the middle of writing the journal leaves a partial line, that replay is converted again
+    journal_file = os.path.join(output_folder, replay_converter.JOURNAL_FILE_NAME)
+    with open(journal_file, 'r') as f:
+        lines = f.readlines()
+    with open(journal_file, 'w') as f:
+        f.writelines(lines[:2])
+        f.write(lines[2][:5])
+    assert replay_converter.migrate(source_folder, output_folder, num_processes=1) == (1, 2, 0)
+
+
+def test_migration_skips_colliding_replays():
+    """Test that replays that would be converted into the same file are left alone"""
+    source_folder, replays = create_source_folder()
+    input_array = np.zeros((10, 206), dtype=np.float32)
+    output_array = np.zeros((10, binary_converter.CONTROLLER_DIM), dtype=np.float32)
+    write_stream_replay(os.path.join(source_folder, 'bot', 'bot-1.gz'), binary_converter.BATCH_ARRAY_FILE_VERSION,
+                        input_array, output_array, binary_converter.GZIP_CODEC, 10)
+    output_folder = os.path.join(source_folder, 'converted')
+    assert replay_converter.migrate(source_folder, output_folder, num_processes=1) == (2, 0, 2)
+    assert not os.path.exists(os.path.join(output_folder, 'bot', 'bot-1' + binary_converter.COLUMNAR_EXTENSION))
+    assert replay_converter.read_journal(os.path.join(output_folder, replay_converter.JOURNAL_FILE_NAME)) == {
+        'old-0.gz', os.path.join('bot', 'bot-2.bin.bz2')}
+
+
+def test_migration_rejects_unreadable_versions():
+    """Test that replays older than version 4 fail with an error instead of being converted with a guessed layout"""
+    source_folder = tempfile.mkdtemp()
+    input_array = np.zeros((10, 206), dtype=np.float32)
+    output_array = np.zeros((10, binary_converter.CONTROLLER_DIM), dtype=np.float32)
+    source_file = os.path.join(source_folder, 'old-0.gz')
+    write_stream_replay(source_file, binary_converter.IS_EVAL_FILE_VERSION, input_array, output_array,
+                        binary_converter.GZIP_CODEC, 1)
+    output_folder = os.path.join(source_folder, 'converted')
+    output_file = os.path.join(output_folder, replay_converter.get_output_name('old-0.gz'))
+    relative_name, status, frames, checksum, error = replay_converter.convert_replay(
+        ('old-0.gz', source_file, output_file, None, 0, 32))
+    assert 'version ' + str(binary_converter.IS_EVAL_FILE_VERSION) in error
+    assert not os.path.exists(output_file)
+    assert replay_converter.migrate(source_folder, output_folder, num_processes=1) == (0, 0, 1)
+
+
+if __name__ == '__main__':
+    test_migration_resumes_from_journal()
+    test_migration_skips_colliding_replays()
+    test_migration_rejects_unreadable_versions()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+
+import numpy as np
+
+from bot_code.conversions import binary_converter
+from bot_code.conversions.input import input_formatter
+from bot_code.trainer.utils.replay_manifest import ReplayManifest
+
+STATE_DIM = input_formatter.get_state_dim()
+
+
+def write_replay(file_name, hashed_name, is_eval, num_frames, codec=None):
+    writer = binary_converter.ColumnarFileWriter(file_name, hashed_name, is_eval, codec=codec)
+    for start in range(0, num_frames, 40):
+        frames = min(40, num_frames - start)
+        writer.write_frames(np.zeros((frames, STATE_DIM), dtype=np.float32),
+                            np.zeros((frames, binary_converter.CONTROLLER_DIM), dtype=np.float32))
+    writer.close()
+
+
+def write_stream_replay(file_name, hashed_name, num_frames, frames_per_array=40):
+    with binary_converter.open_compressed_file(file_name) as f:
+        binary_converter.write_version_info(f, binary_converter.TIME_ADDITION_FILE_VERSION)
+        binary_converter.write_bot_hash(f, hashed_name)
+        binary_converter.write_is_eval(f, False)
+        for start in range(0, num_frames, frames_per_array):
+            frames = min(frames_per_array, num_frames - start)
+            binary_converter.write_array_to_file(f, np.zeros(frames * STATE_DIM, dtype=np.float32))
+            binary_converter.write_array_to_file(f, np.zeros(frames * binary_converter.CONTROLLER_DIM,
+                                                             dtype=np.float32))
+
+
+def replay_name(name):
+    return name + binary_converter.COLUMNAR_EXTENSION
+
+
+def test_manifest_updates_incrementally():
+    folder = tempfile.mkdtemp()
+    replay_folder = os.path.join(folder, 'replays')
+    os.makedirs(os.path.join(replay_folder, 'ignore'))
+    write_replay(os.path.join(replay_folder, replay_name('a-0')), 11, False, 100)
+    write_replay(os.path.join(replay_folder, replay_name('b-0')), 22, True, 30, binary_converter.GZIP_CODEC)
+    write_replay(os.path.join(replay_folder, 'ignore', replay_name('c-0')), 11, False, 100)
+    with open(os.path.join(replay_folder, 'broken.bin.gz'), 'wb') as f:
+        f.write(b'not a replay')
+    # An uncompressed stream file the writer has not finished is not a replay
+    with open(os.path.join(replay_folder, 'd-0' + binary_converter.LEGACY_EXTENSION), 'wb') as f:
+        f.write(b'half written')
+
+    with ReplayManifest(os.path.join(folder, 'manifest.sqlite')) as manifest:
+        assert manifest.update(replay_folder) == (3, 0)
+        info = manifest.get_info(os.path.join(replay_folder, replay_name('a-0')))
+        assert info['file_version'] == binary_converter.COLUMNAR_FILE_VERSION
+        assert info['frame_count'] == 100 and info['chunk_count'] == 3
+        assert info['hashed_name'] == '11' and info['is_eval'] == 0
+
+        # Broken replays are remembered so they are not opened again, but never selected
+        assert len(manifest.select()) == 2
+        assert manifest.select(is_eval=True) == [os.path.join(replay_folder, replay_name('b-0'))]
+        assert manifest.select(hashed_name=11) == [os.path.join(replay_folder, replay_name('a-0'))]
+        assert manifest.select(min_frames=50) == [os.path.join(replay_folder, replay_name('a-0'))]
+        assert manifest.update(replay_folder) == (0, 0)
+
+        write_replay(os.path.join(replay_folder, replay_name('b-0')), 22, True, 60)
+        os.utime(os.path.join(replay_folder, replay_name('b-0')), (0, 0))
+        os.remove(os.path.join(replay_folder, replay_name('a-0')))
+        assert manifest.update(replay_folder) == (1, 1)
+        assert manifest.select(min_frames=50) == [os.path.join(replay_folder, replay_name('b-0'))]
+
+
+def test_manifest_counts_older_replays_lazily():
+    folder = tempfile.mkdtemp()
+    replay_folder = os.path.join(folder, 'replays')
+    os.makedirs(replay_folder)
+    short_replay = os.path.join(replay_folder, 'short.bin.gz')
+    long_replay = os.path.join(replay_folder, 'long.bin.gz')
+    write_stream_replay(short_replay, 11, 30)
+    write_stream_replay(long_replay, 22, 100)
+
+    with ReplayManifest(os.path.join(folder, 'manifest.sqlite')) as manifest:
+        # Only the headers are read, the frame counts are not known yet and are not filtered on
+        assert manifest.update(replay_folder) == (2, 0)
+        info = manifest.get_info(short_replay)
+        assert info['file_version'] == binary_converter.TIME_ADDITION_FILE_VERSION and info['hashed_name'] == '11'
+        assert info['frame_count'] is None and info['chunk_count'] is None
+        assert manifest.select(min_frames=50) == [long_replay, short_replay]
+
+        assert manifest.fill_frame_counts(limit=1) == 1
+        assert manifest.fill_frame_counts() == 1
+        assert manifest.fill_frame_counts() == 0
+        info = manifest.get_info(long_replay)
+        assert info['frame_count'] == 100 and info['chunk_count'] == 3
+        assert manifest.select(min_frames=50) == [long_replay]
+
+
+if __name__ == '__main__':
+    test_manifest_updates_incrementally()
+    test_manifest_counts_older_replays_lazily()
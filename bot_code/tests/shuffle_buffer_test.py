@@ -0,0 +1,41 @@
+import numpy as np
+
+from bot_code.trainer.utils.shuffle_buffer import ShuffleBuffer
+
+
+def test_shuffle_buffer_mixes_files():
+    capacity = 300
+    batch_size = 50
+    buffer = ShuffleBuffer(capacity, batch_size, seed=0)
+    batches = []
+
+    def process_batch(inputs, labels):
+        # Rows are written with their number and the label holds the same number
+        assert np.array_equal(inputs[:, 0], labels[:, 0])
+        batches.append(np.array(inputs[:, 0]))
+
+    frames = 0
+    emitted_after_file = []
+    for file_number in range(10):
+        # Every file gets rows numbered file_number * 1000 and up
+        rows = np.arange(file_number * 1000, file_number * 1000 + 120, dtype=np.float32)
+        buffer.add(np.tile(rows[:, None], (1, 3)), rows[:, None], process_batch)
+        frames += len(rows)
+        emitted_after_file.append(len(batches))
+
+    # Nothing goes out until the buffer is full, then a batch for every batch_size frames that come in
+    for file_number, emitted in enumerate(emitted_after_file):
+        assert emitted == max(0, (file_number + 1) * 120 - capacity) // batch_size
+    # A batch is made of frames from several files
+    assert all(len(np.unique(batch // 1000)) > 1 for batch in batches)
+
+    buffer.flush(process_batch)
+    assert all(len(batch) <= batch_size for batch in batches)
+    emitted = np.sort(np.concatenate(batches))
+    expected = np.sort(np.concatenate([np.arange(n * 1000, n * 1000 + 120) for n in range(10)]))
+    assert len(emitted) == frames
+    assert np.array_equal(emitted, expected)
+
+
+if __name__ == '__main__':
+    test_shuffle_buffer_mixes_files()
@@ -1,11 +1,15 @@
-import gzip
 import io
+import os
+import threading
 import time
 
 from bot_code.conversions import binary_converter
+from bot_code.conversions.frame_filter import FrameFilter, parse_predicates
+from bot_code.conversions.replay_cache import ReplayCache
 from bot_code.conversions.server_converter import ServerConverter
 from bot_code.trainer.base_classes.base_trainer import BaseTrainer
 from bot_code.trainer.utils.file_download_manager import get_file_get_function, get_file_list_get_function
+from bot_code.trainer.utils.process_pool_decoder import ProcessPoolDecoder
 from bot_code.trainer.utils.threaded_file_downloader import ThreadedFileDownloader
 
 
@@ -20,6 +24,14 @@ class DownloadTrainer(BaseTrainer):
     num_downloader_threads = None
     num_trainer_threads = None
     should_batch_process = None
+    batch_rows = None
+    num_decoder_processes = None
+    decoder = None
+    replay_hashed_name = None
+    min_replay_frames = None
+    replay_cache_folder = None
+    replay_cache_megabytes = None
+    frame_filter = None
 
     def load_config(self):
         super().load_config()
@@ -52,9 +64,55 @@ class DownloadTrainer(BaseTrainer):
                                                    'batch_process')
         except Exception as e:
             self.should_batch_process = False
+        try:
+            self.batch_rows = config.getint(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER, 'batch_rows')
+        except Exception as e:
+            self.batch_rows = binary_converter.DEFAULT_BATCH_ROWS
+        try:
+            self.num_decoder_processes = config.getint(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER,
+                                                       'number_decoder_processes')
+        except Exception as e:
+            self.num_decoder_processes = 0
+        try:
+            self.replay_hashed_name = config.get(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER, 'replay_hashed_name')
+        except Exception as e:
+            self.replay_hashed_name = None
+        try:
+            self.min_replay_frames = config.getint(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER, 'min_replay_frames')
+        except Exception as e:
+            self.min_replay_frames = None
+        try:
+            self.replay_cache_folder = config.get(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER, 'replay_cache_folder')
+        except Exception as e:
+            self.replay_cache_folder = os.path.join('training', 'replay_cache')
+        try:
+            self.replay_cache_megabytes = config.getint(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER,
+                                                        'replay_cache_megabytes')
+        except Exception as e:
+            self.replay_cache_megabytes = 10240
+        try:
+            filter_duplicates = config.getboolean(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER, 'filter_duplicates')
+        except Exception as e:
+            filter_duplicates = False
+        try:
+            filter_no_passed_time = config.getboolean(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER,
+                                                      'filter_no_passed_time')
+        except Exception as e:
+            filter_no_passed_time = False
+        try:
+            filter_predicates = parse_predicates(config.get(self.DOWNLOAD_TRAINER_CONFIGURATION_HEADER,
+                                                            'filter_predicates'))
+        except Exception as e:
+            filter_predicates = []
+        if filter_duplicates or filter_no_passed_time or len(filter_predicates) > 0:
+            self.frame_filter = FrameFilter(filter_duplicates, filter_no_passed_time, filter_predicates)
 
     def load_server(self):
         self.input_server = ServerConverter('http://saltie.tk:5000', False, False, False)
+        if self.replay_cache_megabytes > 0:
+            # Later runs over the same replays read them from disk instead of downloading them again
+            self.input_server.set_replay_cache(ReplayCache(self.replay_cache_folder,
+                                                           self.replay_cache_megabytes * 1024 * 1024))
 
     def setup_trainer(self):
         """
@@ -64,15 +122,49 @@ class DownloadTrainer(BaseTrainer):
         if self.download_files:
             self.load_server()
         self.get_file_function = get_file_get_function(self.download_files, self.input_server)
-        self.get_file_list_get_function = get_file_list_get_function(self.download_files, self.input_server)
+        # Local replays can be picked by what is in them, the manifest knows that without opening them
+        self.get_file_list_get_function = get_file_list_get_function(self.download_files, self.input_server,
+                                                                     hashed_name=self.replay_hashed_name,
+                                                                     min_frames=self.min_replay_frames)
+        file_processor_function = self.process_file
+        if self.num_decoder_processes > 0:
+            # The downloader threads only queue files, this thread trains on them once they are decoded
+            self.decoder = ProcessPoolDecoder(self.num_decoder_processes, self.batch_rows,
+                                              frame_filter=self.frame_filter)
+            file_processor_function = self.decoder.submit
         self.download_manager = ThreadedFileDownloader(self.max_files, self.num_downloader_threads,
                                                        self.num_trainer_threads, self.get_file_list_get_function,
-                                                       self.get_file_function, self.process_file, self.batches)
+                                                       self.get_file_function, file_processor_function, self.batches)
 
     def _run_trainer(self):
-        self.download_manager.create_and_run_workers()
+        if self.decoder is None:
+            self.download_manager.create_and_run_workers()
+        else:
+            self.train_decoded_files()
+        if self.frame_filter is not None and self.decoder is None:
+            print(self.frame_filter.create_report())
         self.end_everything()
 
+    def download_and_decode(self):
+        self.download_manager.create_and_run_workers()
+        self.decoder.finish()
+
+    def train_decoded_files(self):
+        """
+        Trains on the files as the decoder processes finish them, while the files are downloaded on another thread.
+        """
+        self.decoder.start()
+        downloader = threading.Thread(target=self.download_and_decode)
+        downloader.daemon = True
+        downloader.start()
+        try:
+            for batches in self.decoder.iter_files():
+                start = time.time()
+                self.train_batches(batches)
+                print('trained file in', str(time.time() - start), '\bs\n\n')
+        finally:
+            self.decoder.close()
+
     def start_new_file(self):
         """
         Called when it is time to start training on a new file
@@ -109,17 +201,24 @@ class DownloadTrainer(BaseTrainer):
         """Called after all files have been trained and training is complete"""
 
     def train_file(self, file):
+        self.train_batches(binary_converter.iter_batches(file, self.batch_rows, self.frame_filter))
+
+    def train_batches(self, batches):
+        """
+        Trains on all the batches of a single file.
+        :param batches: An iterable of (input_array, output_array, meta) like binary_converter.iter_batches
+        """
         self.start_new_file()
-        if self.should_batch_process:
-            try:
-                binary_converter.read_data(file, self.process_pair_batch, batching=True)
-            except Exception as e:
-                print('error batch training on file ', e)
-        else:
-            try:
-                binary_converter.read_data(file, self.process_pair, batching=False)
-            except Exception as e:
-                print('error training on file ', e)
+        try:
+            for input_array, output_array, meta in batches:
+                pair_number = meta['pair_number']
+                if self.should_batch_process:
+                    self.process_pair_batch(input_array, output_array, pair_number, meta['hashed_name'])
+                else:
+                    for i in range(len(input_array)):
+                        self.process_pair(input_array[i], output_array[i], pair_number + i, meta['hashed_name'])
+        except Exception as e:
+            print('error training on file ', e)
         self.end_file()
 
     def process_file(self, input_file):
@@ -133,14 +232,9 @@ class DownloadTrainer(BaseTrainer):
         start = time.time()
 
         try:
-            if isinstance(input_file, io.BytesIO):
-                # file in memory
-                with gzip.GzipFile(fileobj=input_file, mode='rb') as f:
-                    self.train_file(f)
-            else:
-                # file on disk
-                with gzip.open(input_file, 'rb') as f:
-                    self.train_file(f)
+            # works for files in memory and on disk, whichever codec they were written with
+            with binary_converter.open_decompressed_file(input_file) as f:
+                self.train_file(f)
         except FileNotFoundError as e:
             print('whoops file not found')
             print(e.filename)
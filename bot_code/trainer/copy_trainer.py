@@ -1,12 +1,18 @@
+import time
+
 import numpy as np
+import tensorflow as tf
 
 from bot_code.trainer.base_classes.default_model_trainer import DefaultModelTrainer
 from bot_code.trainer.base_classes.download_trainer import DownloadTrainer
 from bot_code.trainer.utils import controller_statistics
+from bot_code.trainer.utils.replay_dataset import ReplayDataset, DEFAULT_CYCLE_LENGTH, DEFAULT_SHUFFLE_BUFFER
+from bot_code.trainer.utils.shuffle_buffer import ShuffleBuffer
 from bot_code.trainer.utils.trainer_runner import run_trainer
 
 
 class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
+    COPY_CONFIGURATION_HEADER = 'Copy Configuration'
 
     should_shuffle = False
     file_number = 0
@@ -22,6 +28,12 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
     eval_number = 30
     controller_stats = None
     action_length = None
+    use_dataset = False
+    dataset_epochs = 1
+    shuffle_buffer_frames = None
+    interleaved_files = None
+    dataset = None
+    shuffle_buffer = None
 
     def load_config(self):
         super().load_config()
@@ -31,6 +43,22 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
                                                    'download_files')
         except Exception as e:
             self.should_shuffle = True
+        try:
+            self.use_dataset = config.getboolean(self.COPY_CONFIGURATION_HEADER, 'use_dataset')
+        except Exception as e:
+            self.use_dataset = False
+        try:
+            self.dataset_epochs = config.getint(self.COPY_CONFIGURATION_HEADER, 'dataset_epochs')
+        except Exception as e:
+            self.dataset_epochs = 1
+        try:
+            self.shuffle_buffer_frames = config.getint(self.COPY_CONFIGURATION_HEADER, 'shuffle_buffer')
+        except Exception as e:
+            self.shuffle_buffer_frames = DEFAULT_SHUFFLE_BUFFER
+        try:
+            self.interleaved_files = config.getint(self.COPY_CONFIGURATION_HEADER, 'interleaved_files')
+        except Exception as e:
+            self.interleaved_files = DEFAULT_CYCLE_LENGTH
 
     def get_config_name(self):
         return 'copy_trainer.cfg'
@@ -47,7 +75,14 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
     def setup_model(self):
         super().setup_model()
         self.model.create_model()
-        self.model.create_copy_training_model()
+        if self.use_dataset:
+            inputs, labels = self.model.create_dataset_inputs(self.create_dataset().create_dataset())
+            self.model.create_copy_training_model(model_input=inputs, taken_actions=labels)
+        else:
+            self.model.create_copy_training_model()
+            if self.should_shuffle and self.shuffle_buffer_frames > 0:
+                # Batches mix frames of many replays instead of coming from a single game
+                self.shuffle_buffer = ShuffleBuffer(max(self.shuffle_buffer_frames, self.batch_size), self.batch_size)
         self.model.create_savers()
         self.model.initialize_model()
         self.controller_stats = controller_statistics.OutputChecks(self.sess, self.action_handler,
@@ -55,6 +90,43 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
                                                                    model_placeholder=self.model.input_placeholder)
         self.controller_stats.create_model()
 
+    def create_dataset(self):
+        """
+        A dataset over the replays the downloader would have trained on.
+        Eval replays are not split out, every replay is trained on.
+        """
+        files = self.get_file_list_get_function(self.max_files, False, self.batches)
+        self.dataset = ReplayDataset(files, self.model.state_dim, self.create_labels,
+                                     format_inputs=self.model.input_formatter.format_array,
+                                     get_file_function=self.get_file_function,
+                                     batch_size=self.model.get_dataset_batch_size(),
+                                     cycle_length=self.interleaved_files,
+                                     shuffle_buffer=self.shuffle_buffer_frames if self.should_shuffle else 0,
+                                     batch_rows=self.batch_rows, frame_filter=self.frame_filter)
+        return self.dataset
+
+    def create_labels(self, output_array):
+        return self.action_handler.create_action_indices(output_array)
+
+    def _run_trainer(self):
+        if not self.use_dataset:
+            super()._run_trainer()
+            return
+        for epoch in range(self.dataset_epochs):
+            self.model.initialize_dataset()
+            start = time.time()
+            steps = 0
+            while True:
+                try:
+                    self.model.run_train_step(True)
+                except tf.errors.OutOfRangeError:
+                    break
+                steps += 1
+                self.epoch += 1
+            print('epoch', epoch, 'trained', steps, 'batches in', str(time.time() - start), 'seconds')
+            self.model.save_model(model_path=None, global_step=epoch, quick_save=True)
+        self.end_everything()
+
     def start_new_file(self):
 
         self.input_batch = []
@@ -70,14 +142,8 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
 
     def add_pair(self, input_array, output_array):
         self.input_batch.append(input_array)
-
-        if self.eval_file:
-            label = output_array
-        else:
-            label = self.action_handler.create_action_index(output_array)
-        # print(output_array)
-        # print(label)
-        self.label_batch.append(label)
+        # the labels are created for the whole batch at once
+        self.label_batch.append(output_array)
 
     def unison_shuffled_copies(self, a, b):
         assert len(a) == len(b)
@@ -98,6 +164,24 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
             return
 
         input_batch = np.array(self.input_batch)
+        if self.eval_file:
+            self.label_batch = np.array(self.label_batch, dtype=np.float32)
+        else:
+            self.label_batch = np.array(self.action_handler.create_action_indices(np.array(self.label_batch)),
+                                        dtype=np.float32)
+
+        if self.eval_file:
+            self.controller_stats.get_amounts(input_array=self.input_batch, bot_output=np.transpose(self.label_batch))
+            self.epoch += 1
+        elif self.shuffle_buffer is not None:
+            # Trained on once the buffer swaps them out, mixed with frames of other replays
+            self.shuffle_buffer.add(input_batch, self.label_batch, self.train_batch)
+        else:
+            if self.should_shuffle:
+                input_batch, self.label_batch = self.unison_shuffled_copies(input_batch, self.label_batch)
+            self.train_batch(input_batch, self.label_batch)
+
+    def train_batch(self, input_batch, label_batch):
         input_batch = self.model.input_formatter.format_array(input_batch)
 
         output = np.argwhere(np.isnan(input_batch))
@@ -106,16 +190,8 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
             for index in output:
                 input_batch[index[0]][index[1]] = 0
 
-        self.label_batch = np.array(self.label_batch, dtype=np.float32)
-
-        if self.should_shuffle:
-            input_batch, self.label_batch = self.unison_shuffled_copies(input_batch, self.label_batch)
-
-        if self.eval_file:
-            self.controller_stats.get_amounts(input_array=self.input_batch, bot_output=np.transpose(self.label_batch))
-        else:
-            feed_dict = self.model.create_feed_dict(input_batch, self.label_batch)
-            self.model.run_train_step(True, feed_dict=feed_dict)
+        feed_dict = self.model.create_feed_dict(input_batch, label_batch)
+        self.model.run_train_step(True, feed_dict=feed_dict)
 
         self.epoch += 1
 
@@ -125,6 +201,8 @@ class CopyTrainer(DownloadTrainer, DefaultModelTrainer):
             self.model.save_model(model_path=None, global_step=self.file_number, quick_save=True)
 
     def end_everything(self):
+        if self.shuffle_buffer is not None:
+            self.shuffle_buffer.flush(self.train_batch)
         self.model.save_model()
 
 
@@ -1,5 +1,8 @@
 import os
-import random
+
+from bot_code.trainer.utils.replay_manifest import MANIFEST_FILE_NAME, ReplayManifest, fill_frame_counts_in_background
+
+frame_count_thread = None
 
 
 def get_file_get_function(download, input_server):
@@ -8,32 +11,36 @@ def get_file_get_function(download, input_server):
     else:
         return lambda input_file: input_file
 
-def get_file_list_get_function(download, input_server):
+def get_file_list_get_function(download, input_server, hashed_name=None, min_frames=None):
     if download:
         return input_server.get_replays
     else:
-        return get_all_files
+        return lambda max_files, only_eval, batches=1: get_all_files(max_files, only_eval, batches,
+                                                                     hashed_name=hashed_name, min_frames=min_frames)
 
-def get_all_files(max_files, only_eval):
+def get_training_path():
     dir_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-    training_path = os.path.join(dir_path,'training', 'replays')
-    files = []
-    include_extensions = {'gz'}
-    exclude_paths = {'data', 'ignore'}
-    exclude_files = {''}
-    for (dirpath, dirnames, filenames) in os.walk(training_path):
-        dirnames[:] = [d for d in dirnames if d not in exclude_paths]
-        for file in filenames:
-            skip_file = False
-            if file.split('.')[-1] not in include_extensions:
-                continue
-            for excluded_name in exclude_files:
-                if excluded_name in file and excluded_name != '':
-                    print('exclude file: ' + file)
-                    skip_file = True
-                    break
-            if skip_file:
-                continue
-            files.append(os.path.join(dirpath, file))
-    random.shuffle(files)
-    return files[:max_files]
+    return os.path.join(dir_path, 'training', 'replays')
+
+def get_all_files(max_files, only_eval, batches=1, hashed_name=None, min_frames=None):
+    """
+    Picks random replays from the training folder.
+    The folder is kept in a manifest, only replays that arrived or changed since the last time are opened.
+    only_eval and batches are there to match the server's get_replays, local replays have always been picked
+    from both training and eval replays, at most max_files of them.
+    :param hashed_name: Only picks replays of this bot hash
+    :param min_frames: Only picks replays with at least this many frames,
+        older replays are kept until their frames are counted in the background
+    :return: The paths of at most max_files replays
+    """
+    global frame_count_thread
+    training_path = get_training_path()
+    if not os.path.isdir(training_path):
+        return []
+    manifest_file = os.path.join(training_path, MANIFEST_FILE_NAME)
+    with ReplayManifest(manifest_file) as manifest:
+        manifest.update(training_path)
+        files = manifest.select(hashed_name=hashed_name, min_frames=min_frames, limit=max_files, shuffle=True)
+    if min_frames is not None and (frame_count_thread is None or not frame_count_thread.is_alive()):
+        frame_count_thread = fill_frame_counts_in_background(manifest_file)
+    return files
@@ -0,0 +1,233 @@
+import collections
+import io
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import shared_memory
+from bot_code.conversions import binary_converter
+from bot_code.conversions.input import input_formatter
+
+DEFAULT_BLOCKS_PER_PROCESS = 4
+WORKER_CHECK_SECONDS = 1.0
+
+# Messages the decode processes send back, as (kind, worker_number, file_number, value)
+FILE_STARTED = 0
+BATCH_READY = 1
+FILE_ENDED = 2
+WORKER_EXITED = 3
+
+
+def create_block_view(memory, num_blocks, batch_rows, row_width):
+    """:return: The shared memory as an array of [block, row, column]"""
+    return np.frombuffer(memory, dtype=np.float32, count=num_blocks * batch_rows * row_width).reshape(
+        (num_blocks, batch_rows, row_width))
+
+
+def decode_worker(worker_number, tag, num_blocks, batch_rows, state_dim, task_queue, free_blocks, ready_queue,
+                  frame_filter=None):
+    """
+    The loop of a decode process.
+    Takes files from the task queue, decodes them into the blocks it owns and says which block is ready.
+    :param worker_number: Which process this is
+    :param free_blocks: The queue of blocks owned by this process that the consumer is done with
+    :param frame_filter: A FrameFilter every process gets its own copy of, or None
+    """
+    row_width = state_dim + binary_converter.CONTROLLER_DIM
+    memory = shared_memory.open_shared_memory(tag, num_blocks * batch_rows * row_width * 4)
+    blocks = create_block_view(memory, num_blocks, batch_rows, row_width)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        file_number, file = task
+        if isinstance(file, bytes):
+            file = io.BytesIO(file)
+        ready_queue.put((FILE_STARTED, worker_number, file_number, None))
+        error = None
+        try:
+            with binary_converter.open_decompressed_file(file) as f:
+                for input_array, output_array, meta in binary_converter.iter_batches(f, batch_rows, frame_filter):
+                    if input_array.shape[1] != state_dim:
+                        raise ValueError('can not decode states of size ' + str(input_array.shape[1]))
+                    block_number = free_blocks.get()
+                    block = blocks[block_number]
+                    rows = len(input_array)
+                    block[:rows, :state_dim] = input_array
+                    block[:rows, state_dim:] = output_array
+                    ready_queue.put((BATCH_READY, worker_number, file_number, (block_number, rows, meta)))
+        except Exception as e:
+            error = str(e)
+        ready_queue.put((FILE_ENDED, worker_number, file_number, error))
+    if frame_filter is not None:
+        print('decoder process', worker_number, frame_filter.create_report())
+    ready_queue.put((WORKER_EXITED, worker_number, None, None))
+    del blocks
+    memory.close()
+
+
+class ProcessPoolDecoder:
+    """
+    Decodes replays in worker processes so the training thread only trains.
+
+    Decompressing and parsing a replay holds the GIL, so more trainer threads do not help.
+    Every process owns a few blocks of one shared memory region, each big enough for a batch of frames.
+    A process decodes a file into its free blocks and only sends the block number and the size of the batch
+    back, the frames themselves are never pickled.
+    The consumer copies a batch out of its block and hands the block straight back to its process.
+
+    Files are trained one at a time, in the order the processes started on them.
+    A process only ever waits for its own blocks, which the consumer frees as it trains on the file that
+    process is decoding, so processes that are ahead can not starve the file being trained on.
+    """
+
+    def __init__(self, num_processes, batch_rows=binary_converter.DEFAULT_BATCH_ROWS,
+                 blocks_per_process=DEFAULT_BLOCKS_PER_PROCESS, frame_filter=None):
+        """
+        :param num_processes: How many processes decode files
+        :param batch_rows: How many frames are in a batch
+        :param blocks_per_process: How many batches a process can decode ahead of the consumer
+        :param frame_filter: A FrameFilter the processes drop frames with, each process reports its own counts
+        """
+        self.num_processes = num_processes
+        self.frame_filter = frame_filter
+        self.batch_rows = batch_rows
+        self.blocks_per_process = blocks_per_process
+        self.state_dim = input_formatter.get_state_dim()
+        self.num_blocks = num_processes * blocks_per_process
+        self.tag = 'Local\\SaltieDecoder' + str(os.getpid()) + '_' + str(id(self))
+        self.memory = None
+        self.blocks = None
+        self.task_queue = mp.Queue(maxsize=2 * num_processes)
+        self.ready_queue = mp.Queue()
+        self.free_blocks = [mp.Queue() for _ in range(num_processes)]
+        self.processes = []
+        self.file_counter = 0
+        self.file_counter_lock = threading.Lock()
+        self.started_files = collections.deque()
+        self.file_messages = collections.defaultdict(collections.deque)
+        self.current_files = [None] * num_processes
+        self.exited_workers = set()
+
+    def start(self):
+        row_width = self.state_dim + binary_converter.CONTROLLER_DIM
+        self.memory = shared_memory.open_shared_memory(self.tag, self.num_blocks * self.batch_rows * row_width * 4)
+        self.blocks = create_block_view(self.memory, self.num_blocks, self.batch_rows, row_width)
+        print('creating', self.num_processes, 'decoder processes')
+        for worker_number in range(self.num_processes):
+            for block_number in range(self.blocks_per_process):
+                self.free_blocks[worker_number].put(worker_number * self.blocks_per_process + block_number)
+            process = mp.Process(target=decode_worker,
+                                 args=(worker_number, self.tag, self.num_blocks, self.batch_rows, self.state_dim,
+                                       self.task_queue, self.free_blocks[worker_number], self.ready_queue,
+                                       self.frame_filter))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+
+    def submit(self, file):
+        """
+        Queues a file for decoding, this blocks while the processes are far enough behind.
+        Several downloader threads can submit at once, every file still gets its own number.
+        :param file: A path or a file that has been downloaded into memory
+        :return: How long it took to queue the file
+        """
+        start = time.time()
+        if isinstance(file, io.BytesIO):
+            file = file.getvalue()
+        with self.file_counter_lock:
+            file_number = self.file_counter
+            self.file_counter += 1
+        self.task_queue.put((file_number, file))
+        return time.time() - start
+
+    def finish(self):
+        """Called once every file has been submitted, the processes exit when they run out of files"""
+        for _ in range(self.num_processes):
+            self.task_queue.put(None)
+
+    def receive(self):
+        """Waits for the next message and files it under its file"""
+        while True:
+            try:
+                kind, worker_number, file_number, value = self.ready_queue.get(timeout=WORKER_CHECK_SECONDS)
+                break
+            except queue.Empty:
+                self.check_workers()
+                if len(self.exited_workers) == self.num_processes:
+                    return
+        if kind == FILE_STARTED:
+            self.current_files[worker_number] = file_number
+            self.started_files.append(file_number)
+        elif kind == WORKER_EXITED:
+            self.exited_workers.add(worker_number)
+        else:
+            if kind == FILE_ENDED:
+                self.current_files[worker_number] = None
+            self.file_messages[file_number].append((kind, worker_number, value))
+
+    def check_workers(self):
+        """Ends the file of a process that died, an empty queue means everything it sent has been received"""
+        for worker_number, process in enumerate(self.processes):
+            if worker_number in self.exited_workers or process.is_alive():
+                continue
+            print('decoder process', worker_number, 'died with exit code', process.exitcode)
+            file_number = self.current_files[worker_number]
+            if file_number is not None:
+                self.file_messages[file_number].append((FILE_ENDED, worker_number, 'decoder process died'))
+                self.current_files[worker_number] = None
+            self.exited_workers.add(worker_number)
+
+    def iter_file_batches(self, file_number):
+        """
+        :return: A generator of (input_array, output_array, meta) for a single file.
+            The arrays are copies, so they can be kept after the next batch
+        """
+        messages = self.file_messages[file_number]
+        while True:
+            while len(messages) == 0:
+                self.receive()
+            kind, worker_number, value = messages.popleft()
+            if kind == FILE_ENDED:
+                del self.file_messages[file_number]
+                if value is not None:
+                    print('error decoding file', value)
+                return
+            block_number, rows, meta = value
+            block = self.blocks[block_number]
+            input_array = np.array(block[:rows, :self.state_dim])
+            output_array = np.array(block[:rows, self.state_dim:])
+            self.free_blocks[worker_number].put(block_number)
+            yield input_array, output_array, meta
+
+    def iter_files(self):
+        """
+        :return: A generator with a batch generator for every decoded file, it ends after finish has been called
+            and every file has been decoded
+        """
+        while True:
+            while len(self.started_files) == 0:
+                if len(self.exited_workers) == self.num_processes:
+                    return
+                self.receive()
+            batches = self.iter_file_batches(self.started_files.popleft())
+            yield batches
+            # Whatever the consumer did not take still holds blocks
+            for _ in batches:
+                pass
+
+    def close(self):
+        for process in self.processes:
+            process.join(WORKER_CHECK_SECONDS)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        if self.memory is not None:
+            self.blocks = None
+            self.memory.close()
+            self.memory = None
+        shared_memory.remove_shared_memory(self.tag)
@@ -0,0 +1,104 @@
+import numpy as np
+import tensorflow as tf
+
+from bot_code.conversions import binary_converter
+
+DEFAULT_CYCLE_LENGTH = 4
+DEFAULT_SHUFFLE_BUFFER = 50000
+DEFAULT_PREFETCH_BATCHES = 2
+
+
+class ReplayDataset:
+    """
+    A tf.data pipeline that reads training batches straight from replay files.
+
+    Every file is read in chunks by a generator, chunks of several files are interleaved so a batch is not
+    made of a single game, and the frames are shuffled, batched and prefetched.
+    The pipeline runs in the background threads of tensorflow, so a batch is being put together while the
+    model trains on the one before it, and the model reads its batches from an iterator instead of a feed_dict.
+
+    The dataset ends once every file has been read, initializing its iterator again starts another epoch.
+    """
+
+    def __init__(self, files, state_dim, create_labels, format_inputs=None, get_file_function=None,
+                 batch_size=5000, cycle_length=DEFAULT_CYCLE_LENGTH, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER,
+                 prefetch_batches=DEFAULT_PREFETCH_BATCHES, batch_rows=binary_converter.DEFAULT_BATCH_ROWS,
+                 frame_filter=None):
+        """
+        :param files: The replays to read, paths, files in memory or whatever get_file_function takes
+        :param state_dim: The size of a formatted state
+        :param create_labels: Turns a batch of controls of shape (rows, 8) into a batch of labels
+        :param format_inputs: Formats a batch of states before it goes into the dataset, like
+            InputFormatter.format_array.  Nothing is done if None
+        :param get_file_function: Turns an entry of files into a file or a list of files, like the downloader does.
+            The entry is used as is if None
+        :param batch_size: How many frames are in a batch the model trains on
+        :param cycle_length: How many files are read at the same time
+        :param shuffle_buffer: How many frames are shuffled together, 0 keeps the order of the files
+        :param prefetch_batches: How many batches are put together ahead of the model
+        :param batch_rows: How many frames are read from a file at a time
+        :param frame_filter: A FrameFilter that drops frames before they go into the dataset, or None
+        """
+        self.files = list(files)
+        self.state_dim = state_dim
+        self.create_labels = create_labels
+        self.format_inputs = format_inputs
+        self.get_file_function = get_file_function
+        self.batch_size = batch_size
+        self.cycle_length = cycle_length
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch_batches = prefetch_batches
+        self.batch_rows = batch_rows
+        self.frame_filter = frame_filter
+        self.label_shape = np.shape(create_labels(np.zeros((1, binary_converter.CONTROLLER_DIM),
+                                                           dtype=np.float32)))[1:]
+
+    def iter_files(self, file_index):
+        file = self.files[file_index]
+        if self.get_file_function is not None:
+            file = self.get_file_function(file)
+        if isinstance(file, (list, tuple)):
+            return file
+        return [file]
+
+    def read_chunks(self, file_index):
+        """
+        The generator behind a single entry of files.
+        :param file_index: Where the entry is in files, only numbers and strings can go through tensorflow
+        :return: A generator of (inputs, labels) for every chunk of the files
+        """
+        try:
+            for file in self.iter_files(int(file_index)):
+                if hasattr(file, 'seek'):
+                    file.seek(0)
+                with binary_converter.open_decompressed_file(file) as f:
+                    for input_array, output_array, meta in binary_converter.iter_batches(f, self.batch_rows, self.frame_filter):
+                        if self.format_inputs is not None:
+                            input_array = self.format_inputs(input_array)
+                        input_array = np.nan_to_num(input_array)
+                        labels = np.asarray(self.create_labels(output_array), dtype=np.float32)
+                        yield input_array, labels
+        except Exception as e:
+            # One bad replay should not end the epoch
+            print('error reading replay for the dataset', e)
+
+    def create_dataset(self, shuffle_files=True):
+        """
+        :param shuffle_files: Reads the files in a different order every epoch
+        :return: A tf.data.Dataset of (inputs, labels) batches
+        """
+        file_indexes = tf.data.Dataset.range(len(self.files))
+        if shuffle_files:
+            file_indexes = file_indexes.shuffle(max(len(self.files), 1), reshuffle_each_iteration=True)
+
+        def read_file(file_index):
+            return tf.data.Dataset.from_generator(self.read_chunks, (tf.float32, tf.float32),
+                                                  (tf.TensorShape([None, self.state_dim]),
+                                                   tf.TensorShape([None]).concatenate(self.label_shape)),
+                                                  args=(file_index,))
+
+        dataset = file_indexes.interleave(read_file, cycle_length=self.cycle_length, block_length=1)
+        dataset = dataset.flat_map(lambda inputs, labels: tf.data.Dataset.from_tensor_slices((inputs, labels)))
+        if self.shuffle_buffer > 0:
+            dataset = dataset.shuffle(self.shuffle_buffer)
+        return dataset.batch(self.batch_size).prefetch(self.prefetch_batches)
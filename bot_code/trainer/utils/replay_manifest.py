@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import threading
+import time
+
+from bot_code.conversions import binary_converter
+
+MANIFEST_FILE_NAME = 'manifest.sqlite'
+DEFAULT_EXCLUDED_FOLDERS = {'data', 'ignore'}
+
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS replays (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    file_version INTEGER,
+    hashed_name TEXT,
+    is_eval INTEGER,
+    frame_count INTEGER,
+    chunk_count INTEGER)'''
+CREATE_INDEXES = ['CREATE INDEX IF NOT EXISTS replays_hashed_name ON replays (hashed_name)',
+                  'CREATE INDEX IF NOT EXISTS replays_frame_count ON replays (is_eval, frame_count)']
+
+
+def read_replay_info(file_name):
+    """
+    Opens a replay to learn what is in it, reading only its header and, for columnar replays, its index.
+    :return: A tuple of (file_version, hashed_name, is_eval, frame_count, chunk_count),
+        file_version is None if the replay is empty, broken or of a version that can not be read,
+        frame_count and chunk_count are None for older versions, which have to be decoded to count them
+    """
+    with binary_converter.open_decompressed_file(file_name) as f:
+        file_version, hashed_name, is_eval = binary_converter.get_file_version(f)
+        if file_version == binary_converter.EMPTY_FILE or not binary_converter.is_readable_file_version(file_version):
+            return None, str(hashed_name), False, 0, 0
+        if file_version == binary_converter.COLUMNAR_FILE_VERSION:
+            f.seek(0, os.SEEK_SET)
+            reader = binary_converter.ColumnarReplayReader(f)
+            return file_version, str(hashed_name), is_eval, reader.get_frame_count(), reader.get_chunk_count()
+        return file_version, str(hashed_name), is_eval, None, None
+
+
+def count_replay_frames(file_name):
+    """
+    Decodes a whole replay of an older version to count what is in it.
+    :return: A tuple of (frame_count, chunk_count)
+    """
+    with binary_converter.open_decompressed_file(file_name) as f:
+        file_version, hashed_name, is_eval = binary_converter.get_file_version(f)
+        frame_count = 0
+        chunk_count = 0
+        for input_array, output_array in binary_converter.iter_stream_blocks(f, file_version):
+            frame_count += len(input_array)
+            chunk_count += 1
+        return frame_count, chunk_count
+
+
+def find_replay_files(folder, excluded_folders=DEFAULT_EXCLUDED_FOLDERS):
+    """:return: A dictionary of the (size, modification time) of every replay under folder, by path"""
+    files = {}
+    for (dirpath, dirnames, filenames) in os.walk(folder):
+        dirnames[:] = [d for d in dirnames if d not in excluded_folders]
+        for file in filenames:
+            if not any(file.endswith(extension) for extension in binary_converter.REPLAY_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed while walking
+            files[path] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+class ReplayManifest:
+    """
+    A SQLite catalog of the replays under a folder, with what is in each of them.
+
+    Updating only opens replays that are new or whose size or modification time changed since the last update,
+    and only reads their headers, so starting a trainer on a folder of older replays does not decode all of them.
+    The frame counts of older replays are unknown (NULL) until fill_frame_counts decodes them.
+    Selecting replays by bot hash, eval and frame count is then a query on an index.
+    """
+
+    def __init__(self, manifest_file):
+        """
+        :param manifest_file: The SQLite file, created if it does not exist
+        """
+        self.manifest_file = manifest_file
+        self.connection = sqlite3.connect(manifest_file)
+        self.connection.execute(CREATE_TABLE)
+        for create_index in CREATE_INDEXES:
+            self.connection.execute(create_index)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def update(self, folder, excluded_folders=DEFAULT_EXCLUDED_FOLDERS):
+        """
+        Brings the manifest up to date with the replays under folder.
+        :return: A tuple of how many replays were added or changed and how many were removed
+        """
+        start = time.time()
+        files = find_replay_files(folder, excluded_folders)
+        prefix = os.path.join(folder, '')
+        known = {path: (size, modified) for path, size, modified in self.connection.execute(
+            'SELECT path, size, modified FROM replays WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+        removed = [(path,) for path in known if path not in files]
+        changed = [path for path, stat in files.items() if known.get(path) != stat]
+        for path in changed:
+            self.add_file(path, files[path], commit=False)
+        self.connection.executemany('DELETE FROM replays WHERE path = ?', removed)
+        self.connection.commit()
+        if len(changed) > 0 or len(removed) > 0:
+            print('manifest added', len(changed), 'replays and removed', len(removed), 'in',
+                  str(time.time() - start), 'seconds')
+        return len(changed), len(removed)
+
+    def add_file(self, path, stat=None, commit=True):
+        """
+        Adds or refreshes a single replay, for replays that are known to have just arrived.
+        :param stat: The (size, modification time) of the file, read from the file if None
+        """
+        if stat is None:
+            file_stat = os.stat(path)
+            stat = (file_stat.st_size, file_stat.st_mtime)
+        try:
+            info = read_replay_info(path)
+        except Exception as e:
+            print('could not read replay', path, e)
+            info = (None, None, False, 0, 0)
+        file_version, hashed_name, is_eval, frame_count, chunk_count = info
+        self.connection.execute('INSERT OR REPLACE INTO replays VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (path, stat[0], stat[1], file_version, hashed_name, int(is_eval),
+                                 frame_count, chunk_count))
+        if commit:
+            self.connection.commit()
+
+    def fill_frame_counts(self, limit=None):
+        """
+        Decodes replays whose frame count is not known yet and records their counts.
+        Each replay is committed on its own, so this can be stopped at any time and picked up later.
+        :param limit: The most replays that are decoded, all of them if None
+        :return: How many replays were counted
+        """
+        query = 'SELECT path, size, modified FROM replays WHERE file_version IS NOT NULL AND frame_count IS NULL'
+        values = []
+        if limit is not None:
+            query += ' LIMIT ?'
+            values.append(limit)
+        counted = 0
+        for path, size, modified in self.connection.execute(query, values).fetchall():
+            try:
+                frame_count, chunk_count = count_replay_frames(path)
+            except Exception as e:
+                print('could not count frames of replay', path, e)
+                frame_count, chunk_count = 0, 0
+            # a replay that changed since it was listed is counted again by the next update
+            self.connection.execute('UPDATE replays SET frame_count = ?, chunk_count = ? '
+                                    'WHERE path = ? AND size = ? AND modified = ?',
+                                    (frame_count, chunk_count, path, size, modified))
+            self.connection.commit()
+            counted += 1
+        return counted
+
+    def select(self, hashed_name=None, is_eval=None, min_frames=None, file_version=None, limit=None, shuffle=False):
+        """
+        :param hashed_name: Only replays of this bot hash
+        :param is_eval: Only eval replays if True, only training replays if False, both if None
+        :param min_frames: Only replays with at least this many frames,
+            replays whose frame count is not known yet are kept
+        :param file_version: Only replays of this file version
+        :param limit: The most replays that are returned
+        :param shuffle: Returns the replays in a random order instead of by path
+        :return: A list of the paths of the replays that match
+        """
+        conditions = ['file_version IS NOT NULL']
+        values = []
+        if hashed_name is not None:
+            conditions.append('hashed_name = ?')
+            values.append(str(hashed_name))
+        if is_eval is not None:
+            conditions.append('is_eval = ?')
+            values.append(int(is_eval))
+        if min_frames is not None:
+            conditions.append('(frame_count IS NULL OR frame_count >= ?)')
+            values.append(min_frames)
+        if file_version is not None:
+            conditions.append('file_version = ?')
+            values.append(file_version)
+        query = 'SELECT path FROM replays WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY RANDOM()' if shuffle else ' ORDER BY path'
+        if limit is not None:
+            query += ' LIMIT ?'
+            values.append(limit)
+        return [row[0] for row in self.connection.execute(query, values)]
+
+    def get_info(self, path):
+        """:return: A dictionary of everything the manifest knows about a replay, None if it is not in it"""
+        cursor = self.connection.execute('SELECT * FROM replays WHERE path = ?', (path,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+
+def fill_frame_counts_in_background(manifest_file):
+    """
+    Counts the frames of the replays in the manifest that are not counted yet on a daemon thread,
+    with its own connection as SQLite connections can not be shared between threads.
+    :return: The thread
+    """
+    def fill():
+        try:
+            with ReplayManifest(manifest_file) as manifest:
+                manifest.fill_frame_counts()
+        except sqlite3.Error as e:
+            print('could not count replay frames', e)
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    return thread
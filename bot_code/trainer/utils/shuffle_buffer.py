@@ -0,0 +1,81 @@
+import numpy as np
+
+
+class ShuffleBuffer:
+    """
+    Mixes frames from many replays before they are trained on.
+
+    The buffer keeps capacity frames in arrays that are allocated once.
+    Until it is full frames are only stored.  After that every batch of new frames swaps places with
+    a batch of random stored frames, which go out as a training batch, so a batch is emitted for every
+    batch_size frames that come in and a batch is drawn from every replay still in the buffer.
+    """
+
+    def __init__(self, capacity, batch_size, seed=None):
+        """
+        :param capacity: How many frames the buffer holds, at least batch_size
+        :param batch_size: How many frames are in an emitted batch
+        :param seed: Seeds the random slots, for repeatable runs
+        """
+        if capacity < batch_size:
+            raise ValueError('the shuffle buffer must hold at least a batch')
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.random_state = np.random.RandomState(seed)
+        self.inputs = None
+        self.labels = None
+        self.batch_inputs = None
+        self.batch_labels = None
+        self.size = 0
+        self.batch_filled = 0
+
+    def allocate(self, input_array, label_array):
+        self.inputs = np.empty((self.capacity,) + input_array.shape[1:], dtype=np.float32)
+        self.labels = np.empty((self.capacity,) + label_array.shape[1:], dtype=np.float32)
+        self.batch_inputs = np.empty((self.batch_size,) + input_array.shape[1:], dtype=np.float32)
+        self.batch_labels = np.empty((self.batch_size,) + label_array.shape[1:], dtype=np.float32)
+
+    def add(self, input_array, label_array, process_batch):
+        """
+        Adds frames to the buffer.
+        :param input_array: The states, of shape (frames, state_dim)
+        :param label_array: The labels of the states, the same number of frames
+        :param process_batch: Called with (inputs, labels) for every batch that is emitted.
+            The arrays are reused for the next batch, so they are only valid during the call
+        """
+        if self.inputs is None:
+            self.allocate(input_array, label_array)
+        start = 0
+        if self.size < self.capacity:
+            count = min(self.capacity - self.size, len(input_array))
+            self.inputs[self.size:self.size + count] = input_array[:count]
+            self.labels[self.size:self.size + count] = label_array[:count]
+            self.size += count
+            start = count
+        while start < len(input_array):
+            count = min(self.batch_size - self.batch_filled, len(input_array) - start)
+            slots = self.random_state.choice(self.capacity, count, replace=False)
+            batch = slice(self.batch_filled, self.batch_filled + count)
+            self.batch_inputs[batch] = self.inputs[slots]
+            self.batch_labels[batch] = self.labels[slots]
+            self.inputs[slots] = input_array[start:start + count]
+            self.labels[slots] = label_array[start:start + count]
+            self.batch_filled += count
+            start += count
+            if self.batch_filled == self.batch_size:
+                process_batch(self.batch_inputs, self.batch_labels)
+                self.batch_filled = 0
+
+    def flush(self, process_batch):
+        """Emits everything that is left in the buffer in random batches, the last one can be smaller"""
+        if self.inputs is None:
+            return
+        # Frames that already swapped out are still waiting in the batch arrays
+        remaining = np.concatenate([self.inputs[:self.size], self.batch_inputs[:self.batch_filled]])
+        remaining_labels = np.concatenate([self.labels[:self.size], self.batch_labels[:self.batch_filled]])
+        order = self.random_state.permutation(len(remaining))
+        for start in range(0, len(order), self.batch_size):
+            slots = order[start:start + self.batch_size]
+            process_batch(remaining[slots], remaining_labels[slots])
+        self.size = 0
+        self.batch_filled = 0
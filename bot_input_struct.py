@@ -1,9 +1,12 @@
 import ctypes
-import mmap
+
+import shared_memory
 
 MAX_PLAYERS = 10
 MAX_NAME_LENGTH = 32
 SHARED_MEMORY_TAG = 'Local\\RLBotInput'
+# Not part of RLBot, see AnsweredTicks
+ANSWER_SHARED_MEMORY_TAG = 'Local\\SaltieAnswers'
 
 
 class PlayerConfiguration(ctypes.Structure):
@@ -46,6 +49,15 @@ class GameInputPacket(ctypes.Structure):
                 ("iNumPlayers", ctypes.c_int)]
 
 
+class AnsweredTicks(ctypes.Structure):
+    """
+    The game time of the packet each bot last answered, written right after its controls.
+    The game does not read this, it lets tools like the packet replayer tell an answer from controls that
+    did not change.
+    """
+    _fields_ = [("fTimeSeconds", ctypes.c_float * MAX_PLAYERS)]
+
+
 def print_game_input_packet(gameInputPacket):
     print("PRINTING GAME INPUT PACKET")
     print_struct(gameInputPacket)
@@ -69,7 +81,7 @@ def print_struct(cStructure):
 # Running this file will read from shared memory and display contents
 if __name__ == '__main__':
     # Open anonymous shared memory for entire GameInputPacket
-    buff = mmap.mmap(-1, ctypes.sizeof(GameInputPacket), SHARED_MEMORY_TAG)
+    buff = shared_memory.open_shared_memory(SHARED_MEMORY_TAG, ctypes.sizeof(GameInputPacket))
 
     # Map buffer to ctypes structure
     gameInputPacket = GameInputPacket.from_buffer(buff)
@@ -1,35 +1,38 @@
 import ctypes
-import gzip
 from datetime import datetime, timedelta
 import importlib
-import mmap
 import os
-import shutil
 import time
 
 import numpy as np
 
+import agent_reload_watcher
 import bot_input_struct as bi
 import game_data_struct as gd
-import rate_limiter
+import game_tick_packet_reader
+import latency_histogram
+import replay_writer
+import shared_memory
+import tick_scheduler
 import sys
 import traceback
 
 from bot_code.conversions import binary_converter as compressor
 from bot_code.conversions.input import input_formatter
+from bot_code.conversions.input import vectorized_input_formatter
 
 OUTPUT_SHARED_MEMORY_TAG = 'Local\\RLBotOutput'
 INPUT_SHARED_MEMORY_TAG = 'Local\\RLBotInput'
 GAME_TICK_PACKET_REFRESHES_PER_SECOND = 60  # 2*60. https://en.wikipedia.org/wiki/Nyquist_rate
 MAX_AGENT_CALL_PERIOD = timedelta(seconds=1.0/30)  # Minimum call rate when paused.
-REFRESH_IN_PROGRESS = 1
-REFRESH_NOT_IN_PROGRESS = 0
 MAX_CARS = 10
+CONTROLLER_SIZE = 8
+LOOP_PHASES = ['read', 'reload', 'agent', 'input', 'record']
 
 
 class BotManager:
 
-    game_file = None
+    replay_writer = None
     model_hash = None
     is_eval = False
 
@@ -43,15 +46,51 @@ class BotManager:
         self.save_data = savedata
         self.module_name = modulename
         self.game_name = gamename
-        self.input_converter = input_formatter.InputFormatter(team, index)
+        self.input_converter = vectorized_input_formatter.VectorizedInputFormatter(team, index)
         self.frames = 0
-        self.file_number = 1
         self.server_manager = server_manager
-        self.input_array = np.array([])
-        self.output_array = np.array([])
         self.batch_size = 1000
         self.upload_size = 20
         self.retry_size = 10
+        self.replay_codec = compressor.DEFAULT_CODEC
+        self.compression_level = compressor.DEFAULT_COMPRESSION_LEVEL
+        self.replay_file_version = compressor.get_recording_file_version()
+        if bot_parameters is not None:
+            self.replay_codec = bot_parameters.get('replay_codec', self.replay_codec)
+            self.compression_level = bot_parameters.getint('replay_compression_level',
+                                                           fallback=self.compression_level)
+            self.replay_file_version = bot_parameters.getint('replay_file_version',
+                                                             fallback=self.replay_file_version)
+        if self.replay_codec == 'none':
+            # Uncompressed columnar replays (replay_file_version = 6) can be memory mapped
+            self.replay_codec = None
+        self.check_replay_settings()
+        # Recording buffers are allocated once and filled in place so recording cost stays flat across a batch.
+        self.input_array = np.zeros((self.batch_size, input_formatter.get_state_dim()), dtype=np.float32)
+        self.output_array = np.zeros((self.batch_size, CONTROLLER_SIZE), dtype=np.float32)
+        self.batch_index = 0
+        latency_file = None
+        if bot_parameters is not None:
+            latency_file = bot_parameters.get('latency_file', latency_file)
+        if latency_file is None and savedata:
+            latency_file = os.path.join(self.game_name, str(self.name).replace(" ", "") + '-latency.json')
+        self.latencies = latency_histogram.PhaseLatencies(self.name, LOOP_PHASES, dump_file=latency_file)
+
+    def check_replay_settings(self):
+        """Falls back to the defaults for replay settings the writer can not use, before it ever runs"""
+        if self.replay_file_version not in (compressor.TIME_ADDITION_FILE_VERSION, compressor.COLUMNAR_FILE_VERSION):
+            print('can not record replays of version', self.replay_file_version, 'using',
+                  compressor.get_recording_file_version())
+            self.replay_file_version = compressor.get_recording_file_version()
+        if self.replay_file_version == compressor.COLUMNAR_FILE_VERSION:
+            valid_codecs = compressor.BLOCK_CODEC_IDS
+        else:
+            # the older stream files are always compressed
+            valid_codecs = compressor.CODEC_EXTENSIONS
+        if self.replay_codec not in valid_codecs:
+            print('can not record version', self.replay_file_version, 'replays with codec', self.replay_codec,
+                  'using', compressor.DEFAULT_CODEC)
+            self.replay_codec = compressor.DEFAULT_CODEC
 
     def load_agent(self, agent_module):
         try:
@@ -62,21 +101,24 @@ class BotManager:
 
     def run(self):
         # Set up shared memory map (offset makes it so bot only writes to its own input!) and map to buffer
-        filename = ""
-        buff = mmap.mmap(-1, ctypes.sizeof(bi.GameInputPacket), INPUT_SHARED_MEMORY_TAG)
+        buff = shared_memory.open_shared_memory(INPUT_SHARED_MEMORY_TAG, ctypes.sizeof(bi.GameInputPacket))
         bot_input = bi.GameInputPacket.from_buffer(buff)
         player_input = bot_input.sPlayerInput[self.index]
         player_input_lock = (ctypes.c_long).from_address(ctypes.addressof(player_input))
+        answer_memory = shared_memory.open_shared_memory(bi.ANSWER_SHARED_MEMORY_TAG, ctypes.sizeof(bi.AnsweredTicks))
+        answered_ticks = bi.AnsweredTicks.from_buffer(answer_memory)
 
         # Set up shared memory for game data
-        game_data_shared_memory = mmap.mmap(-1, ctypes.sizeof(gd.GameTickPacketWithLock), OUTPUT_SHARED_MEMORY_TAG)
-        bot_output = gd.GameTickPacketWithLock.from_buffer(game_data_shared_memory)
-        lock = ctypes.c_long(0)
+        game_data_shared_memory = shared_memory.open_shared_memory(OUTPUT_SHARED_MEMORY_TAG,
+                                                                   ctypes.sizeof(gd.GameTickPacketWithLock))
+        packet_reader = game_tick_packet_reader.GameTickPacketReader(game_data_shared_memory)
+        bot_output = packet_reader.packet_with_lock
         game_tick_packet = gd.GameTickPacket()  # We want to do a deep copy for game inputs so people don't mess with em
 
 
-        # Create Ratelimiter
-        r = rate_limiter.RateLimiter(GAME_TICK_PACKET_REFRESHES_PER_SECOND)
+        # Wakes the loop when the game publishes a new packet
+        scheduler = tick_scheduler.TickScheduler(packet_reader.get_tick_time, GAME_TICK_PACKET_REFRESHES_PER_SECOND,
+                                                 name=self.name)
         last_tick_game_time = None  # What the tick time of the last observed tick was
         last_call_real_time = datetime.now()  # When we last called the Agent
 
@@ -97,39 +139,42 @@ class BotManager:
             self.model_hash = 0
 
         self.server_manager.set_model_hash(self.model_hash)
-        last_module_modification_time = os.stat(agent_module.__file__).st_mtime
 
         if hasattr(agent, 'is_evaluating'):
             self.is_eval = agent.is_evaluating
             self.server_manager.set_is_eval(self.is_eval)
 
         if self.save_data:
-            filename = self.create_file_name()
-            print('creating file ' + filename)
-            self.create_new_file(filename)
+            # Disk and network work happens on the writer thread so it never stalls a tick
+            self.replay_writer = replay_writer.ReplayWriter(self.game_name, self.name, self.server_manager,
+                                                            self.bot_parameters, self.model_hash, self.is_eval,
+                                                            upload_size=self.upload_size, retry_size=self.retry_size,
+                                                            codec=self.replay_codec,
+                                                            compression_level=self.compression_level,
+                                                            file_version=self.replay_file_version)
+            self.replay_writer.start()
         old_time = 0
         counter = 0
 
-        last_module_modification_time = os.stat(agent_module.__file__).st_mtime
+        # Modifications to the agent are picked up and loaded off the loop
+        reload_watcher = agent_reload_watcher.AgentReloadWatcher(agent_module, self.load_agent)
+        reload_watcher.start()
 
         # Run until main process tells to stop
         while not self.terminateEvent.is_set():
-            before = datetime.now()
             before2 = time.time()
+            phase_start = time.perf_counter()
 
-            # Read from game data shared memory
-            game_data_shared_memory.seek(0)  # Move to beginning of shared memory
-            ctypes.memmove(ctypes.addressof(lock), game_data_shared_memory.read(ctypes.sizeof(lock)), ctypes.sizeof(
-                lock))  # dll uses InterlockedExchange so this read will return the correct value!
-
-            if lock.value != REFRESH_IN_PROGRESS:
-                game_data_shared_memory.seek(4, os.SEEK_CUR)  # Move 4 bytes past error code
-                ctypes.memmove(ctypes.addressof(game_tick_packet),
-                               game_data_shared_memory.read(ctypes.sizeof(gd.GameTickPacket)),
-                               ctypes.sizeof(gd.GameTickPacket))  # copy shared memory into struct
+            # Copy game data shared memory into the struct, a torn copy is never handed to the agent
+            if not packet_reader.read(game_tick_packet):
+                # The dll is refreshing the packet, try again as soon as it has published it
+                scheduler.wait_for_tick(last_tick_game_time, MAX_AGENT_CALL_PERIOD.total_seconds())
+                continue
             if game_tick_packet.gameInfo.bMatchEnded:
                 print('\n\n\n\n Match has ended so ending bot loop\n\n\n\n\n')
                 break
+            phase_end = time.perf_counter()
+            self.latencies.record('read', phase_end - phase_start)
 
             controller_input = None
             # Run the Agent only if the gameInfo has updated.
@@ -140,26 +185,30 @@ class BotManager:
                 last_call_real_time = datetime.now()
 
                 try:
-                    # Reload the Agent if it has been modified.
-                    new_module_modification_time = os.stat(agent_module.__file__).st_mtime
-                    if new_module_modification_time != last_module_modification_time:
-                        last_module_modification_time = new_module_modification_time
-                        print('Reloading Agent: ' + agent_module.__file__)
-
-                        importlib.reload(agent_module)
+                    phase_start = time.perf_counter()
+                    # Swap in the reloaded Agent if the watcher finished building one.
+                    if reload_watcher.has_new_agent:
                         old_agent = agent
-                        agent = self.load_agent(agent_module)
+                        agent = reload_watcher.take_new_agent()
+                        agent_module = reload_watcher.agent_module
                         # Retire after the replacement initialized properly.
                         if hasattr(old_agent, 'retire'):
                             old_agent.retire()
 
+                    phase_end = time.perf_counter()
+                    self.latencies.record('reload', phase_end - phase_start)
+
                     # Call agent
+                    phase_start = phase_end
                     controller_input = agent.get_output_vector(game_tick_packet)
+                    phase_end = time.perf_counter()
+                    self.latencies.record('agent', phase_end - phase_start)
 
                     if not controller_input:
                         raise Exception('Agent "{}" did not return a player_input tuple.'.format(agent_module.__file__))
 
                     # Write all player inputs
+                    phase_start = phase_end
                     player_input.fThrottle = controller_input[0]
                     player_input.fSteer = controller_input[1]
                     player_input.fPitch = controller_input[2]
@@ -168,6 +217,8 @@ class BotManager:
                     player_input.bJump = controller_input[5]
                     player_input.bBoost = controller_input[6]
                     player_input.bHandbrake = controller_input[7]
+                    answered_ticks.fTimeSeconds[self.index] = tick_game_time
+                    self.latencies.record('input', time.perf_counter() - phase_start)
 
                 except Exception as e:
                     traceback.print_exc()
@@ -179,37 +230,16 @@ class BotManager:
             current_time = game_tick_packet.gameInfo.TimeSeconds
 
             if self.save_data and game_tick_packet.gameInfo.bRoundActive and not old_time == current_time and not current_time == -10:
-                np_input = self.input_converter.create_input_array(game_tick_packet, passed_time=current_time - old_time)
-                np_output = np.array(controller_input, dtype=np.float32)
-                self.input_array = np.append(self.input_array, np_input)
-                self.output_array = np.append(self.output_array, np_output)
-                if self.frames % self.batch_size == 0 and not self.frames == 0:
-                    print('writing big array', self.frames)
-                    compressor.write_array_to_file(self.game_file, self.input_array)
-                    compressor.write_array_to_file(self.game_file, self.output_array)
-                    self.input_array = np.array([])
-                    self.output_array = np.array([])
-                if self.frames % (self.batch_size * self.upload_size) == 0 and not self.frames == 0:
-                    print('adding new file and uploading')
-                    self.file_number += 1
-                    self.game_file.close()
-                    print('creating file ' + filename)
-                    self.maybe_compress_and_upload(filename)
-                    filename = self.create_file_name()
-                    self.create_new_file(filename)
-                    self.maybe_delete(self.file_number - 3)
-                if self.frames % (self.batch_size * self.upload_size * self.retry_size) == 0 and not self.frames == 0:
-                    try:
-                        self.server_manager.retry_files()
-                    except Exception:
-                        print('failed to retry uploading files')
+                phase_start = time.perf_counter()
+                self.record_frame(game_tick_packet, controller_input, current_time - old_time)
                 self.frames += 1
+                if self.batch_index == self.batch_size:
+                    print('writing big array', self.frames)
+                    self.flush_frames()
+                self.latencies.record('record', time.perf_counter() - phase_start)
 
             old_time = current_time
 
-            # Ratelimit here
-            after = datetime.now()
-
             after2 = time.time()
             # cant ever drop below 40 frames
             if after2 - before2 > 0.025:
@@ -219,42 +249,48 @@ class BotManager:
             else:
                 counter += 1
 
-            r.acquire(after - before)
+            self.latencies.maybe_dump()
 
+            # Sleep until the next packet lands
+            scheduler.wait_for_tick(last_tick_game_time, MAX_AGENT_CALL_PERIOD.total_seconds())
+
+        reload_watcher.stop()
         if hasattr(agent, 'retire'):
             agent.retire()
         # If terminated, send callback
         print("something ended closing file")
         if self.save_data:
-            self.maybe_compress_and_upload(filename)
-            self.server_manager.retry_files()
+            self.flush_frames()
+            self.replay_writer.close()
 
+        self.latencies.dump()
+        print('latencies for ' + self.name + ' in microseconds', self.latencies.create_summary())
         print('done with bot')
 
         self.callbackEvent.set()
 
-    def maybe_compress_and_upload(self, filename):
-        if not os.path.isfile(filename + '.gz'):
-            compressed = self.compress(filename)
-            self.server_manager.maybe_upload_replay(compressed, self.bot_parameters['model_hash'])
-
-    def compress(self, filename):
-        output = filename + '.gz'
-        with open(filename, 'rb') as f_in:
-            with gzip.open(output, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        return output
-
-    def maybe_delete(self, file_number):
-        if file_number > 0:
-            filename = os.path.join(self.game_name, self.name + '-' + str(file_number) + '.bin')
-            os.remove(filename)
-
-    def create_new_file(self, filename):
-        self.game_file = open(filename, 'wb')
-        compressor.write_version_info(self.game_file, compressor.get_latest_file_version())
-        compressor.write_bot_hash(self.game_file, self.model_hash)
-        compressor.write_is_eval(self.game_file, self.is_eval)
-
-    def create_file_name(self):
-        return os.path.join(self.game_name, str(self.name).replace(" ", "") + '-' + str(self.file_number) + '.bin')
+    def record_frame(self, game_tick_packet, controller_input, passed_time):
+        """
+        Copies a single frame into the next free row of the preallocated recording buffers.
+        :param game_tick_packet: The packet the agent was called with
+        :param controller_input: The controls the agent returned, None if the agent failed
+        :param passed_time: Time between the last recorded frame and this one
+        """
+        row = self.batch_index
+        self.input_array[row] = self.input_converter.create_input_array(game_tick_packet, passed_time=passed_time)
+        if controller_input is None:
+            self.output_array[row] = 0
+        else:
+            self.output_array[row] = controller_input
+        self.batch_index += 1
+
+    def flush_frames(self):
+        """
+        Hands the recorded rows to the replay writer as one contiguous block and rewinds the buffers.
+        The block is copied because the buffers are reused for the next batch while the writer is still busy.
+        """
+        if self.batch_index == 0:
+            return
+        self.replay_writer.submit(self.input_array[:self.batch_index].ravel().copy(),
+                                  self.output_array[:self.batch_index].ravel().copy())
+        self.batch_index = 0
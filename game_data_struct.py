@@ -1,5 +1,6 @@
 import ctypes
-import mmap
+
+import shared_memory
 
 MAX_PLAYERS = 10
 MAX_NAME_LENGTH = 32
@@ -251,7 +252,7 @@ def rotate_game_tick_packet_boost_omitted(game_tick_packet):
 # Running this file will read from shared memory and display contents
 if __name__ == '__main__':
     # Open anonymous shared memory for entire GameInputPacket
-    buff = mmap.mmap(-1, ctypes.sizeof(GameTickPacketWithLock), SHARED_MEMORY_TAG)
+    buff = shared_memory.open_shared_memory(SHARED_MEMORY_TAG, ctypes.sizeof(GameTickPacketWithLock))
 
     # Map buffer to ctypes structure
     gameOutputPacket = GameTickPacketWithLock.from_buffer(buff)
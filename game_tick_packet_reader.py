@@ -0,0 +1,64 @@
+import ctypes
+
+import game_data_struct as gd
+
+REFRESH_IN_PROGRESS = 1
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class GameTickPacketReader:
+    """
+    Copies the GameTickPacket out of the shared memory written by the dll.
+
+    The packet region is copied straight from the mapping into a reusable struct with a single memmove,
+    no intermediate bytes objects are created.
+    The lock is read before and after the copy, if the dll started a refresh in between the copy is torn
+    and it is retried instead of being handed to the agent.
+    The dll only flags a refresh with the lock, it has no sequence number, so a refresh that starts and
+    finishes entirely within one copy can not be detected.  A copy takes a few microseconds so this is rare.
+    """
+
+    def __init__(self, shared_memory, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        :param shared_memory: A writable buffer (usually an mmap) the size of a GameTickPacketWithLock
+        :param max_attempts: How many times a torn copy is retried before giving up on this read
+        """
+        self.packet_with_lock = gd.GameTickPacketWithLock.from_buffer(shared_memory)
+        base_address = ctypes.addressof(self.packet_with_lock)
+        # Views directly into the mapping, reading .value is a plain load from shared memory
+        self.lock = ctypes.c_long.from_address(base_address + gd.GameTickPacketWithLock.lock.offset)
+        self.packet_address = base_address + gd.GameTickPacketWithLock.gamecars.offset
+        self.packet_size = ctypes.sizeof(gd.GameTickPacket)
+        self.tick_time = ctypes.c_float.from_address(self.packet_address + gd.GameTickPacket.gameInfo.offset +
+                                                     gd.GameInfo.TimeSeconds.offset)
+        self.max_attempts = max_attempts
+        self.torn_reads = 0
+        self.busy_reads = 0
+
+    def read(self, game_tick_packet):
+        """
+        Copies a consistent snapshot of the shared packet into game_tick_packet.
+        :param game_tick_packet: A GameTickPacket (or any writable ctypes buffer of the same size) that is reused
+        :return: True if game_tick_packet now holds a consistent snapshot.
+            If False it may hold a torn copy and should not be used until the next successful read.
+        """
+        destination = ctypes.addressof(game_tick_packet)
+        for attempt in range(self.max_attempts):
+            lock_before = self.lock.value
+            if lock_before == REFRESH_IN_PROGRESS:
+                self.busy_reads += 1
+                continue
+            ctypes.memmove(destination, self.packet_address, self.packet_size)
+            if self.lock.value == lock_before:
+                return True
+            self.torn_reads += 1
+        return False
+
+    def get_tick_time(self):
+        """
+        :return: The TimeSeconds of the newest packet, read straight from shared memory without copying the packet
+        """
+        return self.tick_time.value
+
+    def get_last_error(self):
+        return self.packet_with_lock.iLastError
@@ -0,0 +1,125 @@
+import json
+import os
+import time
+
+# Every power of two is split into this many linear buckets, so a recorded value is off by at most 1/64th
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+MAX_MICROSECONDS = (1 << 27) - 1  # A bit over two minutes, anything slower is clamped
+BUCKET_COUNT = SUB_BUCKET_COUNT + (MAX_MICROSECONDS.bit_length() - SUB_BUCKET_BITS) * SUB_BUCKET_HALF
+DEFAULT_PERCENTILES = [50.0, 90.0, 99.0, 99.9]
+DEFAULT_DUMP_SECONDS = 30.0
+SECONDS_TO_MICROSECONDS = 1000000
+
+
+def get_bucket_index(microseconds):
+    """:return: The bucket a value in whole microseconds falls into"""
+    if microseconds < SUB_BUCKET_COUNT:
+        return microseconds
+    shift = microseconds.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (microseconds >> shift) - SUB_BUCKET_HALF
+
+
+def get_bucket_highest_value(index):
+    """:return: The largest value in microseconds that falls into the bucket"""
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift, sub_bucket = divmod(index - SUB_BUCKET_COUNT, SUB_BUCKET_HALF)
+    shift += 1
+    return ((sub_bucket + SUB_BUCKET_HALF + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    A fixed size log-linear histogram of durations, in the style of HdrHistogram.
+    Recording is a couple of integer operations and a list increment so it can be done every tick.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total_count = 0
+        self.max_value = 0
+
+    def record(self, seconds):
+        microseconds = min(max(int(seconds * SECONDS_TO_MICROSECONDS), 0), MAX_MICROSECONDS)
+        self.counts[get_bucket_index(microseconds)] += 1
+        self.total_count += 1
+        if microseconds > self.max_value:
+            self.max_value = microseconds
+
+    def get_value_at_percentile(self, percentile):
+        """
+        :param percentile: Between 0 and 100
+        :return: The value in microseconds that percentile of the recorded values are at or below
+        """
+        if self.total_count == 0:
+            return 0
+        target = max(int(round(self.total_count * percentile / 100.0)), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(get_bucket_highest_value(index), self.max_value)
+        return self.max_value
+
+    def reset(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total_count = 0
+        self.max_value = 0
+
+
+class PhaseLatencies:
+    """
+    A LatencyHistogram per phase of the bot loop.
+    The percentiles of every phase are periodically written to a json file, replacing what was there.
+    """
+
+    def __init__(self, name, phases, dump_file=None, dump_seconds=DEFAULT_DUMP_SECONDS,
+                 percentiles=DEFAULT_PERCENTILES):
+        """
+        :param name: The name of the bot, written into the dump
+        :param phases: The names of the phases that are timed
+        :param dump_file: Where the percentiles are written, None only keeps them in memory
+        :param dump_seconds: How often the percentiles are written
+        :param percentiles: Which percentiles are written, between 0 and 100
+        """
+        self.name = name
+        self.histograms = {phase: LatencyHistogram() for phase in phases}
+        self.dump_file = dump_file
+        self.dump_seconds = dump_seconds
+        self.percentiles = percentiles
+        self.last_dump = time.perf_counter()
+
+    def record(self, phase, seconds):
+        self.histograms[phase].record(seconds)
+
+    def create_summary(self):
+        """:return: A dictionary of phase to the count, max and percentiles in microseconds"""
+        summary = {}
+        for phase, histogram in self.histograms.items():
+            phase_summary = {'count': histogram.total_count, 'max': histogram.max_value}
+            for percentile in self.percentiles:
+                phase_summary['p' + str(percentile)] = histogram.get_value_at_percentile(percentile)
+            summary[phase] = phase_summary
+        return summary
+
+    def maybe_dump(self, now=None):
+        if now is None:
+            now = time.perf_counter()
+        if now - self.last_dump < self.dump_seconds:
+            return
+        self.last_dump = now
+        self.dump()
+
+    def dump(self):
+        if self.dump_file is None:
+            return
+        temp_file = self.dump_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump({'name': self.name, 'unit': 'microseconds', 'phases': self.create_summary()}, f, indent=2)
+            # Readers never see a half written file
+            os.replace(temp_file, self.dump_file)
+        except Exception as e:
+            print('failed to write latencies', e)
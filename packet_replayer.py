@@ -0,0 +1,227 @@
+import argparse
+import ctypes
+import itertools
+import math
+import multiprocessing as mp
+import time
+
+import bot_input_struct as bi
+import bot_manager
+import game_data_struct as gd
+import game_tick_packet_reader
+import latency_histogram
+import shared_memory
+
+DEFAULT_TICKS_PER_SECOND = 60
+GAME_SECONDS_PER_TICK = 1.0 / 60
+PACKET_SIZE = ctypes.sizeof(gd.GameTickPacket)
+
+
+def create_synthetic_packets(names):
+    """
+    Endless packets of a ball circling the field and cars chasing it.
+    :param names: The names of the cars, bots find their car by name
+    """
+    packet = gd.GameTickPacket()
+    packet.numCars = len(names)
+    packet.numBoosts = 34
+    packet.gameInfo.bRoundActive = True
+    for i, name in enumerate(names):
+        packet.gamecars[i].wName = name
+        packet.gamecars[i].Team = i % 2
+        packet.gamecars[i].bOnGround = True
+    tick = 0
+    while True:
+        angle = tick / 120.0
+        ball = packet.gameball
+        ball.Location.X, ball.Location.Y, ball.Location.Z = 3000 * math.cos(angle), 4000 * math.sin(angle), 93
+        ball.Velocity.X, ball.Velocity.Y = -25 * math.sin(angle), 33 * math.cos(angle)
+        for i in range(len(names)):
+            car = packet.gamecars[i]
+            car_angle = angle - 0.2 * (i + 1)
+            car.Location.X, car.Location.Y, car.Location.Z = 3000 * math.cos(car_angle), 4000 * math.sin(car_angle), 17
+            car.Rotation.Yaw = int(math.degrees(car_angle + math.pi / 2) / 180 * 32768 + 32768) % 65536 - 32768
+            car.Boost = tick % 100
+        tick += 1
+        yield packet
+
+
+def read_recorded_packets(file_name, loop=False):
+    """
+    Packets recorded with record_packets, a file of GameTickPackets written back to back.
+    :param loop: If the file is played again from the start once it ends
+    """
+    while True:
+        with open(file_name, 'rb') as f:
+            while True:
+                data = f.read(PACKET_SIZE)
+                if len(data) < PACKET_SIZE:
+                    break
+                yield gd.GameTickPacket.from_buffer_copy(data)
+        if not loop:
+            return
+
+
+def record_packets(file_name, seconds):
+    """Appends every new packet the game publishes to file_name, for later replaying"""
+    packet_reader = game_tick_packet_reader.GameTickPacketReader(
+        shared_memory.open_shared_memory(bot_manager.OUTPUT_SHARED_MEMORY_TAG, ctypes.sizeof(gd.GameTickPacketWithLock)))
+    game_tick_packet = gd.GameTickPacket()
+    last_tick_time = None
+    recorded = 0
+    end = time.perf_counter() + seconds
+    with open(file_name, 'ab') as f:
+        while time.perf_counter() < end:
+            if packet_reader.get_tick_time() == last_tick_time or not packet_reader.read(game_tick_packet):
+                time.sleep(0.001)
+                continue
+            last_tick_time = game_tick_packet.gameInfo.TimeSeconds
+            f.write(bytes(game_tick_packet))
+            recorded += 1
+    print('recorded', recorded, 'packets')
+
+
+class PacketReplayer:
+    """
+    Plays the part of the game for a bot.
+    Writes packets into the output shared memory at a fixed rate, which can be faster than the game,
+    and measures how long the bot takes to answer a packet.
+    A packet counts as answered once the bot wrote its game time next to its controls
+    (bot_input_struct.AnsweredTicks), so a bot that returns the same controls twice in a row is measured as well.
+    """
+
+    def __init__(self, ticks_per_second=DEFAULT_TICKS_PER_SECOND, index=0):
+        """
+        :param ticks_per_second: How many packets are written per real second
+        :param index: The car whose controls are watched
+        """
+        self.output_memory = shared_memory.open_shared_memory(bot_manager.OUTPUT_SHARED_MEMORY_TAG,
+                                                              ctypes.sizeof(gd.GameTickPacketWithLock))
+        self.packet_with_lock = gd.GameTickPacketWithLock.from_buffer(self.output_memory)
+        self.packet_address = ctypes.addressof(self.packet_with_lock) + gd.GameTickPacketWithLock.gamecars.offset
+        self.answer_memory = shared_memory.open_shared_memory(bi.ANSWER_SHARED_MEMORY_TAG,
+                                                              ctypes.sizeof(bi.AnsweredTicks))
+        self.answered_ticks = bi.AnsweredTicks.from_buffer(self.answer_memory)
+        self.index = index
+        # what an earlier run left behind is not an answer
+        self.answered_ticks.fTimeSeconds[index] = -1.0
+        self.tick_seconds = 1.0 / ticks_per_second
+        self.latencies = latency_histogram.LatencyHistogram()
+        self.ticks = 0
+        self.unanswered_ticks = 0
+
+    def publish(self, game_tick_packet):
+        """Writes the packet into shared memory the same way the dll does, under the lock"""
+        self.packet_with_lock.lock = game_tick_packet_reader.REFRESH_IN_PROGRESS
+        ctypes.memmove(self.packet_address, ctypes.addressof(game_tick_packet), PACKET_SIZE)
+        self.packet_with_lock.lock = 0
+
+    def run(self, packets, num_ticks):
+        """
+        :param packets: An iterable of GameTickPackets, their TimeSeconds is replaced so time always moves forward
+        :param num_ticks: How many packets are written at most
+        """
+        deadline = time.perf_counter()
+        for tick, game_tick_packet in enumerate(packets):
+            if tick >= num_ticks:
+                break
+            game_tick_packet.gameInfo.TimeSeconds = (tick + 1) * GAME_SECONDS_PER_TICK
+            self.publish(game_tick_packet)
+            published = time.perf_counter()
+            deadline = max(deadline + self.tick_seconds, published)
+            self.ticks += 1
+            # read back so it is rounded to a float the same way the bot sees it
+            if not self.wait_for_answer(game_tick_packet.gameInfo.TimeSeconds, published, deadline):
+                self.unanswered_ticks += 1
+        self.end_match()
+
+    def wait_for_answer(self, tick_time, published, deadline):
+        """Spins until the bot answered the packet of tick_time or the next tick is due, then sleeps out the rest"""
+        while True:
+            now = time.perf_counter()
+            if self.answered_ticks.fTimeSeconds[self.index] == tick_time:
+                self.latencies.record(now - published)
+                if deadline > now:
+                    time.sleep(deadline - now)
+                return True
+            if now >= deadline:
+                return False
+            time.sleep(0)
+
+    def end_match(self):
+        self.packet_with_lock.lock = game_tick_packet_reader.REFRESH_IN_PROGRESS
+        self.packet_with_lock.gameInfo.bMatchEnded = True
+        self.packet_with_lock.gameInfo.TimeSeconds += GAME_SECONDS_PER_TICK
+        self.packet_with_lock.lock = 0
+
+    def create_report(self):
+        report = 'ticks: ' + str(self.ticks) + ' unanswered: ' + str(self.unanswered_ticks)
+        for percentile in latency_histogram.DEFAULT_PERCENTILES + [100.0]:
+            report += ' p' + str(percentile) + ': ' + str(self.latencies.get_value_at_percentile(percentile)) + 'us'
+        return report
+
+
+def run_agent(terminate_event, callback_event, name, team, index, module_name):
+    from bot_code.conversions.server_converter import ServerConverter
+    # Nothing is saved or uploaded, only the loop is measured
+    bm = bot_manager.BotManager(terminate_event, callback_event, None, name, team, index, module_name, '', False,
+                                ServerConverter('', False, False, False))
+    bm.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plays GameTickPackets into shared memory and measures how fast a '
+                                                 'bot answers, without the game.  Off windows the shared memory is '
+                                                 'backed by files in ' + shared_memory.LINUX_SHARED_MEMORY_FOLDER +
+                                                 ', set ' + shared_memory.SHARED_MEMORY_FOLDER_ENVIRONMENT_VARIABLE +
+                                                 ' to use another folder.')
+    parser.add_argument('--rate', type=float, default=DEFAULT_TICKS_PER_SECOND,
+                        help='packets written per real second, above 60 plays faster than the game')
+    parser.add_argument('--ticks', type=int, default=3600, help='how many packets are played')
+    parser.add_argument('--packets', help='a file recorded with --record, synthetic packets are used if not given')
+    parser.add_argument('--loop', action='store_true', help='play the recorded packets again once they run out')
+    parser.add_argument('--record', help='record the packets the game publishes into this file instead')
+    parser.add_argument('--seconds', type=float, default=60, help='how long to record for')
+    parser.add_argument('--agent', help='the module of an agent to run in its own process, like the runner does')
+    parser.add_argument('--name', default='Replayer', help='the name of the watched car')
+    parser.add_argument('--num-cars', type=int, default=2, help='how many cars the synthetic packets have')
+    parser.add_argument('--index', type=int, default=0, help='the index of the watched car')
+    parser.add_argument('--team', type=int, help='the team of the agent, synthetic packets put odd indexes on team 1')
+    args = parser.parse_args()
+
+    if args.record:
+        record_packets(args.record, args.seconds)
+        return
+
+    replayer = PacketReplayer(args.rate, args.index)
+    if args.packets:
+        packets = read_recorded_packets(args.packets, args.loop)
+    else:
+        names = [args.name if i == args.index else 'car' + str(i) for i in range(args.num_cars)]
+        packets = create_synthetic_packets(names)
+
+    process = None
+    if args.agent:
+        # The bot finds its car in the packet that is there when it starts
+        first_packet = next(packets)
+        replayer.publish(first_packet)
+        packets = itertools.chain([first_packet], packets)
+        team = args.team if args.team is not None else args.index % 2
+        terminate_event = mp.Event()
+        callback_event = mp.Event()
+        process = mp.Process(target=run_agent, args=(terminate_event, callback_event, args.name,
+                                                     team, args.index, args.agent))
+        process.start()
+        # Give the agent time to load, a model can take a while
+        time.sleep(5)
+
+    replayer.run(packets, args.ticks)
+    print(replayer.create_report())
+
+    if process is not None:
+        terminate_event.set()
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
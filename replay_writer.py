@@ -0,0 +1,174 @@
+import os
+import queue
+import threading
+
+from bot_code.conversions import binary_converter as compressor
+
+DEFAULT_MAX_QUEUED_BLOCKS = 8
+CLOSE_TIMEOUT_SECONDS = 30
+
+
+class ReplayWriter(threading.Thread):
+    """
+    Owns everything that touches disk or network for a recording bot.
+    The bot loop hands over finished frame blocks with submit() and never waits on the file,
+    the compression or the upload.  File rotation, compression, upload and retries happen on this thread.
+    Blocks are compressed as they are written so a finished file can be uploaded as is.
+    """
+
+    def __init__(self, game_name, name, server_manager, bot_parameters, model_hash, is_eval,
+                 upload_size=20, retry_size=10, max_queued_blocks=DEFAULT_MAX_QUEUED_BLOCKS,
+                 codec=compressor.DEFAULT_CODEC, compression_level=compressor.DEFAULT_COMPRESSION_LEVEL,
+                 file_version=compressor.get_recording_file_version()):
+        """
+        :param game_name: The folder the replay files are written to
+        :param name: The name of the bot, used as the file prefix
+        :param server_manager: The ServerConverter used to upload finished files
+        :param bot_parameters: The bot parameters, the model hash is uploaded with every file
+        :param model_hash: The hash written into the header of every file
+        :param is_eval: If the agent is evaluating, written into the header of every file
+        :param upload_size: How many blocks are written to a file before it is closed and uploaded
+        :param retry_size: How many uploads happen before failed uploads are retried
+        :param max_queued_blocks: How many blocks can wait to be written before new blocks are dropped
+        :param codec: The codec the files are compressed with, one of the binary_converter *_CODEC constants.
+            Columnar files compress each block with it, None leaves them uncompressed so they can be memory mapped
+        :param compression_level: The compression level passed to the codec
+        :param file_version: COLUMNAR_FILE_VERSION or TIME_ADDITION_FILE_VERSION for the older compressed stream
+        """
+        super().__init__(daemon=True)
+        self.game_name = game_name
+        self.name = name
+        self.server_manager = server_manager
+        self.bot_parameters = bot_parameters
+        self.model_hash = model_hash
+        self.is_eval = is_eval
+        self.upload_size = upload_size
+        self.retry_size = retry_size
+        self.codec = codec
+        self.compression_level = compression_level
+        self.file_version = file_version
+        self.block_queue = queue.Queue(maxsize=max_queued_blocks)
+        self.file_number = 1
+        self.blocks_in_file = 0
+        self.dropped_blocks = 0
+        self.game_file = None
+        self.filename = None
+
+    def submit(self, input_block, output_block):
+        """
+        Hands a finished block of frames to the writer without blocking.
+        The writer keeps a reference to the arrays so the caller must not modify them afterwards.
+        :param input_block: A flat array of recorded states
+        :param output_block: A flat array of the recorded controls
+        :return: False if the writer is backed up and the block was dropped
+        """
+        try:
+            self.block_queue.put_nowait((input_block, output_block))
+            return True
+        except queue.Full:
+            self.dropped_blocks += 1
+            print('replay writer is behind, dropped', self.dropped_blocks, 'blocks for', self.name)
+            return False
+
+    def close(self):
+        """
+        Writes everything that is still queued, uploads the last file and stops the thread.
+        Waits at most CLOSE_TIMEOUT_SECONDS for each step so a stuck writer can not hang the bot.
+        """
+        if not self.is_alive():
+            return
+        try:
+            self.block_queue.put(None, timeout=CLOSE_TIMEOUT_SECONDS)
+        except queue.Full:
+            print('replay writer for', self.name, 'is not taking blocks, not waiting for it')
+            return
+        self.join(CLOSE_TIMEOUT_SECONDS)
+        if self.is_alive():
+            print('replay writer for', self.name, 'did not finish in time')
+
+    def run(self):
+        self.open_file()
+        while True:
+            block = self.block_queue.get()
+            if block is None:
+                break
+            try:
+                self.write_block(*block)
+            except Exception as e:
+                print('failed to write replay block', e)
+        self.finish_file()
+        try:
+            self.server_manager.retry_files()
+        except Exception:
+            print('failed to retry uploading files')
+
+    def write_block(self, input_block, output_block):
+        if self.game_file is None:
+            # the file could not be created before, try again so recording picks up once it can
+            self.open_file()
+            if self.game_file is None:
+                self.dropped_blocks += 1
+                return
+        if self.file_version == compressor.COLUMNAR_FILE_VERSION:
+            self.game_file.write_frames(input_block, output_block)
+        else:
+            compressor.write_array_to_file(self.game_file, input_block)
+            compressor.write_array_to_file(self.game_file, output_block)
+        self.blocks_in_file += 1
+        if self.blocks_in_file == self.upload_size:
+            self.rotate_file()
+
+    def rotate_file(self):
+        print('adding new file and uploading')
+        self.finish_file()
+        self.file_number += 1
+        self.blocks_in_file = 0
+        self.open_file()
+        if (self.file_number - 1) % self.retry_size == 0:
+            try:
+                self.server_manager.retry_files()
+            except Exception:
+                print('failed to retry uploading files')
+
+    def open_file(self):
+        """Opens the next file, game_file stays None if it can not be created and the next block tries again"""
+        try:
+            self.filename = self.create_file_name()
+            print('creating file ' + self.filename)
+            self.create_new_file(self.filename)
+        except Exception as e:
+            print('failed to create replay file', e)
+            self.game_file = None
+
+    def finish_file(self):
+        """Closes and uploads the current file, a failed upload does not keep the next file from being opened"""
+        if self.game_file is None:
+            return
+        try:
+            self.game_file.close()
+        except Exception as e:
+            print('failed to close replay file', e)
+        self.game_file = None
+        try:
+            self.upload(self.filename)
+        except Exception as e:
+            print('failed to upload replay file', e)
+
+    def upload(self, filename):
+        self.server_manager.maybe_upload_replay(filename, self.bot_parameters['model_hash'])
+
+    def create_new_file(self, filename):
+        if self.file_version == compressor.COLUMNAR_FILE_VERSION:
+            self.game_file = compressor.ColumnarFileWriter(filename, self.model_hash, self.is_eval, codec=self.codec,
+                                                           compression_level=self.compression_level)
+            return
+        self.game_file = compressor.open_compressed_file(filename, self.codec, self.compression_level)
+        compressor.write_version_info(self.game_file, self.file_version)
+        compressor.write_bot_hash(self.game_file, self.model_hash)
+        compressor.write_is_eval(self.game_file, self.is_eval)
+
+    def create_file_name(self):
+        file_name = os.path.join(self.game_name, str(self.name).replace(" ", "") + '-' + str(self.file_number))
+        if self.file_version == compressor.COLUMNAR_FILE_VERSION:
+            return file_name + compressor.COLUMNAR_EXTENSION
+        return file_name + '.bin' + compressor.get_codec_extension(self.codec)
@@ -1,8 +1,6 @@
 import configparser
 import ctypes
 import io
-import mmap
-import msvcrt
 import multiprocessing as mp
 import os
 import sys
@@ -12,10 +10,17 @@ import time
 import bot_input_struct as bi
 import bot_manager
 import game_data_struct as gd
+import game_tick_packet_reader
 import rlbot_exception
+import shared_memory
 
 from bot_code.conversions.server_converter import ServerConverter
 
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None  # only on windows, the runner reads a line instead
+
 
 PARTICPANT_CONFIGURATION_HEADER = 'Participant Configuration'
 PARTICPANT_BOT_KEY_PREFIX = 'participant_is_bot_'
@@ -77,7 +82,7 @@ def main():
     framework_config.read(RLBOT_CONFIG_FILE)
 
     # Open anonymous shared memory for entire GameInputPacket and map buffer
-    buff = mmap.mmap(-1, ctypes.sizeof(bi.GameInputPacket), INPUT_SHARED_MEMORY_TAG)
+    buff = shared_memory.open_shared_memory(INPUT_SHARED_MEMORY_TAG, ctypes.sizeof(bi.GameInputPacket))
     gameInputPacket = bi.GameInputPacket.from_buffer(buff)
 
     # Determine number of participants
@@ -209,7 +214,7 @@ def main():
             process = mp.Process(target=run_agent,
                                  args=(quit_event, callback, bot_parameter_list[i],
                                        str(gameInputPacket.sPlayerConfiguration[i].wName),
-                                       bot_teams[i], i, bot_modules[i], save_path + '\\' + game_name,
+                                       bot_teams[i], i, bot_modules[i], os.path.join(save_path, game_name),
                                        save_data, server_manager))
             process.start()
 
@@ -218,10 +223,11 @@ def main():
 
     # Wait 100 milliseconds then check for an error code
     time.sleep(0.1)
-    game_data_shared_memory = mmap.mmap(-1, ctypes.sizeof(gd.GameTickPacketWithLock),
-                                        bot_manager.OUTPUT_SHARED_MEMORY_TAG)
-    bot_output = gd.GameTickPacketWithLock.from_buffer(game_data_shared_memory)
-    if not bot_output.iLastError == 0:
+    game_data_shared_memory = shared_memory.open_shared_memory(bot_manager.OUTPUT_SHARED_MEMORY_TAG,
+                                                               ctypes.sizeof(gd.GameTickPacketWithLock))
+    packet_reader = game_tick_packet_reader.GameTickPacketReader(game_data_shared_memory)
+    last_error = packet_reader.get_last_error()
+    if not last_error == 0:
         # Terminate all process and then raise an exception
         quit_event.set()
         terminated = False
@@ -230,10 +236,13 @@ def main():
             for callback in callbacks:
                 if not callback.is_set():
                     terminated = False
-        raise rlbot_exception.RLBotException().raise_exception_from_error_code(bot_output.iLastError)
+        raise rlbot_exception.RLBotException().raise_exception_from_error_code(last_error)
 
-    print("Press any character to exit")
-    msvcrt.getch()
+    if msvcrt is not None:
+        print("Press any character to exit")
+        msvcrt.getch()
+    else:
+        input("Press enter to exit")
 
     print("Shutting Down")
     quit_event.set()
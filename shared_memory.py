@@ -0,0 +1,63 @@
+import mmap
+import os
+import sys
+import tempfile
+
+# Set this to a folder to back the shared memory with files in it, on any platform
+SHARED_MEMORY_FOLDER_ENVIRONMENT_VARIABLE = 'RLBOT_SHARED_MEMORY_FOLDER'
+LINUX_SHARED_MEMORY_FOLDER = '/dev/shm'
+
+
+def get_shared_memory_folder():
+    """
+    :return: The folder the shared memory files are kept in,
+        None when the named mappings of windows are used
+    """
+    folder = os.environ.get(SHARED_MEMORY_FOLDER_ENVIRONMENT_VARIABLE)
+    if folder:
+        return folder
+    if sys.platform == 'win32':
+        return None
+    if os.path.isdir(LINUX_SHARED_MEMORY_FOLDER):
+        return LINUX_SHARED_MEMORY_FOLDER
+    return tempfile.gettempdir()
+
+
+def get_shared_memory_file(tag):
+    """:return: The path of the file that backs the shared memory with this tag"""
+    return os.path.join(get_shared_memory_folder(), tag.replace('\\', '_'))
+
+
+def open_shared_memory(tag, size):
+    """
+    Opens the shared memory the game and the bots talk through.
+    On windows this is the named mapping the injected dll creates.
+    Everywhere else (or when the folder environment variable is set) the tag is turned into a file
+    in /dev/shm, or the temp folder, that every process opening the same tag maps.
+    :param tag: The name of the mapping, like 'Local\\RLBotOutput'
+    :param size: The size of the mapping in bytes
+    :return: A writable mmap
+    """
+    if get_shared_memory_folder() is None:
+        return mmap.mmap(-1, size, tag)
+    file_descriptor = os.open(get_shared_memory_file(tag), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if os.fstat(file_descriptor).st_size < size:
+            os.ftruncate(file_descriptor, size)
+        return mmap.mmap(file_descriptor, size)
+    finally:
+        # The mapping keeps its own reference to the file
+        os.close(file_descriptor)
+
+
+def remove_shared_memory(tag):
+    """
+    Removes the file behind the shared memory with this tag once nothing needs it anymore.
+    Windows frees named mappings when the last handle closes, so there is nothing to do there.
+    """
+    if get_shared_memory_folder() is None:
+        return
+    try:
+        os.remove(get_shared_memory_file(tag))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,129 @@
+import time
+
+DEFAULT_SPIN_SECONDS = 0.002  # Sleeping is only trusted up to this close to a deadline, after that we spin
+DEFAULT_POLL_SECONDS = 0.0005  # How often a late tick is polled for once spinning gave up
+DEFAULT_REPORT_SECONDS = 60.0
+PERIOD_SMOOTHING = 0.1
+
+
+class TickScheduler:
+    """
+    Wakes the bot loop right after the game publishes a new GameTickPacket instead of on a fixed period.
+
+    The arrival of the next tick is predicted from the measured tick period.
+    The scheduler sleeps until shortly before that deadline, then spins on the packet's TimeSeconds
+    so the loop wakes as soon as it changes.  If the tick is late (or the game is paused) it keeps polling
+    at a low rate until it arrives or the timeout runs out.
+    All timing uses time.perf_counter.
+
+    Wake-up jitter (when the new tick was seen compared to when it was predicted) and the number of
+    ticks that were skipped entirely are collected and printed every report_seconds.
+    """
+
+    def __init__(self, read_tick_time, ticks_per_second, spin_seconds=DEFAULT_SPIN_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS, report_seconds=DEFAULT_REPORT_SECONDS, name=''):
+        """
+        :param read_tick_time: Returns the TimeSeconds of the newest packet, it is called a lot so it should be cheap
+        :param ticks_per_second: How often the game is expected to publish a packet
+        :param spin_seconds: How long before the predicted tick sleeping stops and spinning starts
+        :param poll_seconds: How long to sleep between polls once the tick is late
+        :param report_seconds: How often the stats are printed, None never prints them
+        :param name: Used in the printed stats
+        """
+        self.read_tick_time = read_tick_time
+        self.tick_seconds = 1.0 / ticks_per_second
+        self.period = self.tick_seconds
+        self.spin_seconds = spin_seconds
+        self.poll_seconds = poll_seconds
+        self.report_seconds = report_seconds
+        self.name = name
+        self.deadline = None
+        self.last_tick_wake = None
+        self.last_report = time.perf_counter()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.timeouts = 0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+
+    def wait_for_tick(self, last_tick_time, timeout):
+        """
+        Blocks until the shared packet holds a tick newer than last_tick_time.
+        :param last_tick_time: The TimeSeconds of the last tick that was handled
+        :param timeout: The most seconds to wait, the game does not publish new ticks while paused
+        :return: True if there is a new tick, False if the timeout ran out first
+        """
+        now = time.perf_counter()
+        give_up = now + timeout
+        deadline = self.deadline if self.deadline is not None else now
+        while True:
+            tick_time = self.read_tick_time()
+            now = time.perf_counter()
+            if tick_time != last_tick_time:
+                self.on_tick(now, deadline, last_tick_time, tick_time)
+                return True
+            if now >= give_up:
+                self.timeouts += 1
+                self.maybe_report(now)
+                return False
+            until_deadline = deadline - now
+            if until_deadline > self.spin_seconds:
+                # Far away from the tick, give the cpu back
+                time.sleep(min(until_deadline - self.spin_seconds, give_up - now))
+            elif until_deadline > -self.spin_seconds:
+                # Close to the tick, spin so it is seen as soon as it lands
+                time.sleep(0)
+            else:
+                # The tick is late, stop burning the cpu
+                time.sleep(min(self.poll_seconds, max(give_up - now, 0)))
+
+    def on_tick(self, now, deadline, last_tick_time, tick_time):
+        jitter = now - deadline
+        self.ticks += 1
+        self.total_jitter += abs(jitter)
+        self.max_jitter = max(self.max_jitter, abs(jitter))
+        if last_tick_time is not None:
+            skipped = int(round((tick_time - last_tick_time) / self.tick_seconds)) - 1
+            if skipped > 0:
+                self.missed_ticks += skipped
+        if self.last_tick_wake is not None:
+            interval = now - self.last_tick_wake
+            # Pauses and hitches would throw the estimate off, a game running faster than expected should not
+            if interval < 1.5 * self.period:
+                self.period += PERIOD_SMOOTHING * (interval - self.period)
+        self.last_tick_wake = now
+        self.deadline = now + self.period
+        self.maybe_report(now)
+
+    def maybe_report(self, now):
+        if self.report_seconds is None or now - self.last_report < self.report_seconds:
+            return
+        print(self.create_report())
+        self.last_report = now
+        self.reset_stats()
+
+    def create_report(self):
+        mean_jitter = self.total_jitter / self.ticks if self.ticks > 0 else 0.0
+        return ('ticks for ' + str(self.name) + ': ' + str(self.ticks) +
+                ' missed: ' + str(self.missed_ticks) +
+                ' timeouts: ' + str(self.timeouts) +
+                ' period: {:.2f}ms'.format(self.period * 1000) +
+                ' jitter mean: {:.3f}ms max: {:.3f}ms'.format(mean_jitter * 1000, self.max_jitter * 1000))
+
+
+if __name__ == '__main__':
+    # Run a scheduler test against a fake game that ticks at 60 per second
+    start = time.perf_counter()
+
+    def read_fake_tick_time():
+        return int((time.perf_counter() - start) * 60) / 60.0
+
+    scheduler = TickScheduler(read_fake_tick_time, 60, report_seconds=1.0, name='test')
+    last_tick_time = None
+    while time.perf_counter() - start < 5:
+        if scheduler.wait_for_tick(last_tick_time, 1.0 / 30):
+            last_tick_time = read_fake_tick_time()
+        time.sleep(0.005)  # Pretend to be the agent